@@ -0,0 +1,46 @@
+"""Receipt render throughput: static template rebuilt per render (old behaviour) vs built once per process.
+
+Run from api/:  python -m benchmarks.bench_receipts [-n 200] [--logo path/to/logo.png]
+"""
+import argparse, os, tempfile, time
+
+from services import receipts
+
+SAMPLE = dict(receipt_id="RCPT-2025-0001", donor_name="Alex Rivera", donation_amount=125.0, donation_date="2025-08-01",
+              designation="Shipping Fund", restricted=True, payment_method="Square", soft_credit_to="BrightTech LLC",
+              line_items=[{"designation": "Shipping Fund", "amount": 125.0}])
+
+def _synthetic_logo() -> str:
+    from PIL import Image, ImageDraw
+    im = Image.new("RGBA", (1024, 1024), (0, 0, 0, 0))
+    ImageDraw.Draw(im).ellipse((64, 64, 960, 960), fill=(255, 255, 255, 230))
+    path = os.path.join(tempfile.mkdtemp(), "logo.png"); im.save(path)
+    return path
+
+def _rate(n: int, before_each=None) -> float:
+    receipts.generate_receipt_pdf(**SAMPLE)  # warm imports and fonts
+    start = time.perf_counter()
+    for _ in range(n):
+        if before_each: before_each()
+        receipts.generate_receipt_pdf(**SAMPLE)
+    return n / (time.perf_counter() - start)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=200)
+    ap.add_argument("--logo", default=None, help="defaults to SPARK_LOGO_PATH, or a synthetic 1024px PNG if that is unreadable")
+    args = ap.parse_args()
+    logo = args.logo or receipts.LOGO_PATH
+    if receipts._prepare_logo(open(logo, "rb").read() if os.path.exists(logo) else None) is None:
+        logo = _synthetic_logo()
+    receipts.LOGO_PATH = logo
+    receipts.receipt_template.cache_clear()
+    per_render = _rate(args.n, receipts.receipt_template.cache_clear)
+    receipts.receipt_template.cache_clear()
+    cached = _rate(args.n)
+    print(f"logo: {logo}")
+    print(f"template per render : {per_render:8.1f} renders/s")
+    print(f"template per process: {cached:8.1f} renders/s  ({cached / per_render:.2f}x)")
+
+if __name__ == "__main__":
+    main()
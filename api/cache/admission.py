@@ -0,0 +1,43 @@
+import os, time, hashlib
+from typing import Tuple
+
+ADMIT_MIN_FREQ = int(os.getenv("CACHE_ADMIT_MIN_FREQ", "2"))       # requests seen before a PDF earns a Redis slot; 0 admits all
+TTL_MAX_MULT = int(os.getenv("CACHE_TTL_MAX_MULT", "4"))           # hot keys live up to this many base TTLs
+SKETCH_WINDOW_SEC = int(os.getenv("CACHE_SKETCH_WINDOW_SEC", str(7*24*3600)))
+SKETCH_DEPTH, SKETCH_WIDTH = 4, 1 << 16
+ADMISSION_STATS_KEY = b"spark:stats:admission"
+
+# Count-min sketch of request frequency kept in Redis as BITFIELD u8 counters: SKETCH_DEPTH rows of
+# SKETCH_WIDTH saturating bytes (256 KB) per window. Estimates add the current and previous window,
+# so counts age out after two windows without a decay pass. Lua helpers shared by the cache scripts:
+#   freq(cur, prev, offsets, incr)  -> min count over the rows, incrementing the current window first
+#   ttl_for(base, f, admit, maxmult) -> base TTL stretched by how far f sits above the admission bar
+SKETCH_LUA = """
+local function freq(cur, prev, offs, incr, window)
+  local est = nil
+  for o in string.gmatch(offs, '%d+') do
+    local c
+    if incr then c = redis.call('bitfield', cur, 'overflow', 'sat', 'incrby', 'u8', '#' .. o, 1)[1]
+    else c = redis.call('bitfield', cur, 'get', 'u8', '#' .. o)[1] end
+    c = c + redis.call('bitfield', prev, 'get', 'u8', '#' .. o)[1]
+    if est == nil or c < est then est = c end
+  end
+  if incr and redis.call('ttl', cur) < 0 then redis.call('expire', cur, 2 * tonumber(window)) end
+  return est
+end
+local function ttl_for(base, f, admit, maxmult)
+  return base * math.max(1, math.min(maxmult, f - math.max(admit, 1) + 1))
+end
+"""
+
+def sketch_keys() -> Tuple[bytes, bytes]:
+    w = int(time.time() // SKETCH_WINDOW_SEC)
+    return f"spark:sketch:{w}".encode(), f"spark:sketch:{w - 1}".encode()
+
+def sketch_offsets(item: str) -> str:
+    """One counter per row for item, as the '#'-style u8 offsets BITFIELD takes."""
+    h = hashlib.blake2b(item.encode(), digest_size=2 * SKETCH_DEPTH).digest()
+    return ",".join(str(row * SKETCH_WIDTH + int.from_bytes(h[2*row:2*row + 2], "little")) for row in range(SKETCH_DEPTH))
+
+def policy_args(item: str) -> list:
+    return [sketch_offsets(item), ADMIT_MIN_FREQ, TTL_MAX_MULT, SKETCH_WINDOW_SEC]
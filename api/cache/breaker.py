@@ -0,0 +1,78 @@
+import os, time, logging, threading
+from typing import Callable, Optional
+import redis
+from redis.client import Pipeline
+
+logger = logging.getLogger(__name__)
+
+BREAKER_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", "3"))      # consecutive connection failures that trip it
+BREAKER_PROBE_SEC = float(os.getenv("REDIS_BREAKER_PROBE_SEC", "2"))
+
+class RedisUnavailable(redis.ConnectionError):
+    """Raised without touching the network while the breaker is open."""
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open after `threshold` failures; a background probe closes it.
+
+    While open every call fails fast, so callers' existing `except Exception` fallbacks run
+    immediately instead of each waiting out the socket timeout.
+    """
+    def __init__(self, name: str, probe: Callable[[], object], threshold: int = BREAKER_THRESHOLD,
+                 probe_sec: float = BREAKER_PROBE_SEC):
+        self.name, self.probe, self.threshold, self.probe_sec = name, probe, threshold, probe_sec
+        self._lock = threading.Lock()
+        self.state = "closed"; self.failures = 0; self.trips = 0
+        self.opened_at: Optional[float] = None; self.last_error: Optional[str] = None
+
+    def allow(self) -> bool:
+        return self.state == "closed"
+
+    def success(self):
+        if self.failures: self.failures = 0
+
+    def failure(self, err: Exception):
+        with self._lock:
+            self.failures += 1; self.last_error = str(err)
+            if self.state == "open" or self.failures < self.threshold: return
+            self.state = "open"; self.opened_at = time.time(); self.trips += 1
+        logger.error(f"{self.name} circuit opened after {self.failures} consecutive failures: {err}")
+        threading.Thread(target=self._probe_loop, name=f"{self.name}-probe", daemon=True).start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_sec)
+            try: self.probe()
+            except Exception as e: self.last_error = str(e); continue
+            with self._lock: self.state = "closed"; self.failures = 0
+            logger.info(f"{self.name} circuit closed after {time.time() - self.opened_at:.1f}s")
+            return
+
+    def status(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips,
+                "opened_at": self.opened_at if self.state == "open" else None, "last_error": self.last_error}
+
+_CONNECTIVITY = (redis.ConnectionError, redis.TimeoutError)
+
+def _guarded(breaker: CircuitBreaker, fn, *args, **kwargs):
+    if not breaker.allow(): raise RedisUnavailable(f"{breaker.name} circuit open")
+    try: res = fn(*args, **kwargs)
+    except _CONNECTIVITY as e: breaker.failure(e); raise
+    breaker.success(); return res
+
+class BreakerPipeline(Pipeline):
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs); self.breaker = breaker
+
+    def execute(self, raise_on_error=True):
+        return _guarded(self.breaker, super().execute, raise_on_error)
+
+class BreakerRedis(redis.Redis):
+    """redis.Redis whose commands and pipelines go through a CircuitBreaker (pub/sub connections do not)."""
+    def __init__(self, *args, breaker: CircuitBreaker, **kwargs):
+        super().__init__(*args, **kwargs); self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        return _guarded(self.breaker, super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> BreakerPipeline:
+        return BreakerPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint, breaker=self.breaker)
@@ -0,0 +1,25 @@
+import os, zlib
+from typing import Optional
+
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "none").lower()  # none | zlib
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "6"))
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "512"))
+
+# 5-byte header: magic, format version, codec id. Raw PDFs start with "%PDF", so
+# values written before the codec existed (or with it off) still read back as-is.
+MAGIC = b"SPZ"
+VERSION = 1
+CODECS = {"zlib": 1}
+
+def encode(raw: bytes) -> bytes:
+    """Compresses raw behind the versioned header when enabled and worthwhile; otherwise returns raw."""
+    if CACHE_COMPRESSION not in CODECS or len(raw) < CACHE_COMPRESS_MIN_BYTES: return raw
+    packed = MAGIC + bytes((VERSION, CODECS["zlib"])) + zlib.compress(raw, CACHE_COMPRESSION_LEVEL)
+    return packed if len(packed) < len(raw) else raw
+
+def decode(stored: Optional[bytes]) -> Optional[bytes]:
+    """Inverse of encode; a header from an unknown version or codec reads as a miss."""
+    if not stored or not stored.startswith(MAGIC): return stored
+    if stored[3] != VERSION or stored[4] != CODECS["zlib"]: return None
+    try: return zlib.decompress(stored[5:])
+    except zlib.error: return None
@@ -0,0 +1,14 @@
+import os, hashlib
+from typing import Optional
+
+PDF_CACHE_CONTROL = os.getenv("PDF_CACHE_CONTROL", "private, max-age=3600, must-revalidate")
+
+def pdf_etag(pdf: bytes) -> str:
+    """Strong ETag over the PDF bytes; rendering is deterministic, so equal inputs give equal tags."""
+    return '"' + hashlib.sha256(pdf).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    if not if_none_match or not etag: return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so a W/ prefix on the client's copy still matches
+    return "*" in tags or any((t[2:] if t.startswith("W/") else t) == etag for t in tags)
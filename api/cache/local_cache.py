@@ -0,0 +1,52 @@
+import time, threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Hashable, Callable
+
+class LocalLRU:
+    """Thread-safe in-process LRU bounded by total value bytes, with a per-entry expiry.
+
+    Values are (pdf, etag) pairs; only the PDF length counts towards max_bytes. Entries
+    larger than max_item_bytes are never admitted so one huge statement can't flush the tier.
+    """
+    def __init__(self, max_bytes: int, max_item_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes // 4
+        self._d: "OrderedDict[Hashable, Tuple[float, bytes, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0; self.hits = 0; self.misses = 0; self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Optional[str]]]:
+        with self._lock:
+            e = self._d.get(key)
+            if e is None: self.misses += 1; return None
+            if e[0] <= time.monotonic():
+                self._drop(key); self.misses += 1; return None
+            self._d.move_to_end(key); self.hits += 1
+            return e[1], e[2]
+
+    def set(self, key: Hashable, value: bytes, etag: Optional[str], ttl: float):
+        if self.max_bytes <= 0 or ttl <= 0 or len(value) > self.max_item_bytes: self.pop(key); return
+        with self._lock:
+            if key in self._d: self._drop(key)
+            self._d[key] = (time.monotonic() + ttl, value, etag); self.bytes += len(value)
+            while self.bytes > self.max_bytes and self._d:
+                self._drop(next(iter(self._d))); self.evictions += 1
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            if key in self._d: self._drop(key)
+
+    def pop_where(self, pred: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [k for k in self._d if pred(k)]: self._drop(key)
+
+    def clear(self):
+        with self._lock: self._d.clear(); self.bytes = 0
+
+    def _drop(self, key: Hashable):
+        self.bytes -= len(self._d.pop(key)[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._d), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
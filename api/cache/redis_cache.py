@@ -1,6 +1,13 @@
-import os, json
-from typing import Optional
+import os, json, time, socket, logging, threading
+from typing import Optional, Tuple, Iterable, List, Dict
 import redis
+from cache.etag import pdf_etag
+from cache.local_cache import LocalLRU
+from cache.codec import encode, decode, CACHE_COMPRESSION
+from cache.breaker import CircuitBreaker, BreakerRedis
+from cache.admission import SKETCH_LUA, ADMISSION_STATS_KEY, ADMIT_MIN_FREQ, TTL_MAX_MULT, sketch_keys, policy_args
+
+logger = logging.getLogger(__name__)
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
@@ -8,25 +15,318 @@ SOCKET_TIMEOUT = int(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
 DEFAULT_RECEIPT_TTL = int(os.getenv("RECEIPT_TTL_SEC", str(30*24*3600)))
 DEFAULT_STATEMENT_TTL = int(os.getenv("STATEMENT_TTL_SEC", str(90*24*3600)))
 _pool = redis.ConnectionPool.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, socket_timeout=SOCKET_TIMEOUT)
-r = redis.Redis(connection_pool=_pool)
+# one breaker for every Redis caller in the process (this module, webhooks.security, the background jobs)
+breaker = CircuitBreaker("redis", probe=lambda: redis.Redis(connection_pool=_pool).ping())
+r = BreakerRedis(connection_pool=_pool, breaker=breaker)
+
+LOCAL_CACHE_MAX_BYTES = int(os.getenv("LOCAL_CACHE_MAX_BYTES", str(64*1024*1024)))  # 0 disables the in-process tier
+INVALIDATE_CHANNEL = os.getenv("CACHE_INVALIDATE_CHANNEL", "spark:cache:invalidate")
+_TTL = {"receipt": DEFAULT_RECEIPT_TTL, "statement": DEFAULT_STATEMENT_TTL}
+_local = LocalLRU(LOCAL_CACHE_MAX_BYTES)
+_listener_pid = 0
+_listener_lock = threading.Lock()
+_subscribed = threading.Event()
+
+CODEC_STATS_KEY = b"spark:stats:codec"
+PREWARMED_KEY = b"spark:prewarmed"          # zset of pre-rendered keys not yet requested, scored by expiry
+PREWARM_STATS_KEY = b"spark:stats:prewarm"
+BULK_CHUNK = int(os.getenv("REDIS_BULK_CHUNK", "500"))   # keys per round trip in the bulk helpers
+
+# Cache keys carry the version of the record they were rendered from: spark:receipt:{donation_id}:v{n}
+# reads spark:ver:donation:{donation_id}, spark:statement:{donor_id}:{year}:v{n} reads spark:ver:donor:{donor_id}.
+# Bumping a counter orphans every older PDF at once; the orphans just age out under their TTL.
+# Callers read the counters first and hand the scripts the versioned key names in KEYS; each script
+# re-checks its counter, so a bump in between turns the call into a miss (or an unstored write).
+# Reads count towards the admission sketch; a hit on a key that has grown hot stretches its TTL.
+_READ = r.register_script(SKETCH_LUA + """
+if (redis.call('get', KEYS[1]) or '0') ~= ARGV[1] then return {false, false, -2} end
+local f = freq(KEYS[6], KEYS[7], ARGV[4], ARGV[8] == '1', ARGV[7])
+local pdf = false
+if ARGV[2] == '1' then
+  pdf = redis.call('get', KEYS[2])
+  -- the first read of a pre-rendered PDF is a render the warm-up job saved
+  if pdf and redis.call('zrem', KEYS[4], KEYS[2]) == 1 then redis.call('hincrby', KEYS[5], 'avoided', 1) end
+end
+local pttl = redis.call('pttl', KEYS[2])
+local want = ttl_for(tonumber(ARGV[3]), f, tonumber(ARGV[5]), tonumber(ARGV[6])) * 1000
+if pttl >= 0 and pttl < want and want > tonumber(ARGV[3]) * 1000 then
+  redis.call('pexpire', KEYS[2], want); redis.call('pexpire', KEYS[3], want); pttl = want
+end
+return {pdf, redis.call('get', KEYS[3]), pttl}
+""")
+# Writes pass the admission bar (mode 0) unless pre-rendered (1) or forced (2); returns the TTL used,
+# -1 if rejected, or -2 if the record's version moved since the caller read it. A rejected PDF still
+# leaves its ETag, so a client that fetched it once can revalidate with a 304 instead of a re-download.
+_WRITE = r.register_script(SKETCH_LUA + """
+if (redis.call('get', KEYS[1]) or '0') ~= ARGV[1] then return -2 end
+local f = freq(KEYS[5], KEYS[6], ARGV[6], false, ARGV[9])
+if ARGV[5] == '0' and f < tonumber(ARGV[7]) then
+  redis.call('setex', KEYS[3], tonumber(ARGV[2]), ARGV[4])
+  redis.call('hincrby', KEYS[7], 'rejected', 1); redis.call('hincrby', KEYS[7], 'bytes_saved', string.len(ARGV[3]))
+  return -1
+end
+local ttl = tonumber(ARGV[2])
+if ARGV[5] ~= '1' then ttl = ttl_for(ttl, f, tonumber(ARGV[7]), tonumber(ARGV[8])) end
+redis.call('setex', KEYS[2], ttl, ARGV[3])
+redis.call('setex', KEYS[3], ttl, ARGV[4])
+redis.call('hincrby', KEYS[7], 'admitted', 1)
+if ARGV[5] == '1' then
+  redis.call('zadd', KEYS[4], tonumber(redis.call('time')[1]) + ttl, KEYS[2])
+end
+return ttl
+""")
+# Conditional GETs read just the ETag: no sketch count, no TTL stretch, no PDF fetch
+_ETAG = r.register_script("""
+if (redis.call('get', KEYS[1]) or '0') ~= ARGV[1] then return false end
+return redis.call('get', KEYS[2])
+""")
+# KEYS: n versioned PDF keys, their n counters, then the prewarm zset and stats; ARGV: the n versions read
+_MGET = r.register_script("""
+local n = #ARGV
+local out = {}
+for i = 1, n do
+  local pdf = false
+  if (redis.call('get', KEYS[n + i]) or '0') == ARGV[i] then pdf = redis.call('get', KEYS[i]) end
+  if pdf and redis.call('zrem', KEYS[2 * n + 1], KEYS[i]) == 1 then redis.call('hincrby', KEYS[2 * n + 2], 'avoided', 1) end
+  out[i] = pdf
+end
+return out
+""")
+_EXISTS = r.register_script("""
+local n = #ARGV
+local out = {}
+for i = 1, n do
+  out[i] = 0
+  if (redis.call('get', KEYS[n + i]) or '0') == ARGV[i] then out[i] = redis.call('exists', KEYS[i]) end
+end
+return out
+""")
 
 def _bkey(kind: str, key: str) -> bytes: return f"spark:{kind}:{key}".encode()
+def _vkey(kind: str, key: str) -> bytes:
+    # receipts follow their donation, statements their donor (the part of the key before :year)
+    return f"spark:ver:donation:{key}".encode() if kind == "receipt" else f"spark:ver:donor:{key.rsplit(':', 1)[0]}".encode()
+def _versions(kind: str, keys: List[str], client=None) -> List[bytes]:
+    return [v or b"0" for v in (client or r).mget([_vkey(kind, k) for k in keys])]
+def _at(base: bytes, version: bytes) -> bytes: return base + b":v" + version
+def _codec_stats() -> dict:
+    # cumulative over every PDF written by any worker since the counters were created
+    raw = {k.decode(): int(v) for k, v in (r.hgetall(CODEC_STATS_KEY) or {}).items()}
+    written, stored = raw.get("raw_bytes", 0), raw.get("stored_bytes", 0)
+    return {"codec": CACHE_COMPRESSION, "writes": raw.get("writes", 0), "raw_bytes": written, "stored_bytes": stored,
+            "ratio": round(stored / written, 3) if written else None}
+def redis_health() -> dict:
+    return {"url": REDIS_URL.split("@")[-1], "breaker": breaker.status()}
 def cache_stats() -> dict:
-    try: info = r.info(); return {"used_memory": info.get("used_memory_human"), "hits": info.get("keyspace_hits"), "misses": info.get("keyspace_misses")}
-    except Exception: return {"status": "redis_unavailable"}
+    out = {"local": dict(_local.stats(), subscribed=_subscribed.is_set()), "breaker": breaker.state}
+    try: info = r.info(); out.update(used_memory=info.get("used_memory_human"), hits=info.get("keyspace_hits"), misses=info.get("keyspace_misses"))
+    except Exception: out["status"] = "redis_unavailable"
+    try: out["payload"] = _codec_stats()
+    except Exception: pass
+    try:
+        adm = {k.decode(): int(v) for k, v in (r.hgetall(ADMISSION_STATS_KEY) or {}).items()}
+        out["admission"] = {"admit_min_freq": ADMIT_MIN_FREQ, "ttl_max_mult": TTL_MAX_MULT, "admitted": adm.get("admitted", 0),
+                            "rejected": adm.get("rejected", 0), "bytes_saved": adm.get("bytes_saved", 0)}
+    except Exception: pass
+    return out
 
-def get_cached_receipt_pdf(donation_id: str) -> Optional[bytes]:
-    try: return r.get(_bkey("receipt", donation_id))
-    except Exception: return None
+def _node() -> str: return f"{socket.gethostname()}:{os.getpid()}"
+
+def _listen():
+    """Drops local entries that another worker rewrote or invalidated; runs as a daemon thread per process."""
+    while True:
+        ps = None
+        if not breaker.allow():
+            _subscribed.clear(); _local.clear(); time.sleep(1); continue
+        try:
+            ps = r.pubsub(ignore_subscribe_messages=True); ps.subscribe(INVALIDATE_CHANNEL)
+            # anything published while we were not subscribed is lost, so start from an empty tier
+            _local.clear(); _subscribed.set()
+            while True:
+                m = ps.get_message(timeout=1.0)
+                if not m: continue
+                msg = json.loads(m["data"])
+                if msg.get("node") != _node(): _drop_local(msg)
+        except Exception as e:
+            _subscribed.clear(); _local.clear()
+            logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+            time.sleep(1)
+        finally:
+            try: ps and ps.close()
+            except Exception: pass
+
+def _ensure_listener():
+    global _listener_pid
+    if _listener_pid == os.getpid() or LOCAL_CACHE_MAX_BYTES <= 0: return
+    with _listener_lock:
+        if _listener_pid != os.getpid():  # re-arm after fork; threads don't survive it
+            _listener_pid = os.getpid(); _subscribed.clear(); _local.clear()
+            threading.Thread(target=_listen, name="cache-invalidate", daemon=True).start()
 
-def cache_receipt_pdf(donation_id: str, pdf: bytes, ttl: int = DEFAULT_RECEIPT_TTL):
-    try: r.setex(_bkey("receipt", donation_id), ttl, pdf)
+def _drop_local(msg: dict):
+    kind = msg["kind"]
+    if "prefix" in msg: _local.pop_where(lambda k: k[0] == kind and k[1].startswith(msg["prefix"]))
+    else: _local.pop((kind, msg["key"]))
+
+def _publish(kind: str, key: str, prefix: bool = False, client=None):
+    try: (client or r).publish(INVALIDATE_CHANNEL, json.dumps({"node": _node(), "kind": kind, "prefix" if prefix else "key": key}))
     except Exception: pass
 
-def get_cached_statement_pdf(donor_id: str, year: int) -> Optional[bytes]:
-    try: return r.get(_bkey("statement", f"{donor_id}:{year}"))
+def _get_local(kind: str, key: str) -> Optional[Tuple[bytes, Optional[str]]]:
+    # a local copy is only trusted while we're subscribed to invalidations
+    _ensure_listener()
+    return _local.get((kind, key)) if _subscribed.is_set() else None
+
+def _read(kind: str, key: str, fetch: bool, count: bool = True):
+    v = _versions(kind, [key])[0]
+    return _READ(keys=[_vkey(kind, key), _at(_bkey(kind, key), v), _at(_bkey(f"etag:{kind}", key), v),
+                       PREWARMED_KEY, PREWARM_STATS_KEY, *sketch_keys()],
+                 args=[v, int(fetch), _TTL[kind], *policy_args(f"{kind}:{key}"), int(count)], client=r)
+
+def _get_pdf(kind: str, key: str, count: bool = True) -> Optional[bytes]:
+    hit = _get_local(kind, key)
+    if hit: return hit[0]
+    try: stored, etag, pttl = _read(kind, key, True, count)
     except Exception: return None
+    pdf = decode(stored)
+    if pdf:
+        ttl = _TTL[kind] if pttl is None or pttl < 0 else min(_TTL[kind], pttl / 1000)  # local copies never stretch
+        _local.set((kind, key), pdf, etag.decode() if etag else None, ttl)
+    return pdf
+
+def _set_many(kind: str, pdfs: Dict[str, bytes], ttl: int, prewarmed: bool = False, force: bool = False):
+    """Writes PDFs, ETags and codec counters for many keys in one pipeline per BULK_CHUNK keys.
+
+    Each write is checked against the admission sketch inside the script; rejected keys are simply
+    not stored. prewarmed writes are always admitted at the base TTL, force skips the bar.
+    """
+    items = list(pdfs.items()); mode = 1 if prewarmed else 2 if force else 0
+    sk = list(sketch_keys())
+    for i in range(0, len(items), BULK_CHUNK):
+        part, etags, sizes = items[i:i+BULK_CHUNK], {}, {}
+        versions = _versions(kind, [key for key, _ in part])
+        p = r.pipeline(transaction=False)
+        for (key, pdf), v in zip(part, versions):
+            # the ETag lives beside the PDF so conditional GETs can answer 304 without fetching the bytes
+            etag, stored = pdf_etag(pdf), encode(pdf)
+            _WRITE(keys=[_vkey(kind, key), _at(_bkey(kind, key), v), _at(_bkey(f"etag:{kind}", key), v),
+                         PREWARMED_KEY, *sk, ADMISSION_STATS_KEY],
+                   args=[v, ttl, stored, etag, mode, *policy_args(f"{kind}:{key}")], client=p)
+            etags[key], sizes[key] = etag, len(stored)
+        res = p.execute()
+        admitted = [(key, pdf) for (key, pdf), used in zip(part, res) if int(used) >= 0]
+        p = r.pipeline(transaction=False)
+        for key, _ in admitted: _publish(kind, key, client=p)
+        p.hincrby(CODEC_STATS_KEY, "writes", len(admitted))
+        p.hincrby(CODEC_STATS_KEY, "raw_bytes", sum(len(pdf) for _, pdf in admitted))
+        p.hincrby(CODEC_STATS_KEY, "stored_bytes", sum(sizes[key] for key, _ in admitted))
+        p.execute()
+        _ensure_listener()
+        for key, pdf in admitted:
+            # pre-rendered and bulk-written PDFs may never be asked for, so they don't displace the hot set in memory
+            if prewarmed or len(items) > 1: _local.pop((kind, key))
+            else: _local.set((kind, key), pdf, etags[key], min(ttl, _TTL[kind]))
+
+def _set_pdf(kind: str, key: str, pdf: bytes, ttl: int, prewarmed: bool = False, force: bool = False):
+    _set_many(kind, {key: pdf}, ttl, prewarmed, force)
+
+def _get_many(kind: str, keys: List[str]) -> Dict[str, bytes]:
+    """Current-version PDFs for the keys that are cached: local tier first, then one scripted read per BULK_CHUNK."""
+    out: Dict[str, bytes] = {}; remote = []
+    for key in dict.fromkeys(keys):
+        hit = _get_local(kind, key)
+        if hit: out[key] = hit[0]
+        else: remote.append(key)
+    for i in range(0, len(remote), BULK_CHUNK):
+        part = remote[i:i+BULK_CHUNK]
+        try:
+            versions = _versions(kind, part)
+            vals = _MGET(keys=[_at(_bkey(kind, k), v) for k, v in zip(part, versions)] + [_vkey(kind, k) for k in part]
+                         + [PREWARMED_KEY, PREWARM_STATS_KEY], args=versions, client=r)
+        except Exception: return out
+        for key, stored in zip(part, vals):
+            pdf = decode(stored)
+            if pdf: out[key] = pdf
+    return out
+
+def _exists_many(kind: str, keys: List[str]) -> List[bool]:
+    """Whether the current version of each key is in Redis, one scripted round trip per BULK_CHUNK."""
+    out: List[bool] = []
+    for i in range(0, len(keys), BULK_CHUNK):
+        part = keys[i:i+BULK_CHUNK]
+        versions = _versions(kind, part)
+        out += [bool(x) for x in _EXISTS(keys=[_at(_bkey(kind, k), v) for k, v in zip(part, versions)] + [_vkey(kind, k) for k in part],
+                                         args=versions, client=r)]
+    return out
 
-def cache_statement_pdf(donor_id: str, year: int, pdf: bytes, ttl: int = DEFAULT_STATEMENT_TTL):
-    try: r.setex(_bkey("statement", f"{donor_id}:{year}"), ttl, pdf)
+def prewarm_stats() -> dict:
+    now = int(time.time())
+    p = r.pipeline(transaction=False)
+    p.zremrangebyscore(PREWARMED_KEY, "-inf", now); p.zcard(PREWARMED_KEY); p.hget(PREWARM_STATS_KEY, "avoided")
+    _, pending, avoided = p.execute()
+    return {"renders_avoided": int(avoided or 0), "prewarmed_unrequested": pending}
+
+def bump_versions(donation_ids: Iterable[str] = (), donor_ids: Iterable[str] = ()):
+    """Invalidates every cached receipt of donation_ids and every statement year of donor_ids in O(1) each."""
+    donation_ids, donor_ids = [d for d in donation_ids if d], [d for d in donor_ids if d]
+    if not (donation_ids or donor_ids): return
+    for d in donation_ids: _local.pop(("receipt", d))
+    for d in donor_ids: _local.pop_where(lambda k, p=f"{d}:": k[0] == "statement" and k[1].startswith(p))
+    try:
+        p = r.pipeline(transaction=False)
+        for d in donation_ids: p.incr(_vkey("receipt", d)); _publish("receipt", d, client=p)
+        for d in donor_ids: p.incr(_vkey("statement", f"{d}:")); _publish("statement", f"{d}:", prefix=True, client=p)
+        p.execute()
+    except Exception as e: logger.warning(f"Failed to bump cache versions: {str(e)}")
+
+def _get_etag(kind: str, key: str) -> Optional[str]:
+    hit = _get_local(kind, key)
+    if hit and hit[1]: return hit[1]
+    try:
+        v = _versions(kind, [key])[0]
+        etag = _ETAG(keys=[_vkey(kind, key), _at(_bkey(f"etag:{kind}", key), v)], args=[v], client=r)
+        return etag.decode() if etag else None
+    except Exception: return None
+
+def get_cached_receipt_pdf(donation_id: str, count: bool = True) -> Optional[bytes]:
+    """count=False peeks without counting as a request (re-checks and polls while another worker renders)."""
+    return _get_pdf("receipt", donation_id, count)
+
+def get_receipt_etag(donation_id: str) -> Optional[str]:
+    return _get_etag("receipt", donation_id)
+
+def cache_receipt_pdf(donation_id: str, pdf: bytes, ttl: int = DEFAULT_RECEIPT_TTL, prewarmed: bool = False):
+    try: _set_pdf("receipt", donation_id, pdf, ttl, prewarmed)
+    except Exception: pass
+
+def get_cached_statement_pdf(donor_id: str, year: int, count: bool = True) -> Optional[bytes]:
+    return _get_pdf("statement", f"{donor_id}:{year}", count)
+
+def get_statement_etag(donor_id: str, year: int) -> Optional[str]:
+    return _get_etag("statement", f"{donor_id}:{year}")
+
+def cache_statement_pdf(donor_id: str, year: int, pdf: bytes, ttl: int = DEFAULT_STATEMENT_TTL, prewarmed: bool = False):
+    try: _set_pdf("statement", f"{donor_id}:{year}", pdf, ttl, prewarmed)
     except Exception: pass
+
+# Bulk variants for batch jobs: a handful of round trips for thousands of keys. Reads return only the hits.
+def get_cached_receipts(donation_ids: Iterable[str]) -> Dict[str, bytes]:
+    return _get_many("receipt", list(donation_ids))
+
+def cache_receipts(pdfs: Dict[str, bytes], ttl: int = DEFAULT_RECEIPT_TTL, prewarmed: bool = False):
+    try: _set_many("receipt", pdfs, ttl, prewarmed)
+    except Exception as e: logger.warning(f"Bulk receipt cache write failed: {str(e)}")
+
+def receipts_cached(donation_ids: List[str]) -> List[bool]:
+    return _exists_many("receipt", donation_ids)
+
+def get_cached_statements(donor_ids: Iterable[str], year: int) -> Dict[str, bytes]:
+    return {k.rsplit(":", 1)[0]: v for k, v in _get_many("statement", [f"{d}:{year}" for d in donor_ids]).items()}
+
+def cache_statements(year: int, pdfs: Dict[str, bytes], ttl: int = DEFAULT_STATEMENT_TTL, prewarmed: bool = False,
+                     force: bool = False):
+    try: _set_many("statement", {f"{d}:{year}": pdf for d, pdf in pdfs.items()}, ttl, prewarmed, force)
+    except Exception as e: logger.warning(f"Bulk statement cache write failed: {str(e)}")
+
+def statements_cached(donor_ids: List[str], year: int) -> List[bool]:
+    return _exists_many("statement", [f"{d}:{year}" for d in donor_ids])
@@ -0,0 +1,84 @@
+import os, time, uuid, logging, threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+from cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+FLIGHT_LOCK_MS = int(os.getenv("FLIGHT_LOCK_MS", "35000"))      # covers RENDER_TIMEOUT_SEC plus caching
+FLIGHT_WAIT_SEC = float(os.getenv("FLIGHT_WAIT_SEC", "35"))
+FLIGHT_POLL_SEC = float(os.getenv("FLIGHT_POLL_SEC", "0.05"))
+
+# compare-and-delete so a leader whose lock already expired can't release the next leader's
+_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+_flights: Dict[str, Future] = {}
+_flights_lock = threading.Lock()
+stats = {"leaders": 0, "joined": 0, "remote_waits": 0, "remote_hits": 0}
+
+def _lock_key(key: str) -> bytes: return f"spark:lock:{key}".encode()
+
+def _acquire(key: str, token: str) -> Optional[bool]:
+    """True if we hold the cross-worker lock, False if someone else does, None if Redis is unreachable."""
+    try: return bool(redis_cache.r.set(_lock_key(key), token, nx=True, px=FLIGHT_LOCK_MS))
+    except Exception: return None
+
+def _release(key: str, token: str):
+    try: redis_cache.r.eval(_RELEASE, 1, _lock_key(key), token)
+    except Exception: pass
+
+def _lead(key: str, load: Callable[[], Optional[bytes]], build: Callable[[], bytes],
+          save: Callable[[bytes], None]) -> Tuple[bytes, bool]:
+    # load here is the caller's peek: re-checks and polls must not count as fresh requests
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + FLIGHT_WAIT_SEC
+    while True:
+        held = _acquire(key, token)
+        if held is not False: break
+        # another worker is rendering: wait for its result to land in the cache
+        stats["remote_waits"] += 1
+        while time.monotonic() < deadline:
+            time.sleep(FLIGHT_POLL_SEC)
+            pdf = load()
+            if pdf: stats["remote_hits"] += 1; return pdf, True
+            try:
+                if not redis_cache.r.exists(_lock_key(key)): break  # holder gave up without caching
+            except Exception: break
+        else:
+            logger.warning(f"Gave up waiting on render lock for {key}; rendering locally")
+            held = None; break
+    try:
+        if held:
+            pdf = load()  # the previous holder may have finished between our miss and the lock
+            if pdf: return pdf, True
+        pdf = build()
+        try: save(pdf)
+        except Exception as e: logger.warning(f"Failed to cache {key}: {str(e)}")
+        return pdf, False
+    finally:
+        if held: _release(key, token)
+
+def single_flight(key: str, load: Callable[[], Optional[bytes]], build: Callable[[], bytes],
+                  save: Callable[[bytes], None], peek: Optional[Callable[[], Optional[bytes]]] = None) -> Tuple[bytes, bool]:
+    """Returns (pdf, hit) for key, running build() at most once across concurrent callers.
+
+    Callers in this process share one Future; across workers a short Redis lock elects the
+    renderer and the others poll the cache for its result. load() is the cache read,
+    save() the cache write; both should swallow their own Redis errors. peek() (default load)
+    is used for the re-checks and polls after the first miss.
+    """
+    pdf = load()
+    if pdf: return pdf, True
+    with _flights_lock:
+        fut = _flights.get(key); leader = fut is None
+        if leader: fut = _flights[key] = Future()
+    if not leader:
+        stats["joined"] += 1
+        return fut.result(timeout=FLIGHT_WAIT_SEC + FLIGHT_LOCK_MS / 1000)
+    stats["leaders"] += 1
+    try:
+        res = _lead(key, peek or load, build, save); fut.set_result(res); return res
+    except BaseException as e:
+        fut.set_exception(e); raise
+    finally:
+        with _flights_lock: _flights.pop(key, None)
@@ -13,8 +13,14 @@ from routes.statements import router as statements_router
 from routes.reconciliation import router as reconciliation_router
 from routes.data_room import router as data_room_router
 from routes.health_metrics import router as health_router
+from routes.exports import router as exports_router
 from webhooks.square import router as square_router
 from auth import router as auth_router
+from services.render_pool import shutdown_pool
+from services.datastore import on_data_change
+from cache.redis_cache import bump_versions
+from services.prewarm import prewarm_after_ingest
+from services.outbox import get_outbox
 
 # Configure logging
 logging.basicConfig(
@@ -28,13 +34,21 @@ ENVIRONMENT = os.getenv("ENV", "local")
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "*").split(",")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
+# reloads of donations.csv/donors.csv retire the cached PDFs of exactly the records that changed
+on_data_change(bump_versions)
+on_data_change(prewarm_after_ingest)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info(f"SparkCreatives API starting up - Environment: {ENVIRONMENT}")
+    # drain emails left queued by a previous instance
+    get_outbox().start()
     yield
     # Shutdown  
     logger.info("SparkCreatives API shutting down")
+    get_outbox().stop()
+    shutdown_pool()
 
 app = FastAPI(
     title="SparkCreatives Cloud Run API",
@@ -109,6 +123,7 @@ api_v1.include_router(receipts_router, tags=["receipts"])
 api_v1.include_router(statements_router, tags=["statements"]) 
 api_v1.include_router(reconciliation_router, tags=["reconciliation"])
 api_v1.include_router(data_room_router, tags=["data-room"])
+api_v1.include_router(exports_router, tags=["exports"])
 
 # Webhook routes (no auth required)
 api_v1.include_router(square_router, prefix="/webhooks/square", tags=["webhooks-square"])
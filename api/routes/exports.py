@@ -0,0 +1,81 @@
+import os, io, logging, zipfile
+from concurrent.futures import as_completed, TimeoutError as FutureTimeout
+from typing import Iterator, List, Tuple
+from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
+from services.datastore import get_store
+from services.receipts import receipt_args, receipt_id_for
+from services.render_pool import submit_receipt_pdf, RENDER_TIMEOUT_SEC
+from cache.redis_cache import get_cached_receipts, cache_receipts
+from auth import require_user, User
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "64"))
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink: zipfile streams into it and we drain it after every entry."""
+    def __init__(self):
+        self.buf = bytearray()
+    def writable(self): return True
+    def write(self, b):
+        self.buf += b; return len(b)
+    def drain(self) -> bytes:
+        out = bytes(self.buf); self.buf.clear(); return out
+
+def _entry(zf: zipfile.ZipFile, name: str, date: str, data: bytes):
+    try: y, m, d = (int(x) for x in date[:10].split("-"))
+    except ValueError: y, m, d = 1980, 1, 1
+    zf.writestr(zipfile.ZipInfo(name, (max(y, 1980), m, d, 0, 0, 0)), data)
+
+def _entries(rows: List[dict]) -> Iterator[Tuple[dict, bytes]]:
+    """Yields (row, pdf) per donation: cached PDFs first, then fresh renders as they finish on the pool."""
+    store = get_store(); pending = {}; fresh = {}
+    cached = get_cached_receipts(r["donation_id"] for r in rows)
+    for row in rows:
+        if row["donation_id"] in cached: yield row, cached[row["donation_id"]]; continue
+        donor = store.donor(row.get("donor_id", ""))
+        pending[submit_receipt_pdf(**receipt_args(row, donor))] = row
+    done = set()
+    try:
+        for fut in as_completed(pending, timeout=RENDER_TIMEOUT_SEC * max(1, len(pending))):
+            done.add(fut); row = pending[fut]
+            try: pdf = fut.result()
+            except Exception as e:
+                logger.warning(f"Export render failed for donation {row['donation_id']}: {str(e)}")
+                yield row, b""; continue
+            fresh[row["donation_id"]] = pdf
+            yield row, pdf
+    except FutureTimeout:
+        for fut, row in pending.items():
+            if fut not in done: fut.cancel(); yield row, b""
+    if fresh: cache_receipts(fresh)
+
+def stream_receipts_zip(rows: List[dict]) -> Iterator[bytes]:
+    sink = _ChunkSink(); failed = []
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i in range(0, len(rows), EXPORT_CHUNK):
+            for row, pdf in _entries(rows[i:i+EXPORT_CHUNK]):
+                if not pdf: failed.append(row["donation_id"]); continue
+                date = row.get("received_at") or ""
+                _entry(zf, f"{date[:10] or 'undated'}_{receipt_id_for(row)}.pdf", date, pdf)
+                yield sink.drain()
+        if failed:
+            zf.writestr("errors.txt", "Receipts that failed to render:\n" + "\n".join(failed) + "\n")
+    yield sink.drain()
+
+@router.get("/exports/receipts.zip")
+def export_receipts(
+    org_id: str = Query(..., description="Organization to export"),
+    start: str = Query("0000-01-01", description="Inclusive received_at lower bound (ISO date)"),
+    end: str = Query("9999-12-31", description="Exclusive received_at upper bound (ISO date)"),
+    current_user: User = Depends(require_user)
+):
+    """Stream every receipt for an org and date range as a ZIP archive"""
+    if start >= end: raise HTTPException(400, "start must be before end")
+    rows = [r for r in get_store().donations_between(start, end, org_id=org_id) if r.get("donation_id")]
+    if not rows: raise HTTPException(404, "No donations in range")
+    logger.info(f"User {current_user.username} exporting {len(rows)} receipts for org {org_id} [{start}, {end})")
+    return StreamingResponse(stream_receipts_zip(rows), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="receipts-{org_id}-{start}-{end}.zip"'})
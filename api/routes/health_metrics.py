@@ -1,14 +1,22 @@
 from fastapi import APIRouter
 import os, time
+from services.render_pool import pool_status
+from cache.single_flight import stats as flight_stats
+from cache.redis_cache import redis_health
+from services.emailer import email_metrics
+from services.outbox import outbox_metrics
 router = APIRouter()
 @router.get("/health")
 def health():
     checks = {"env": os.getenv("ENV","local"), "email_provider": os.getenv("EMAIL_PROVIDER","not-set"),
               "logo_exists": os.path.exists(os.getenv("SPARK_LOGO_PATH","/app/assets/logo.png"))}
-    return {"status":"ok","checks":checks}
+    checks["redis"] = redis_health()
+    # Redis is a cache here: an open breaker degrades latency and dedupe, not correctness
+    return {"status": "ok" if checks["redis"]["breaker"]["state"] == "closed" else "degraded", "checks": checks}
 START = time.time()
 COUNTERS = {"receipts_generated": 0, "emails_sent": 0}
 @router.get("/metrics")
 def metrics():
     uptime = time.time() - START
-    return {"uptime_seconds": int(uptime), **COUNTERS}
+    return {"uptime_seconds": int(uptime), **COUNTERS, "render_pool": pool_status(), "single_flight": dict(flight_stats),
+            "email": email_metrics(), "outbox": outbox_metrics()}
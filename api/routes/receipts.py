@@ -1,13 +1,48 @@
 import logging
-from fastapi import APIRouter, HTTPException, Response, Depends
-from services.receipts import find_donation, find_donor, generate_receipt_pdf, line_items_from_row
-from services.emailer import send_email
-from cache.redis_cache import get_cached_receipt_pdf, cache_receipt_pdf
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException, Response, Depends, Header
+from services.receipts import find_donation, find_donor, receipt_args
+from services.render_pool import render_receipt_pdf, RenderError, RenderTimeout
+from services.outbox import get_outbox, register_attachment
+from cache.redis_cache import get_cached_receipt_pdf, cache_receipt_pdf, get_receipt_etag
+from cache.etag import pdf_etag, etag_matches, PDF_CACHE_CONTROL
+from cache.single_flight import single_flight
 from auth import require_user, User
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _render(dn: dict, donor: dict, rid: str) -> bytes:
+    try:
+        return render_receipt_pdf(**receipt_args(dn, donor))
+    except RenderTimeout:
+        logger.error(f"Receipt render timed out for {rid}")
+        raise HTTPException(503, "Receipt rendering timed out")
+    except RenderError as e:
+        logger.error(f"Receipt render unavailable for {rid}: {str(e)}")
+        raise HTTPException(503, "Receipt rendering unavailable")
+
+def _receipt_pdf(donation_id: str, dn: dict, donor: dict, rid: str) -> Tuple[bytes, bool]:
+    """Cached receipt or one coalesced render shared by every concurrent miss; returns (pdf, hit)."""
+    try:
+        return single_flight(f"receipt:{donation_id}", lambda: get_cached_receipt_pdf(donation_id),
+                             lambda: _render(dn, donor, rid), lambda pdf: cache_receipt_pdf(donation_id, pdf),
+                             peek=lambda: get_cached_receipt_pdf(donation_id, count=False))
+    except FutureTimeout:
+        logger.error(f"Timed out waiting on a concurrent render for {rid}")
+        raise HTTPException(503, "Receipt rendering timed out")
+
+def _receipt_attachment(donation_id: str) -> Tuple[bytes, str]:
+    """Outbox resolver: the receipt PDF for a queued email, rendered or read from cache at send time."""
+    dn = find_donation(donation_id)
+    if not dn: raise LookupError(f"Donation {donation_id} not found")
+    donor = find_donor(dn.get("donor_id", "")) or {"primary_contact_name": "Donor", "email": ""}
+    rid = dn.get("receipt_id") or f"RCPT-{donation_id}"
+    return _receipt_pdf(donation_id, dn, donor, rid)[0], f"{rid}.pdf"
+
+register_attachment("receipt", _receipt_attachment)
+
 def _pdf_response(pdf: bytes, filename: str, hit: bool = False):
     """Create PDF response with appropriate headers"""
     return Response(
@@ -15,14 +50,20 @@ def _pdf_response(pdf: bytes, filename: str, hit: bool = False):
         media_type="application/pdf",
         headers={
             "Content-Disposition": f'inline; filename="{filename}"', 
-            "X-Cache": "HIT" if hit else "MISS"
+            "X-Cache": "HIT" if hit else "MISS",
+            "ETag": pdf_etag(pdf),
+            "Cache-Control": PDF_CACHE_CONTROL
         }
     )
 
+def _not_modified(etag: str):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PDF_CACHE_CONTROL})
+
 @router.get("/donations/{donation_id}/receipt.pdf")
 def get_receipt(
     donation_id: str,
-    current_user: User = Depends(require_user)
+    current_user: User = Depends(require_user),
+    if_none_match: Optional[str] = Header(None)
 ):
     """Generate and return receipt PDF for donation"""
     logger.info(f"User {current_user.username} requesting receipt for donation {donation_id}")
@@ -35,34 +76,17 @@ def get_receipt(
     donor = find_donor(dn.get("donor_id", "")) or {"primary_contact_name": "Donor", "email": ""}
     rid = dn.get("receipt_id") or f"RCPT-{donation_id}"
     
-    # Check cache first
-    cached = get_cached_receipt_pdf(donation_id)
-    if cached:
-        logger.info(f"Serving cached receipt for donation {donation_id}")
-        return _pdf_response(cached, f"{rid}.pdf", True)
-    
-    # Generate new PDF
-    logger.info(f"Generating new receipt PDF for donation {donation_id}")
-    pdf = generate_receipt_pdf(
-        receipt_id=rid, 
-        donor_name=donor["primary_contact_name"],
-        donation_amount=float(dn.get("amount", "0") or 0), 
-        donation_date=(dn.get("received_at") or "")[:10],
-        designation=dn.get("designation", "General Fund"), 
-        restricted=(dn.get("restricted", "no").lower() == "yes"),
-        payment_method=(dn.get("method", "square")).title(), 
-        soft_credit_to=dn.get("soft_credit_to") or None,
-        line_items=line_items_from_row(dn)
-    )
-    
-    # Cache the PDF
-    try: 
-        cache_receipt_pdf(donation_id, pdf)
-        logger.info(f"Cached receipt PDF for donation {donation_id}")
-    except Exception as e:
-        logger.warning(f"Failed to cache receipt PDF for {donation_id}: {str(e)}")
+    # Conditional GET: answer from the stored digest without fetching the PDF
+    if if_none_match:
+        etag = get_receipt_etag(donation_id)
+        if etag_matches(if_none_match, etag):
+            logger.info(f"Receipt for donation {donation_id} not modified")
+            return _not_modified(etag)
     
-    return _pdf_response(pdf, f"{rid}.pdf")
+    # Cached copy, or a render shared with any concurrent request for the same receipt
+    pdf, hit = _receipt_pdf(donation_id, dn, donor, rid)
+    logger.info(f"{'Serving cached' if hit else 'Generated new'} receipt for donation {donation_id}")
+    return _pdf_response(pdf, f"{rid}.pdf", hit)
 
 @router.post("/donations/{donation_id}/receipt")
 def send_receipt(
@@ -84,40 +108,19 @@ def send_receipt(
     
     rid = dn.get("receipt_id") or f"RCPT-{donation_id}"
     
-    # Get PDF (cached or generate new)
-    cached = get_cached_receipt_pdf(donation_id)
-    pdf = cached or generate_receipt_pdf(
-        receipt_id=rid, 
-        donor_name=donor["primary_contact_name"],
-        donation_amount=float(dn.get("amount", "0") or 0), 
-        donation_date=(dn.get("received_at") or "")[:10],
-        designation=dn.get("designation", "General Fund"), 
-        restricted=(dn.get("restricted", "no").lower() == "yes"),
-        payment_method=(dn.get("method", "square")).title(), 
-        soft_credit_to=dn.get("soft_credit_to") or None,
-        line_items=line_items_from_row(dn)
-    )
-    
-    # Cache if not already cached
-    if not cached:
-        try: 
-            cache_receipt_pdf(donation_id, pdf)
-            logger.info(f"Cached receipt PDF for donation {donation_id}")
-        except Exception as e:
-            logger.warning(f"Failed to cache receipt PDF for {donation_id}: {str(e)}")
-    
-    # Send email
-    success = send_email(
+    # Queue the email; a background sender attaches the PDF and retries provider failures
+    msg_id, status, queued = get_outbox().enqueue(
+        f"receipt:{donation_id}:{donor['email']}",
         donor["email"], 
         "Your donation receipt", 
         "<p>Thank you for your gift to SparkCreatives. Your receipt is attached.</p>", 
-        pdf, 
-        f"{rid}.pdf"
+        ref=("receipt", donation_id),
+        filename=f"{rid}.pdf"
     )
     
-    if success:
-        logger.info(f"Receipt emailed successfully for donation {donation_id} to {donor['email']}")
+    if queued:
+        logger.info(f"Receipt email queued for donation {donation_id} to {donor['email']} (message {msg_id})")
     else:
-        logger.error(f"Failed to email receipt for donation {donation_id} to {donor['email']}")
+        logger.info(f"Receipt email for donation {donation_id} already {status} (message {msg_id})")
     
-    return {"sent": bool(success)}
+    return {"queued": queued, "message_id": msg_id, "status": status}
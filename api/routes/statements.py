@@ -1,41 +1,95 @@
-from fastapi import APIRouter, HTTPException, Response, Query
-from services.receipts import find_donor, _load_csv, generate_receipt_pdf
-from services.receipts import _designation_breakdown as designation_breakdown
-from services.emailer import send_email
-from cache.redis_cache import get_cached_statement_pdf, cache_statement_pdf
+import os, tempfile
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Response, Query, Header, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from services.receipts import find_donor, statement_args
+from services.render_pool import render_receipt_pdf, submit_task, wait_pdf, RenderError
+from services.statement_writer import render_itemized_statement_file, write_itemized_rows, iter_file
+from services.datastore import get_store
+from services.prewarm import start_prewarm, prewarm_status
+from services.statement_batch import run_statement_batch, run_shard, fan_out, fanout_status, STATEMENT_SHARDS
+from services.task_queue import verify_task_caller
+from cache.redis_cache import get_cached_statement_pdf, cache_statement_pdf, get_statement_etag
+from cache.etag import pdf_etag, etag_matches, PDF_CACHE_CONTROL
+from cache.single_flight import single_flight
 router = APIRouter()
+class ShardTask(BaseModel):
+    year: int = Field(..., ge=1900, le=9999)
+    shard: int = Field(..., ge=0)
+    shards: int = Field(..., ge=1, le=1024)
+    run_id: str = Field(..., min_length=1, max_length=64)
+    chain: str = Field(..., min_length=1, max_length=64)
+    part: int = Field(0, ge=0)
+    @model_validator(mode="after")
+    def _in_range(self):
+        if self.shard >= self.shards: raise ValueError("shard must be below shards")
+        return self
+def _task_caller(authorization: Optional[str] = Header(None), x_tasks_secret: Optional[str] = Header(None)):
+    if not verify_task_caller(authorization, x_tasks_secret): raise HTTPException(401, "Invalid task credentials")
 def _pdf_response(pdf: bytes, filename: str, hit: bool = False):
     return Response(content=pdf, media_type="application/pdf",
-                    headers={"Content-Disposition": f'inline; filename="{filename}"', "X-Cache": "HIT" if hit else "MISS"})
+                    headers={"Content-Disposition": f'inline; filename="{filename}"', "X-Cache": "HIT" if hit else "MISS",
+                             "ETag": pdf_etag(pdf), "Cache-Control": PDF_CACHE_CONTROL})
 @router.get("/donors/{donor_id}/statement/{year}")
-def get_statement(donor_id: str, year: int):
+def get_statement(donor_id: str, year: int, if_none_match: Optional[str] = Header(None)):
     donor = find_donor(donor_id); 
     if not donor: raise HTTPException(404, "Donor not found")
-    cached = get_cached_statement_pdf(donor_id, year)
+    if if_none_match:
+        etag = get_statement_etag(donor_id, year)
+        if etag_matches(if_none_match, etag): return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PDF_CACHE_CONTROL})
     rid = f"YEAR-{year}-{donor_id}"
-    if cached: return _pdf_response(cached, f"{rid}.pdf", True)
-    donations = [r for r in _load_csv("donations.csv") if r.get("donor_id")==donor_id and r.get("received_at","")[:4]==str(year)]
-    total = sum(float(d.get("amount","0") or 0) for d in donations)
-    pdf = generate_receipt_pdf(
-        receipt_id=rid, donor_name=donor.get("primary_contact_name","Donor"),
-        donation_amount=total, donation_date=f"{year}-12-31", designation=f"Annual Statement {year}", restricted=False,
-        payment_method="Multiple", soft_credit_to=None, line_items=designation_breakdown(donations))
-    try: cache_statement_pdf(donor_id, year, pdf)
-    except Exception: pass
-    return _pdf_response(pdf, f"{rid}.pdf")
+    def build() -> bytes:
+        cents, _, breakdown = get_store().giving_summary(donor_id, year)
+        return render_receipt_pdf(**statement_args(donor, year, cents, breakdown))
+    try:
+        pdf, hit = single_flight(f"statement:{donor_id}:{year}", lambda: get_cached_statement_pdf(donor_id, year),
+                                 build, lambda pdf: cache_statement_pdf(donor_id, year, pdf),
+                                 peek=lambda: get_cached_statement_pdf(donor_id, year, count=False))
+    except (RenderError, FutureTimeout): raise HTTPException(503, "Statement rendering timed out or unavailable")
+    return _pdf_response(pdf, f"{rid}.pdf", hit)
+@router.get("/donors/{donor_id}/statement/{year}/itemized")
+def get_itemized_statement(donor_id: str, year: int):
+    donor = find_donor(donor_id)
+    if not donor: raise HTTPException(404, "Donor not found")
+    rid = f"YEAR-{year}-{donor_id}-ITEMIZED"
+    store = get_store()
+    # the breakdown is net of refunds, so the printed total comes from the same summary rather than the listed gifts
+    cents, _, breakdown = store.giving_summary(donor_id, year)
+    fd, rows_path = tempfile.mkstemp(suffix=".csv"); os.close(fd)
+    fd, path = tempfile.mkstemp(suffix=".pdf"); os.close(fd)
+    try:
+        write_itemized_rows(rows_path, store.donations_for_donor(donor_id, year))
+        wait_pdf(submit_task(render_itemized_statement_file, path, donor_id, year, donor.get("primary_contact_name","Donor"), rows_path, breakdown, cents))
+    except RenderError:
+        os.unlink(path); raise HTTPException(503, "Statement rendering timed out or unavailable")
+    except Exception:
+        os.unlink(path); raise
+    finally:
+        os.unlink(rows_path)
+    return StreamingResponse(iter_file(path), media_type="application/pdf",
+                             headers={"Content-Disposition": f'inline; filename="{rid}.pdf"', "Content-Length": str(os.path.getsize(path))})
 @router.post("/tasks/year-end-statements")
-def batch_statements(year: int = Query(..., description="Year for statements")):
-    donors = _load_csv("donors.csv"); donations = _load_csv("donations.csv"); count=0
-    for d in donors:
-        did = d.get("donor_id")
-        my = [r for r in donations if r.get("donor_id")==did and r.get("received_at","")[:4]==str(year)]
-        if not my: continue
-        total = sum(float(x.get("amount","0") or 0) for x in my)
-        rid = f"YEAR-{year}-{did}"
-        pdf = generate_receipt_pdf(
-            receipt_id=rid, donor_name=d.get("primary_contact_name","Donor"), donation_amount=total, donation_date=f"{year}-12-31",
-            designation=f"Annual Statement {year}", restricted=False, payment_method="Multiple", soft_credit_to=None,
-            line_items=designation_breakdown(my))
-        if d.get("email"): send_email(d["email"], f"Your {year} annual giving statement", "<p>Attached is your annual statement.</p>", pdf, f"{rid}.pdf")
-        count += 1
-    return {"generated": count}
+def batch_statements(year: int = Query(..., description="Year for statements"),
+                     restart: bool = Query(False, description="Discard the checkpoint and start the year over"),
+                     shards: int = Query(STATEMENT_SHARDS, ge=0, le=1024, description="Fan out over this many queued shard tasks; 0 runs inline")):
+    # resumable: re-POST after a timeout or "paused" and the run continues from its last checkpoint
+    if not shards: return run_statement_batch(year, restart)
+    try: return fan_out(year, shards, restart)
+    except RuntimeError as e: raise HTTPException(503, str(e))
+@router.post("/tasks/year-end-statements/shard", dependencies=[Depends(_task_caller)])
+def batch_statements_shard(task: ShardTask):
+    # task queue callback; an error response makes Cloud Tasks retry from the shard's checkpoint
+    return run_shard(task.model_dump())
+@router.get("/tasks/year-end-statements")
+def batch_statements_progress(year: int = Query(..., description="Year for statements")):
+    return fanout_status(year)
+@router.post("/tasks/prewarm")
+def prewarm_cache(kind: str = Query("all", pattern="^(receipts|statements|all)$"),
+                  year: Optional[int] = Query(None, description="Statement year (defaults to the current year)")):
+    kinds = ("receipts", "statements") if kind == "all" else (kind,)
+    return {"started": start_prewarm(kinds, year), "status": prewarm_status()}
+@router.get("/tasks/prewarm")
+def prewarm_progress():
+    return prewarm_status()
@@ -0,0 +1,106 @@
+import os, csv, fcntl, threading
+from typing import Optional, List, Dict, Tuple, Iterable
+from services.datastore import DonationRow, to_cents
+from services.ingest import CsvTail
+
+REFUND_COLUMNS = ("refund_id", "payment_id", "donation_id", "donor_id", "year", "designation", "amount", "created_at")
+Summary = Tuple[int, int, List[Dict]]
+
+def net_summary(totals: Dict[str, int], count: int, refunds: Optional["RefundLedger"], donor_id: str, year: int) -> Summary:
+    """giving_summary's (total_cents, count, designation breakdown) from gross cents per designation, net of refunds."""
+    if refunds is not None:
+        totals = dict(totals)
+        for des, cents in refunds.adjustments(donor_id, year).items():
+            totals[des] = totals.get(des, 0) - cents
+    return sum(totals.values()), count, [{"designation": k, "amount": v / 100} for k, v in sorted(totals.items())]
+
+class GivingAggregates:
+    """Materialized (donor_id, year) -> [total cents, gift count, {designation: cents}].
+
+    The CSV backend builds it with its in-memory indexes and folds appended rows forward, so
+    giving_summary is a dict lookup instead of a scan of the donor's gifts. Refunds from the
+    ledger are netted out at read time.
+    """
+    def __init__(self, refunds: Optional["RefundLedger"] = None):
+        self.refunds = refunds
+        self._agg: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows: Iterable[DonationRow]):
+        with self._lock:
+            for r in rows:
+                e = self._agg.setdefault((r.get("donor_id") or "", r.year), [0, 0, {}])
+                des = r.get("designation") or "General Fund"
+                e[0] += r.cents; e[1] += 1; e[2][des] = e[2].get(des, 0) + r.cents
+
+    def summary(self, donor_id: str, year: int) -> Summary:
+        """(total_cents, count, designation breakdown) net of refunds, same shape as the stores' giving_summary."""
+        with self._lock:
+            e = self._agg.get((donor_id, str(year)))
+            totals = dict(e[2]) if e else {}; count = e[1] if e else 0
+        return net_summary(totals, count, self.refunds, donor_id, year)
+
+    def year(self, year: int) -> Dict[str, Summary]:
+        """Every donor's summary for one year, keyed by donor_id."""
+        with self._lock: donors = [d for (d, y) in self._agg if y == str(year) and d]
+        return {d: self.summary(d, year) for d in donors}
+
+class RefundLedger:
+    """Append-only refunds.csv in DATA_DIR, aggregated per (donor_id, year, designation).
+
+    The webhook appends under an flock and dedupes by refund_id; every worker follows the
+    file with CsvTail, so a refund recorded by one process reaches the others' totals.
+    """
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "refunds.csv")
+        self._tail = CsvTail(self.path)
+        self._lock = threading.Lock()
+        self._sig: Optional[Tuple[int, int]] = None
+        self._ids: set = set()
+        self._agg: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def _sync(self):
+        try: st = os.stat(self.path); sig = (st.st_mtime_ns, st.st_size)
+        except OSError: sig = None
+        if sig == self._sig: return
+        with self._lock:
+            if sig == self._sig: return
+            rebuilt, rows = self._tail.poll()
+            if rebuilt: self._ids, self._agg = set(), {}
+            for r in rows:
+                if not r.get("refund_id") or r["refund_id"] in self._ids: continue
+                self._ids.add(r["refund_id"])
+                e = self._agg.setdefault((r.get("donor_id") or "", r.get("year") or ""), {})
+                des = r.get("designation") or "General Fund"
+                e[des] = e.get(des, 0) + to_cents(r.get("amount"))
+            self._sig = sig
+
+    def adjustments(self, donor_id: str, year: int) -> Dict[str, int]:
+        self._sync()
+        return self._agg.get((donor_id, str(year)), {})
+
+    def record(self, refund_id: str, donation: DonationRow, cents: int, created_at: Optional[str] = None) -> bool:
+        """Appends a refund against donation; False if refund_id is already in the ledger."""
+        with open(f"{self.path}.lock", "w") as lk:
+            fcntl.flock(lk, fcntl.LOCK_EX)
+            self._sync()
+            if refund_id in self._ids: return False
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                if new: w.writerow(REFUND_COLUMNS)
+                w.writerow((refund_id, donation.get("square_payment_id") or "", donation.get("donation_id") or "",
+                            donation.get("donor_id") or "", donation.year, donation.get("designation") or "General Fund",
+                            f"{cents / 100:.2f}", created_at or ""))
+            self._sync()
+        return True
+
+_ledgers: Dict[str, RefundLedger] = {}
+_ledgers_lock = threading.Lock()
+
+def get_refund_ledger(directory: str) -> RefundLedger:
+    ledger = _ledgers.get(directory)
+    if ledger is None:
+        with _ledgers_lock:
+            ledger = _ledgers.setdefault(directory, RefundLedger(directory))
+    return ledger
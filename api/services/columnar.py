@@ -0,0 +1,77 @@
+from decimal import Decimal
+from typing import Optional, List, Dict, Tuple, Iterable, Callable
+import numpy as np
+
+from services.datastore import to_cents, DonationRow
+
+def _categorical(values: Iterable[str], lookup: Dict[str, int]) -> np.ndarray:
+    return np.fromiter((lookup.setdefault(v, len(lookup)) for v in values), dtype=np.int64)
+
+def cents_str(cents: int) -> str:
+    return f"{Decimal(int(cents)).scaleb(-2):.2f}"
+
+class DonationTable:
+    """Columnar donations: integer-cent amounts plus categorical codes for donor, year, designation and org."""
+    def __init__(self, rows: List[Dict], base: Optional["DonationTable"] = None):
+        cents = np.fromiter((r.cents if isinstance(r, DonationRow) else to_cents(r.get("amount")) for r in rows),
+                            dtype=np.int64, count=len(rows))
+        self.cents = cents if base is None else np.concatenate([base.cents, cents])
+        self.size = int(self.cents.size)
+        self._codes: Dict[str, np.ndarray] = {}
+        self._labels: Dict[str, List[str]] = {}
+        self._index: Dict[str, Dict[str, int]] = {}
+        for col, values in (("donor", (r.get("donor_id") or "" for r in rows)),
+                            ("year", ((r.get("received_at") or "")[:4] for r in rows)),
+                            ("designation", (r.get("designation") or "General Fund" for r in rows)),
+                            ("org", (r.get("org_id") or "" for r in rows))):
+            lookup = dict(base._index[col]) if base is not None else {}
+            codes = _categorical(values, lookup)
+            self._codes[col] = codes if base is None else np.concatenate([base._codes[col], codes])
+            self._labels[col], self._index[col] = list(lookup), lookup
+
+    @classmethod
+    def from_codes(cls, cents: np.ndarray, columns: Dict[str, Tuple[np.ndarray, Callable[[int], str]]]) -> "DonationTable":
+        """Builds a table from pre-encoded columns (e.g. snapshot string ids), densifying codes and merging equal labels."""
+        t = cls([])
+        t.cents, t.size = cents, int(cents.shape[0])
+        for col, (raw, label) in columns.items():
+            uniq, inverse = np.unique(raw, return_inverse=True)
+            lookup: Dict[str, int] = {}
+            remap = np.fromiter((lookup.setdefault(label(int(u)), len(lookup)) for u in uniq), dtype=np.int64, count=uniq.size)
+            t._codes[col], t._labels[col], t._index[col] = remap[inverse], list(lookup), lookup
+        return t
+
+    def extended(self, rows: List[Dict]) -> "DonationTable":
+        """New table with rows appended; existing codes are reused so only the new rows are encoded."""
+        return DonationTable(rows, base=self) if rows else self
+
+    def mask(self, **eq) -> np.ndarray:
+        """Boolean row mask for column == label filters, e.g. mask(donor="d_1001", year="2025")."""
+        m = np.ones(self.size, dtype=bool)
+        for col, label in eq.items():
+            code = self._index[col].get(str(label))
+            if code is None: return np.zeros(self.size, dtype=bool)
+            m &= self._codes[col] == code
+        return m
+
+    def total(self, mask: Optional[np.ndarray] = None) -> Tuple[int, int]:
+        c = self.cents if mask is None else self.cents[mask]
+        return int(c.sum()), int(c.size)
+
+    def group_by(self, *columns: str, mask: Optional[np.ndarray] = None) -> Dict[Tuple[str, ...], Tuple[int, int]]:
+        """Grouped (sum_cents, count) keyed by label tuples, computed in a single sort/reduce pass."""
+        idx = np.arange(self.size) if mask is None else np.flatnonzero(mask)
+        if idx.size == 0: return {}
+        dims = [len(self._labels[c]) for c in columns]
+        key = np.ravel_multi_index([self._codes[c][idx] for c in columns], dims) if columns else np.zeros(idx.size, dtype=np.int64)
+        order = np.argsort(key, kind="stable")
+        k = key[order]
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+        sums = np.add.reduceat(self.cents[idx][order], starts)
+        counts = np.diff(np.r_[starts, k.size])
+        groups = np.unravel_index(k[starts], dims) if columns else []
+        out = {}
+        for i in range(starts.size):
+            label = tuple(self._labels[c][groups[j][i]] for j, c in enumerate(columns))
+            out[label] = (int(sums[i]), int(counts[i]))
+        return out
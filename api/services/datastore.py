@@ -0,0 +1,258 @@
+import os, hashlib, logging, threading
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+from typing import Optional, List, Dict, Tuple, Set, Callable, Iterable
+from services.ingest import CsvTail
+
+DATA_BACKEND = os.getenv("DATA_BACKEND", "csv")  # csv | sqlite | snapshot
+DONATION_COLUMNS = ("donation_id", "org_id", "donor_id", "amount", "currency", "method", "designation", "restricted",
+                    "received_at", "square_payment_id", "receipt_id", "soft_credit_to", "designation_breakdown")
+DONOR_COLUMNS = ("donor_id", "primary_contact_name", "email")
+
+logger = logging.getLogger(__name__)
+CHANGE_CLAIM_TTL = int(os.getenv("CHANGE_CLAIM_TTL_SEC", str(24*3600)))
+_change_listeners: List[Callable[[Set[str], Set[str]], None]] = []
+
+def data_dir() -> str:
+    return os.getenv("DATA_DIR", "/app/data")
+
+def to_cents(v) -> int:
+    try: return int((Decimal(str(v or "0").strip() or "0") * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError): return 0
+
+def parse_breakdown(raw: str) -> Optional[List[Dict]]:
+    br = (raw or "").strip()
+    if not br: return None
+    out = []
+    for part in br.split(";"):
+        if ":" in part:
+            d,a = part.split(":",1)
+            try:
+                out.append({"designation":d.strip(), "amount":float(a)})
+            except ValueError: pass
+    return out or None
+
+def on_data_change(fn: Callable[[Set[str], Set[str]], None]):
+    """Registers fn(donation_ids, donor_ids), called whenever a reload adds, edits or removes those records."""
+    _change_listeners.append(fn); return fn
+
+def notify_changed(donation_ids: Set[str], donor_ids: Set[str]):
+    if not (donation_ids or donor_ids): return
+    for fn in list(_change_listeners):
+        try: fn(donation_ids, donor_ids)
+        except Exception as e: logger.warning(f"Data change listener failed: {str(e)}")
+
+def claim_change(change: str) -> bool:
+    """True in the one process that gets to announce change; every worker tailing the CSVs sees the same edit."""
+    from cache.redis_cache import r
+    key = f"spark:datachange:{hashlib.blake2b(change.encode(), digest_size=12).hexdigest()}".encode()
+    try: return bool(r.set(key, os.getpid(), nx=True, ex=CHANGE_CLAIM_TTL))
+    except Exception: return True  # no Redis means no cache versions to bump twice
+
+def diff_rows(old_donations: Iterable[Dict], old_donors: Iterable[Dict],
+              new_donations: Iterable[Dict], new_donors: Iterable[Dict]) -> Tuple[Set[str], Set[str]]:
+    """(donation_ids, donor_ids) whose records differ between two loads of the CSVs.
+
+    A donor edit also marks every donation of that donor, since name and email print on receipts.
+    """
+    def index(rows: Iterable[Dict], key: str, cols: Tuple[str, ...]) -> Dict[str, Tuple]:
+        out: Dict[str, Tuple] = {}
+        for r in rows:
+            if r.get(key): out.setdefault(r[key], tuple(r.get(c) or "" for c in cols))  # first occurrence wins
+        return out
+    new_donations = list(new_donations)
+    a, b = index(old_donations, "donation_id", DONATION_COLUMNS), index(new_donations, "donation_id", DONATION_COLUMNS)
+    donations = {k for k in a.keys() | b.keys() if a.get(k) != b.get(k)}
+    di = DONATION_COLUMNS.index("donor_id")
+    donors = {row[di] for k in donations for row in (a.get(k), b.get(k)) if row and row[di]}
+    a, b = index(old_donors, "donor_id", DONOR_COLUMNS), index(new_donors, "donor_id", DONOR_COLUMNS)
+    edited = {k for k in a.keys() | b.keys() if a.get(k) != b.get(k)}
+    donations |= {r["donation_id"] for r in new_donations if r.get("donation_id") and r.get("donor_id") in edited}
+    return donations, donors | edited
+
+class DonationRow(dict):
+    """A donations.csv row with its amount and designation_breakdown parsed once at load time."""
+    __slots__ = ("cents", "year", "line_items")
+
+    def __init__(self, raw: Dict[str, str]):
+        super().__init__(raw)
+        self.cents = to_cents(raw.get("amount"))
+        self.year = (raw.get("received_at") or "")[:4]
+        self.line_items = parse_breakdown(raw.get("designation_breakdown"))
+
+    @property
+    def amount(self) -> float:
+        return self.cents / 100
+
+class _Snapshot:
+    """Indexes over donations.csv/donors.csv; extended in place on append, replaced wholesale on rewrite."""
+    def __init__(self, donations: List[DonationRow], donors: List[Dict], refunds=None):
+        from services.aggregates import GivingAggregates
+        self.donations: List[DonationRow] = []
+        self.donors: List[Dict] = []
+        self.table = None
+        self.by_donation, self.by_receipt, self.by_payment = {}, {}, {}
+        self.by_donor_id: Dict[str, Dict] = {}
+        self.by_donor: Dict[str, List[DonationRow]] = defaultdict(list)
+        self.by_org: Dict[str, List[DonationRow]] = defaultdict(list)
+        self.giving = GivingAggregates(refunds)
+        self.add_donations(donations); self.add_donors(donors)
+
+    def add_donations(self, rows: List[DonationRow]):
+        for r in rows:
+            # first occurrence wins, matching the old linear-scan semantics
+            if r.get("donation_id"): self.by_donation.setdefault(r["donation_id"], r)
+            if r.get("receipt_id"): self.by_receipt.setdefault(r["receipt_id"], r)
+            if r.get("square_payment_id"): self.by_payment.setdefault(r["square_payment_id"], r)
+            self.by_donor[r.get("donor_id") or ""].append(r)
+            self.by_org[r.get("org_id") or ""].append(r)
+        self.donations.extend(rows)
+        self.giving.add(rows)
+        # readers may hold the previous table, so extend into a new one rather than mutating it
+        if rows and self.table is not None: self.table = self.table.extended(rows)
+
+    def add_donors(self, rows: List[Dict]):
+        for d in rows:
+            if d.get("donor_id"): self.by_donor_id.setdefault(d["donor_id"], d)
+        self.donors.extend(rows)
+
+def _sig(path: str) -> Optional[Tuple[int, int]]:
+    try: st = os.stat(path); return (st.st_mtime_ns, st.st_size)
+    except OSError: return None
+
+class DataStore:
+    """Hash-indexed, in-memory view of DATA_DIR.
+
+    Both CSVs are followed with CsvTail: when a file's mtime or size changes only the
+    appended rows are parsed and folded into the indexes; a truncated or rewritten file
+    triggers a full rebuild.
+    """
+    def __init__(self, directory: str):
+        self.dir = directory
+        self.donations_path = os.path.join(directory, "donations.csv")
+        self.donors_path = os.path.join(directory, "donors.csv")
+        self._lock = threading.Lock()
+        self._sigs: Tuple = (None, None)
+        self._snap: Optional[_Snapshot] = None
+        self._tails = (CsvTail(self.donations_path), CsvTail(self.donors_path))
+
+    def _current(self) -> _Snapshot:
+        sigs = (_sig(self.donations_path), _sig(self.donors_path))
+        snap = self._snap
+        if snap is not None and sigs == self._sigs: return snap
+        with self._lock:
+            if self._snap is None or sigs != self._sigs:
+                self._ingest(sigs)
+                self._sigs = sigs
+            return self._snap
+
+    def _ingest(self, sigs: Tuple):
+        (don_rebuilt, don_rows), (dnr_rebuilt, dnr_rows) = (t.poll() for t in self._tails)
+        prev = self._snap
+        # each worker tails the files itself; only the first to reach these sigs announces what changed
+        announce = lambda: prev is not None and claim_change(f"{self.dir}|{sigs}")
+        if prev is not None and not (don_rebuilt or dnr_rebuilt):
+            prev.add_donations([DonationRow(r) for r in don_rows]); prev.add_donors(dnr_rows)
+            if (don_rows or dnr_rows) and announce():
+                donations, donors = diff_rows((), (), don_rows, dnr_rows)
+                # an appended donor row reprints the name on every receipt that donor already had
+                for d in dnr_rows:
+                    donations.update(r["donation_id"] for r in prev.by_donor.get(d.get("donor_id") or "", ()) if r.get("donation_id"))
+                notify_changed(donations, donors)
+            return
+        # first load, or a file was rewritten: rebuild every index from both files' full contents
+        if not don_rebuilt: don_rows = self._reread(0)
+        if not dnr_rebuilt: dnr_rows = self._reread(1)
+        from services.aggregates import get_refund_ledger
+        self._snap = _Snapshot([DonationRow(r) for r in don_rows], dnr_rows, get_refund_ledger(self.dir))
+        if announce(): notify_changed(*diff_rows(prev.donations, prev.donors, self._snap.donations, self._snap.donors))
+
+    def _reread(self, i: int) -> List[Dict]:
+        self._tails[i].__init__(self._tails[i].path)
+        return self._tails[i].poll()[1]
+
+    def reload(self):
+        """Forces a full rebuild from byte 0 of both files."""
+        with self._lock:
+            prev = self._snap
+            self._tails = (CsvTail(self.donations_path), CsvTail(self.donors_path))
+            self._snap = None; self._sigs = (None, None)
+        snap = self._current()
+        if prev is not None: notify_changed(*diff_rows(prev.donations, prev.donors, snap.donations, snap.donors))
+        return snap
+
+    @property
+    def ingested_rows(self) -> int:
+        return self._tails[0].rows
+
+    def donation(self, donation_id: str) -> Optional[DonationRow]:
+        return self._current().by_donation.get(donation_id)
+
+    def donation_by_receipt(self, receipt_id: str) -> Optional[DonationRow]:
+        return self._current().by_receipt.get(receipt_id)
+
+    def donation_by_payment(self, square_payment_id: str) -> Optional[DonationRow]:
+        return self._current().by_payment.get(square_payment_id)
+
+    def donor(self, donor_id: str) -> Optional[Dict]:
+        return self._current().by_donor_id.get(donor_id)
+
+    def donations(self) -> List[DonationRow]:
+        return self._current().donations
+
+    def donors(self) -> List[Dict]:
+        return self._current().donors
+
+    def table(self):
+        """Columnar view of the current donations, built on first use per snapshot."""
+        snap = self._current()
+        if snap.table is None:
+            from services.columnar import DonationTable
+            snap.table = DonationTable(snap.donations)
+        return snap.table
+
+    def donations_for_org(self, org_id: str) -> List[DonationRow]:
+        return self._current().by_org.get(org_id, [])
+
+    def donations_for_donor(self, donor_id: str, year: Optional[int] = None) -> List[DonationRow]:
+        rows = self._current().by_donor.get(donor_id, [])
+        if year is None: return rows
+        return [r for r in rows if r.year == str(year)]
+
+    def giving_summary(self, donor_id: str, year: int) -> Tuple[int, int, List[Dict]]:
+        """(total_cents, count, designation breakdown) for one donor-year, net of refunds, from the aggregate index."""
+        return self._current().giving.summary(donor_id, year)
+
+    def giving_summaries(self, year: int) -> Dict[str, Tuple[int, int, List[Dict]]]:
+        return self._current().giving.year(year)
+
+    def donations_between(self, start: str, end: str, donor_id: Optional[str] = None,
+                          org_id: Optional[str] = None) -> List[DonationRow]:
+        """Donations with start <= received_at < end (ISO strings), optionally narrowed to a donor or org."""
+        snap = self._current()
+        rows = snap.by_donor.get(donor_id, []) if donor_id is not None else \
+            snap.by_org.get(org_id, []) if org_id is not None else snap.donations
+        return [r for r in rows if start <= (r.get("received_at") or "") < end
+                and (org_id is None or r.get("org_id") == org_id)]
+
+_stores: Dict[str, DataStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(directory: Optional[str] = None) -> DataStore:
+    """Process-wide store for a data directory; DATA_BACKEND selects the CSV, SQLite or mmap snapshot backend."""
+    directory = directory or data_dir()
+    store = _stores.get(directory)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(directory)
+            if store is None:
+                if DATA_BACKEND == "sqlite":
+                    from services.sqlite_store import SqliteStore
+                    store = SqliteStore(directory)
+                elif DATA_BACKEND == "snapshot":
+                    from services.snapshot import SnapshotStore
+                    store = SnapshotStore(directory)
+                else:
+                    store = DataStore(directory)
+                _stores[directory] = store
+    return store
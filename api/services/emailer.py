@@ -1,12 +1,104 @@
 import os
+import time
 import base64
 import json
 import logging
-from typing import Optional
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 PROVIDER = os.getenv("EMAIL_PROVIDER", "sendgrid")
+EMAIL_POOL_SIZE = int(os.getenv("EMAIL_POOL_SIZE", "20"))
+EMAIL_RETRIES = int(os.getenv("EMAIL_RETRIES", "3"))
+EMAIL_BACKOFF_SEC = float(os.getenv("EMAIL_BACKOFF_SEC", "0.5"))
+EMAIL_TIMEOUT = (float(os.getenv("EMAIL_CONNECT_TIMEOUT", "5")), float(os.getenv("EMAIL_READ_TIMEOUT", "30")))
+EMAIL_BULK_CONCURRENCY = int(os.getenv("EMAIL_BULK_CONCURRENCY", "8"))   # batch requests in flight at once
+EMAIL_BULK_FLUSH = int(os.getenv("EMAIL_BULK_FLUSH", "200"))             # messages a bulk caller buffers before sending
+SENDGRID_API_URL = os.getenv("SENDGRID_API_URL", "https://api.sendgrid.com").rstrip("/")
+POSTMARK_API_URL = os.getenv("POSTMARK_API_URL", "https://api.postmarkapp.com").rstrip("/")
+SENDGRID_BATCH = 1000                      # personalizations per mail/send request (provider limit)
+POSTMARK_BATCH = 500                       # messages per /email/batch request (provider limit)
+POSTMARK_BATCH_BYTES = 40 * 1024 * 1024    # stay under Postmark's 50 MB batch payload cap
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+def _session(provider: str) -> requests.Session:
+    """Process-wide keep-alive session per provider, so sends reuse TCP+TLS connections."""
+    s = _sessions.get(provider)
+    if s is None:
+        with _sessions_lock:
+            s = _sessions.get(provider)
+            if s is None:
+                # 429/5xx mean the provider did not accept the message, so the POST is safe to repeat;
+                # read errors are not retried since the message may already have been queued
+                retry = Retry(total=EMAIL_RETRIES, connect=EMAIL_RETRIES, read=0, status=EMAIL_RETRIES,
+                              backoff_factor=EMAIL_BACKOFF_SEC, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=frozenset({"POST"}), respect_retry_after_header=True, raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=EMAIL_POOL_SIZE, max_retries=retry, pool_block=True)
+                s = requests.Session(); s.mount("https://", adapter); s.mount("http://", adapter)
+                _sessions[provider] = s
+    return s
+
+class _Latency:
+    """Per-provider send latency: totals plus a sliding window for percentiles."""
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock(); self.samples = deque(maxlen=window)
+        self.sent = 0; self.failed = 0; self.total_ms = 0.0; self.max_ms = 0.0
+
+    def record(self, ms: float, ok: bool):
+        with self.lock:
+            self.samples.append(ms); self.total_ms += ms; self.max_ms = max(self.max_ms, ms)
+            if ok: self.sent += 1
+            else: self.failed += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            s = sorted(self.samples); n = self.sent + self.failed
+            pct = lambda q: round(s[min(len(s) - 1, int(q * len(s)))], 1) if s else None
+            return {"sent": self.sent, "failed": self.failed, "avg_ms": round(self.total_ms / n, 1) if n else None,
+                    "p50_ms": pct(0.5), "p95_ms": pct(0.95), "max_ms": round(self.max_ms, 1)}
+
+_latency: Dict[str, _Latency] = {"sendgrid": _Latency(), "postmark": _Latency()}
+
+def email_metrics() -> dict:
+    return {"provider": PROVIDER, "pool_size": EMAIL_POOL_SIZE, **{p: l.snapshot() for p, l in _latency.items()}}
+
+def _post(provider: str, url: str, headers: dict, payload: object, ok_codes: tuple) -> requests.Response:
+    """POST through the provider's pooled session, timing the send (retries included)."""
+    t0 = time.perf_counter(); ok = False
+    try:
+        response = _session(provider).post(url, headers=headers, data=json.dumps(payload), timeout=EMAIL_TIMEOUT)
+        ok = response.status_code in ok_codes
+        return response
+    finally:
+        _latency[provider].record((time.perf_counter() - t0) * 1000, ok)
+
+def _from_address() -> str:
+    return os.getenv("FROM_EMAIL", "noreply@sparkcreatives.org")
+
+def _sendgrid_payload(recipients: List[str], subject: str, html: str, attachment: Optional[bytes], filename: str) -> dict:
+    # one personalization per recipient so nobody sees anyone else's address
+    payload = {
+        "personalizations": [{"to": [{"email": to}]} for to in recipients],
+        "from": {"email": _from_address(), "name": os.getenv("FROM_NAME", "SparkCreatives")},
+        "subject": subject,
+        "content": [{"type": "text/html", "value": html}]
+    }
+    if attachment:
+        payload["attachments"] = [{"content": base64.b64encode(attachment).decode("utf-8"), "filename": filename, "type": "application/pdf"}]
+    return payload
+
+def _postmark_message(to_email: str, subject: str, html: str, attachment: Optional[bytes], filename: str) -> dict:
+    message = {"From": _from_address(), "To": to_email, "Subject": subject, "HtmlBody": html}
+    if attachment:
+        message["Attachments"] = [{"Name": filename, "Content": base64.b64encode(attachment).decode("utf-8"), "ContentType": "application/pdf"}]
+    return message
 
 def send_email(to_email: str, subject: str, html: str, attachment: Optional[bytes] = None, filename: str = "attachment.pdf") -> bool:
     """Send email via configured provider (SendGrid or Postmark)"""
@@ -28,33 +120,20 @@ def _send_via_sendgrid(to_email: str, subject: str, html: str, attachment: Optio
         logger.warning("SENDGRID_API_KEY not configured - email sending disabled")
         return False
     
-    payload = {
-        "personalizations": [{"to": [{"email": to_email}]}],
-        "from": {
-            "email": os.getenv("FROM_EMAIL", "noreply@sparkcreatives.org"), 
-            "name": os.getenv("FROM_NAME", "SparkCreatives")
-        },
-        "subject": subject,
-        "content": [{"type": "text/html", "value": html}]
-    }
-    
+    payload = _sendgrid_payload([to_email], subject, html, attachment, filename)
     if attachment:
-        payload["attachments"] = [{
-            "content": base64.b64encode(attachment).decode("utf-8"),
-            "filename": filename, 
-            "type": "application/pdf"
-        }]
         logger.info(f"Email includes attachment: {filename}")
     
     try:
-        response = requests.post(
-            "https://api.sendgrid.com/v3/mail/send",
-            headers={
+        response = _post(
+            "sendgrid",
+            f"{SENDGRID_API_URL}/v3/mail/send",
+            {
                 "Authorization": f"Bearer {key}",
                 "Content-Type": "application/json"
             },
-            data=json.dumps(payload),
-            timeout=30
+            payload,
+            (200, 202)
         )
         
         success = response.status_code in (200, 202)
@@ -76,30 +155,20 @@ def _send_via_postmark(to_email: str, subject: str, html: str, attachment: Optio
         logger.warning("POSTMARK_TOKEN not configured - email sending disabled")
         return False
     
-    payload = {
-        "From": os.getenv("FROM_EMAIL", "noreply@sparkcreatives.org"),
-        "To": to_email, 
-        "Subject": subject, 
-        "HtmlBody": html
-    }
-    
+    payload = _postmark_message(to_email, subject, html, attachment, filename)
     if attachment:
-        payload["Attachments"] = [{
-            "Name": filename, 
-            "Content": base64.b64encode(attachment).decode("utf-8"),
-            "ContentType": "application/pdf"
-        }]
         logger.info(f"Email includes attachment: {filename}")
     
     try:
-        response = requests.post(
-            "https://api.postmarkapp.com/email",
-            headers={
+        response = _post(
+            "postmark",
+            f"{POSTMARK_API_URL}/email",
+            {
                 "X-Postmark-Server-Token": token, 
                 "Content-Type": "application/json"
             },
-            data=json.dumps(payload),
-            timeout=30
+            payload,
+            (200, 201)
         )
         
         success = response.status_code in (200, 201)
@@ -113,3 +182,71 @@ def _send_via_postmark(to_email: str, subject: str, html: str, attachment: Optio
     except requests.RequestException as e:
         logger.error(f"Postmark API request failed: {str(e)}")
         return False
+
+def _sendgrid_batches(messages: List[dict]) -> List[List[int]]:
+    """Indices of messages sharing subject, body and attachment, up to SENDGRID_BATCH per request."""
+    groups: Dict[tuple, List[int]] = {}
+    for i, m in enumerate(messages):
+        groups.setdefault((m["subject"], m["html"], m.get("filename"), m.get("attachment")), []).append(i)
+    return [idx[j:j+SENDGRID_BATCH] for idx in groups.values() for j in range(0, len(idx), SENDGRID_BATCH)]
+
+def _postmark_batches(messages: List[dict]) -> List[List[int]]:
+    """Consecutive runs of up to POSTMARK_BATCH messages, cut early before the payload cap."""
+    batches: List[List[int]] = [[]]; size = 0
+    for i, m in enumerate(messages):
+        est = len(m["html"]) + len(m.get("attachment") or b"") * 4 // 3 + 1024
+        if batches[-1] and (len(batches[-1]) >= POSTMARK_BATCH or size + est > POSTMARK_BATCH_BYTES):
+            batches.append([]); size = 0
+        batches[-1].append(i); size += est
+    return batches
+
+def _bulk_sendgrid(key: str, messages: List[dict], idx: List[int], results: List[dict]):
+    m = messages[idx[0]]
+    payload = _sendgrid_payload([messages[i]["to"] for i in idx], m["subject"], m["html"], m.get("attachment"), m.get("filename", "attachment.pdf"))
+    response = _post("sendgrid", f"{SENDGRID_API_URL}/v3/mail/send",
+                     {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}, payload, (200, 202))
+    ok = response.status_code in (200, 202)
+    if not ok: logger.error(f"SendGrid API error {response.status_code} for {len(idx)} recipients: {response.text}")
+    for i in idx: results[i].update(sent=ok, error=None if ok else f"HTTP {response.status_code}")
+
+def _bulk_postmark(token: str, messages: List[dict], idx: List[int], results: List[dict]):
+    payload = [_postmark_message(messages[i]["to"], messages[i]["subject"], messages[i]["html"],
+                                 messages[i].get("attachment"), messages[i].get("filename", "attachment.pdf")) for i in idx]
+    response = _post("postmark", f"{POSTMARK_API_URL}/email/batch",
+                     {"X-Postmark-Server-Token": token, "Content-Type": "application/json"}, payload, (200,))
+    if response.status_code != 200:
+        logger.error(f"Postmark batch API error {response.status_code} for {len(idx)} messages: {response.text}")
+        for i in idx: results[i].update(sent=False, error=f"HTTP {response.status_code}")
+        return
+    # the batch endpoint answers 200 with one result per message, in request order
+    for i, res in zip(idx, response.json()):
+        ok = res.get("ErrorCode") == 0
+        results[i].update(sent=ok, error=None if ok else res.get("Message"))
+
+def send_bulk(messages: List[dict]) -> List[dict]:
+    """Send many emails in as few provider requests as possible, up to EMAIL_BULK_CONCURRENCY requests at once.
+
+    Each message is a dict with to, subject, html and optional attachment/filename. SendGrid requests
+    group recipients of identical messages as personalizations; Postmark requests go to /email/batch.
+    Returns {"to", "sent", "error"} for every message, in input order.
+    """
+    results = [{"to": m["to"], "sent": False, "error": None} for m in messages]
+    if not messages: return results
+    if PROVIDER == "sendgrid":
+        secret, batches, send = os.getenv("SENDGRID_API_KEY"), _sendgrid_batches(messages), _bulk_sendgrid
+    else:
+        secret, batches, send = os.getenv("POSTMARK_TOKEN"), _postmark_batches(messages), _bulk_postmark
+    if not secret:
+        logger.warning(f"{PROVIDER} credentials not configured - email sending disabled")
+        for r in results: r["error"] = "not configured"
+        return results
+    def run(idx: List[int]):
+        try: send(secret, messages, idx, results)
+        except Exception as e:
+            logger.error(f"Bulk email request for {len(idx)} recipients failed: {str(e)}")
+            for i in idx: results[i].update(sent=False, error=str(e))
+    with ThreadPoolExecutor(max_workers=max(1, min(EMAIL_BULK_CONCURRENCY, len(batches))), thread_name_prefix="email-bulk") as ex:
+        list(ex.map(run, batches))
+    sent = sum(r["sent"] for r in results)
+    logger.info(f"Bulk email via {PROVIDER}: {sent}/{len(results)} sent in {len(batches)} requests")
+    return results
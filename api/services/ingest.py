@@ -0,0 +1,66 @@
+import os, io, csv, hashlib
+from typing import Optional, List, Dict, Tuple
+
+PROBE_BYTES = 4096
+
+def _digest(f, start: int, end: int) -> str:
+    f.seek(start)
+    return hashlib.blake2b(f.read(max(0, end - start)), digest_size=16).hexdigest()
+
+class CsvTail:
+    """Follows an append-only CSV by byte offset.
+
+    poll() parses only rows appended since the last call. If the file was replaced,
+    truncated, or the bytes already consumed no longer match, it re-reads from byte 0
+    and reports a rebuild so callers can drop incremental state.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.rows = 0
+        self.fieldnames: Optional[List[str]] = None
+        self._ino: Optional[int] = None
+        self._head = self._tail = ""
+
+    def _fingerprint(self, f, offset: int) -> Tuple[str, str]:
+        head_end = min(offset, PROBE_BYTES)
+        return _digest(f, 0, head_end), _digest(f, max(head_end, offset - PROBE_BYTES), offset)
+
+    def _consume(self, f, start: int) -> Tuple[int, List[Dict]]:
+        f.seek(start)
+        chunk = f.read()
+        # only take complete lines, and never stop inside a quoted multi-line field
+        end = chunk.rfind(b"\n") + 1
+        while end and chunk[:end].count(b'"') % 2:
+            end = chunk.rfind(b"\n", 0, end - 1) + 1
+        if not end: return start, []
+        text = io.StringIO(chunk[:end].decode("utf-8-sig" if start == 0 else "utf-8"), newline="")
+        if start == 0:
+            reader = csv.DictReader(text)
+            rows = list(reader)
+            self.fieldnames = reader.fieldnames
+        else:
+            rows = list(csv.DictReader(text, fieldnames=self.fieldnames))
+        return start + end, rows
+
+    def poll(self) -> Tuple[bool, List[Dict]]:
+        """Returns (rebuilt, rows): every row when rebuilt, otherwise only newly appended rows."""
+        try:
+            st = os.stat(self.path)
+            f = open(self.path, "rb")
+        except OSError:
+            rebuilt = self.offset > 0 or self._ino is not None
+            self.__init__(self.path)
+            return rebuilt, []
+        with f:
+            rewritten = (self._ino is not None and st.st_ino != self._ino) or st.st_size < self.offset \
+                or (self.offset and self._fingerprint(f, self.offset) != (self._head, self._tail))
+            if rewritten or self._ino is None:
+                self.offset = self.rows = 0
+                self.fieldnames = None
+            start = self.offset
+            self.offset, rows = self._consume(f, start) if st.st_size > start else (start, [])
+            self.rows += len(rows)
+            self._ino = st.st_ino
+            self._head, self._tail = self._fingerprint(f, self.offset)
+        return start == 0, rows
@@ -0,0 +1,192 @@
+import os, time, random, sqlite3, logging, threading
+from typing import Optional, Dict, Callable, Tuple, List
+from services.datastore import data_dir
+from services.emailer import send_bulk
+from services.sqlite_store import BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))                 # messages a worker claims and sends per round
+OUTBOX_POLL_SEC = float(os.getenv("OUTBOX_POLL_SEC", "2"))           # idle wait; enqueues in this process wake workers early
+OUTBOX_LEASE_SEC = int(os.getenv("OUTBOX_LEASE_SEC", "300"))         # claimed rows return to the queue if a worker dies
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SEC = float(os.getenv("OUTBOX_BACKOFF_SEC", "30"))
+OUTBOX_BACKOFF_MAX_SEC = float(os.getenv("OUTBOX_BACKOFF_MAX_SEC", "3600"))
+OUTBOX_DEDUPE_SEC = int(os.getenv("OUTBOX_DEDUPE_SEC", "600"))       # a key already sent this recently is not sent again
+OUTBOX_RETAIN_SEC = int(os.getenv("OUTBOX_RETAIN_SEC", str(7*24*3600)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, to_email TEXT NOT NULL,
+                                   subject TEXT NOT NULL, html TEXT NOT NULL, ref_kind TEXT, ref_id TEXT, filename TEXT,
+                                   status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+                                   next_at REAL NOT NULL, lease_until REAL, created_at REAL NOT NULL, sent_at REAL,
+                                   last_error TEXT);
+CREATE INDEX IF NOT EXISTS ix_outbox_due ON outbox(status, next_at);
+"""
+
+# PDFs are attached by reference and rendered (or read from cache) at send time, so the queue stays small
+_resolvers: Dict[str, Callable[[str], Tuple[bytes, str]]] = {}
+
+def register_attachment(kind: str, resolve: Callable[[str], Tuple[bytes, str]]):
+    """resolve(ref_id) -> (pdf, filename) for messages enqueued with ref=(kind, ref_id)."""
+    _resolvers[kind] = resolve
+
+class Outbox:
+    """Durable email queue in an embedded SQLite file, drained by background sender threads.
+
+    Rows move pending -> sending -> sent, or back to pending with exponential backoff after a
+    failed attempt and to dead after OUTBOX_MAX_ATTEMPTS. A claim is a lease, so messages held by
+    a worker that crashed go out again once it expires; every gunicorn worker can drain the same file.
+    """
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("OUTBOX_PATH") or os.path.join(data_dir(), "outbox.db")
+        self._local = threading.local()
+        self._wake = threading.Event(); self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []; self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "retried": 0, "dead": 0, "deduped": 0, "last_lag_sec": None}
+        with self._conn() as c: c.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, key: str, to_email: str, subject: str, html: str,
+                ref: Optional[Tuple[str, str]] = None, filename: Optional[str] = None) -> Tuple[int, str, bool]:
+        """Queues a message under a dedupe key; returns (id, status, queued).
+
+        A key that is still queued, or was sent within OUTBOX_DEDUPE_SEC, is not queued again.
+        """
+        now = time.time(); kind, ref_id = ref or (None, None)
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT id, status, sent_at FROM outbox WHERE key=?", (key,)).fetchone()
+            if row and (row["status"] in ("pending", "sending") or (row["status"] == "sent" and row["sent_at"] > now - OUTBOX_DEDUPE_SEC)):
+                c.execute("COMMIT"); self.stats["deduped"] += 1
+                return row["id"], row["status"], False
+            c.execute("INSERT INTO outbox (key, to_email, subject, html, ref_kind, ref_id, filename, next_at, created_at) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET to_email=excluded.to_email, "
+                      "subject=excluded.subject, html=excluded.html, ref_kind=excluded.ref_kind, ref_id=excluded.ref_id, "
+                      "filename=excluded.filename, status='pending', attempts=0, next_at=excluded.next_at, lease_until=NULL, "
+                      "created_at=excluded.created_at, sent_at=NULL, last_error=NULL",
+                      (key, to_email, subject, html, kind, ref_id, filename, now, now))
+            msg_id = c.execute("SELECT id FROM outbox WHERE key=?", (key,)).fetchone()[0]
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK"); raise
+        self.start(); self._wake.set()
+        return msg_id, "pending", True
+
+    def _claim(self) -> List[sqlite3.Row]:
+        now = time.time(); c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            rows = c.execute("SELECT * FROM outbox WHERE (status='pending' AND next_at<=?) OR (status='sending' AND lease_until<?) "
+                             "ORDER BY next_at LIMIT ?", (now, now, OUTBOX_BATCH)).fetchall()
+            c.executemany("UPDATE outbox SET status='sending', lease_until=? WHERE id=?", ((now + OUTBOX_LEASE_SEC, r["id"]) for r in rows))
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK"); raise
+        return rows
+
+    def _attach(self, row: sqlite3.Row) -> dict:
+        msg = {"to": row["to_email"], "subject": row["subject"], "html": row["html"]}
+        if row["ref_kind"]:
+            pdf, filename = _resolvers[row["ref_kind"]](row["ref_id"])
+            msg.update(attachment=pdf, filename=row["filename"] or filename)
+        return msg
+
+    def _fail(self, c: sqlite3.Connection, row: sqlite3.Row, error: str):
+        attempts = row["attempts"] + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            c.execute("UPDATE outbox SET status='dead', attempts=?, lease_until=NULL, last_error=? WHERE id=?", (attempts, error, row["id"]))
+            self.stats["dead"] += 1
+            logger.error(f"Outbox gave up on {row['key']} to {row['to_email']} after {attempts} attempts: {error}")
+            return
+        # jittered exponential backoff so a provider outage doesn't end in a synchronized retry storm
+        delay = min(OUTBOX_BACKOFF_MAX_SEC, OUTBOX_BACKOFF_SEC * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        c.execute("UPDATE outbox SET status='pending', attempts=?, next_at=?, lease_until=NULL, last_error=? WHERE id=?",
+                  (attempts, time.time() + delay, error, row["id"]))
+        self.stats["retried"] += 1
+
+    def drain_once(self) -> int:
+        """Claims and sends one batch; returns how many messages were claimed."""
+        rows = self._claim()
+        if not rows: return 0
+        msgs, ready, failures = [], [], []
+        for row in rows:
+            try: msgs.append(self._attach(row)); ready.append(row)
+            except Exception as e: failures.append((row, f"attachment: {str(e)}"))
+        results = send_bulk(msgs) if msgs else []
+        now = time.time(); c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for row, res in zip(ready, results):
+                if res["sent"]:
+                    c.execute("UPDATE outbox SET status='sent', attempts=attempts+1, sent_at=?, lease_until=NULL, last_error=NULL WHERE id=?",
+                              (now, row["id"]))
+                    self.stats["sent"] += 1; self.stats["last_lag_sec"] = round(now - row["created_at"], 3)
+                else: failures.append((row, res["error"] or "send failed"))
+            for row, error in failures: self._fail(c, row, error)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK"); raise
+        return len(rows)
+
+    def _prune(self):
+        self._conn().execute("DELETE FROM outbox WHERE status='sent' AND sent_at<?", (time.time() - OUTBOX_RETAIN_SEC,))
+
+    def _run(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                if self.drain_once(): continue
+                if time.monotonic() - last_prune > 3600: self._prune(); last_prune = time.monotonic()
+            except Exception as e:
+                logger.error(f"Outbox sender error: {str(e)}")
+            self._wake.wait(OUTBOX_POLL_SEC); self._wake.clear()
+
+    def start(self):
+        """Starts the sender threads once per process (again after a fork)."""
+        if self._pid == os.getpid() or OUTBOX_WORKERS <= 0: return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._run, name=f"outbox-sender-{i}", daemon=True) for i in range(OUTBOX_WORKERS)]
+            for t in self._threads: t.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set(); self._wake.set()
+        for t in self._threads: t.join(timeout)
+        self._pid = None
+
+    def metrics(self) -> dict:
+        now = time.time(); c = self._conn()
+        counts = {r["status"]: r["n"] for r in c.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status")}
+        oldest = c.execute("SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+        return {"depth": counts.get("pending", 0) + counts.get("sending", 0), "by_status": counts,
+                "lag_sec": round(now - oldest, 3) if oldest else 0.0, "workers": OUTBOX_WORKERS, **self.stats}
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None: _outbox = Outbox()
+    return _outbox
+
+def outbox_metrics() -> dict:
+    try: return get_outbox().metrics()
+    except Exception as e: return {"error": str(e)}
@@ -0,0 +1,123 @@
+import os, json, time, uuid, logging, threading
+from datetime import datetime
+from typing import Optional, List, Tuple, Iterable, Set, FrozenSet
+
+from services.datastore import get_store
+from services.receipts import receipt_args, statement_args
+from services.render_pool import render_many, RENDER_POOL_SIZE
+from cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+PREWARM_RATE_PER_SEC = float(os.getenv("PREWARM_RATE_PER_SEC", "5"))
+PREWARM_ON_INGEST = os.getenv("PREWARM_ON_INGEST", "true").lower() == "true"
+PREWARM_LOCK_SEC = int(os.getenv("PREWARM_LOCK_SEC", "600"))   # refreshed after every chunk
+STATUS_KEY = b"spark:prewarm:status"
+LOCK_KEY = b"spark:lock:prewarm"
+_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+_lock = threading.Lock()
+_active = False
+_queued: Optional[Tuple[Tuple[str, ...], Optional[int], Optional[FrozenSet[str]]]] = None
+
+def _plan(kinds: Iterable[str], year: Optional[int],
+          donation_ids: Optional[Iterable[str]] = None) -> Tuple[List[Tuple[str, dict, dict]], int]:
+    """(kind, key parts, render kwargs) for every receipt/statement missing from Redis, plus the count already cached.
+
+    donation_ids limits the receipts to those donations (point lookups instead of a scan of every row).
+    """
+    store = get_store(); plan: List[Tuple[str, dict, dict]] = []; cached = 0
+    if "receipts" in kinds:
+        seen: Set[str] = set(); rows = []
+        candidates = store.donations() if donation_ids is None else filter(None, map(store.donation, sorted(donation_ids)))
+        for r in candidates:
+            if r.get("donation_id") and r["donation_id"] not in seen: seen.add(r["donation_id"]); rows.append(r)
+        for r, hit in zip(rows, redis_cache.receipts_cached([r["donation_id"] for r in rows])):
+            if hit: cached += 1; continue
+            plan.append(("receipt", {"donation_id": r["donation_id"]}, receipt_args(r, store.donor(r.get("donor_id", "")))))
+    if "statements" in kinds:
+        table = store.table()
+        donors = sorted(d for (d,) in table.group_by("donor", mask=table.mask(year=year)) if d)
+        for d, hit in zip(donors, redis_cache.statements_cached(donors, year)):
+            donor = store.donor(d)
+            if hit or not donor: cached += hit; continue
+            cents, _, breakdown = store.giving_summary(d, year)
+            plan.append(("statement", {"donor_id": d, "year": year}, statement_args(donor, year, cents, breakdown)))
+    return plan, cached
+
+def _save_status(status: dict):
+    try: redis_cache.r.setex(STATUS_KEY, 7*24*3600, json.dumps(status))
+    except Exception: pass
+
+def prewarm_status() -> dict:
+    try: status = json.loads(redis_cache.r.get(STATUS_KEY) or "{}")
+    except Exception: status = {}
+    try: status.update(redis_cache.prewarm_stats())
+    except Exception: pass
+    return status or {"state": "idle"}
+
+def run_prewarm(kinds: Iterable[str] = ("receipts",), year: Optional[int] = None,
+                donation_ids: Optional[Iterable[str]] = None) -> dict:
+    """Renders every missing receipt/statement (or just donation_ids' receipts) at PREWARM_RATE_PER_SEC; one run at a time across all workers."""
+    kinds = tuple(kinds); token = uuid.uuid4().hex
+    if "statements" in kinds: year = year or datetime.now().year
+    try:
+        if not redis_cache.r.set(LOCK_KEY, token, nx=True, ex=PREWARM_LOCK_SEC): return {"state": "busy"}
+    except Exception as e:
+        logger.warning(f"Cache pre-warm skipped, Redis unavailable: {str(e)}"); return {"state": "redis_unavailable"}
+    status = {"state": "running", "kinds": list(kinds), "year": year, "scope": "all" if donation_ids is None else "changed",
+              "started_at": datetime.utcnow().isoformat(), "planned": 0, "already_cached": 0, "rendered": 0, "failed": 0}
+    try:
+        _save_status(status)
+        plan, status["already_cached"] = _plan(kinds, year, donation_ids); status["planned"] = len(plan)
+        chunk = max(1, RENDER_POOL_SIZE)
+        for i in range(0, len(plan), chunk):
+            part, t0 = plan[i:i+chunk], time.monotonic()
+            receipts, statements = {}, {}
+            for (kind, key, _), pdf in zip(part, render_many([kw for _, _, kw in part])):
+                if pdf is None: status["failed"] += 1; continue
+                if kind == "receipt": receipts[key["donation_id"]] = pdf
+                else: statements[key["donor_id"]] = pdf
+                status["rendered"] += 1
+            if receipts: redis_cache.cache_receipts(receipts, prewarmed=True)
+            if statements: redis_cache.cache_statements(year, statements, prewarmed=True)
+            _save_status(status); redis_cache.r.expire(LOCK_KEY, PREWARM_LOCK_SEC)
+            # throttle: leave the pool to live requests between chunks
+            time.sleep(max(0.0, len(part) / PREWARM_RATE_PER_SEC - (time.monotonic() - t0)))
+        status["state"] = "done"
+    except Exception as e:
+        logger.error(f"Cache pre-warm failed: {str(e)}"); status.update(state="failed", error=str(e))
+    finally:
+        status["finished_at"] = datetime.utcnow().isoformat(); _save_status(status)
+        try: redis_cache.r.eval(_RELEASE, 1, LOCK_KEY, token)
+        except Exception: pass
+    logger.info(f"Cache pre-warm {status['state']}: {status['rendered']} rendered, {status['already_cached']} already cached")
+    return status
+
+def start_prewarm(kinds: Iterable[str] = ("receipts",), year: Optional[int] = None,
+                  donation_ids: Optional[Iterable[str]] = None) -> bool:
+    """Runs the pre-warm in a background thread; requests made while one runs merge into a single follow-up run."""
+    global _active, _queued
+    job = (tuple(kinds), year, None if donation_ids is None else frozenset(donation_ids))
+    with _lock:
+        if _active:
+            prev_kinds, prev_year, prev_ids = _queued or ((), None, frozenset())
+            # a full run anywhere in the merge covers every donation
+            ids = None if job[2] is None or prev_ids is None else prev_ids | job[2]
+            _queued = (tuple(sorted(set(prev_kinds) | set(job[0]))), year or prev_year, ids)
+            return False
+        _active = True
+    def loop(job):
+        global _active, _queued
+        while job:
+            try: run_prewarm(*job)
+            except Exception as e: logger.error(f"Cache pre-warm crashed: {str(e)}")
+            with _lock:
+                job, _queued = _queued, None
+                if not job: _active = False
+    threading.Thread(target=loop, args=(job,), name="cache-prewarm", daemon=True).start()
+    return True
+
+def prewarm_after_ingest(donation_ids: Set[str], donor_ids: Set[str]):
+    """on_data_change listener: new or edited donations get their receipts rendered ahead of the first request."""
+    if PREWARM_ON_INGEST and donation_ids: start_prewarm(("receipts",), donation_ids=donation_ids)
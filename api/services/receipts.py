@@ -1,12 +1,13 @@
-import os, io, csv
-from datetime import datetime
-from typing import Optional, List, Dict
+import os, io
+from functools import lru_cache
+from typing import Optional, List, Dict, Tuple
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.utils import ImageReader
 import qrcode
+from services.datastore import get_store, parse_breakdown, DonationRow
 
 ORG_NAME = os.getenv("SPARK_ORG_NAME", "SparkCreatives Inc.")
 ORG_EIN = os.getenv("SPARK_EIN", "33-4477854")
@@ -21,41 +22,106 @@ def _load_logo_bytes() -> Optional[bytes]:
     except Exception:
         return None
 
-def _qr_bytes(url: str) -> bytes:
-    img = qrcode.make(url)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    return buf.getvalue()
+QR_BORDER = 4  # quiet-zone modules, same as qrcode.make()
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "4096"))
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def _qr_runs(url: str) -> Tuple[int, Tuple[Tuple[int, int, int], ...]]:
+    """(modules per side, (row, col, length) runs of dark modules) for url, LRU-cached for re-rendered receipts."""
+    qr = qrcode.QRCode(border=0); qr.add_data(url); qr.make(fit=True)
+    runs = []
+    for r, row in enumerate(qr.get_matrix()):
+        col = 0
+        while col < len(row):
+            if row[col]:
+                start = col
+                while col < len(row) and row[col]: col += 1
+                runs.append((r, start, col - start))
+            else:
+                col += 1
+    return qr.modules_count, tuple(runs)
+
+def _draw_qr(c, url: str, x: float, y: float, size: float):
+    """Draws the QR module matrix as filled vector rectangles; no PNG encode/decode round trip."""
+    n, runs = _qr_runs(url)
+    cell = size / (n + 2*QR_BORDER)
+    top = y + size - QR_BORDER*cell
+    p = c.beginPath()
+    for r, col, length in runs:
+        p.rect(x + (QR_BORDER + col)*cell, top - (r + 1)*cell, length*cell, cell)
+    c.setFillColor(colors.black)
+    c.drawPath(p, stroke=0, fill=1)
+
+HEADER_RGB = (0.946, 0.592, 0.219)  # #F19738
+LOGO_BOX = 0.8*inch
+LOGO_DPI = 300
 
-def _draw_header(c, W, H, logo_bytes: Optional[bytes]):
-    c.setFillColorRGB(0.946, 0.592, 0.219)  # #F19738
-    c.rect(0, H-1.0*inch, W, 1.0*inch, fill=1, stroke=0)
-    if logo_bytes:
-        try:
-            img = ImageReader(io.BytesIO(logo_bytes))
-            c.drawImage(img, 0.75*inch, H-0.9*inch, width=0.8*inch, height=0.8*inch, preserveAspectRatio=True, mask='auto')
-        except Exception:
-            pass
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(1.8*inch, H-0.55*inch, ORG_NAME[:64])
-    c.setFont("Helvetica", 9.5)
-    c.drawString(1.8*inch, H-0.8*inch, f"EIN: {ORG_EIN} • {ORG_ADDR}")
-
-def _designation_breakdown(rows: List[Dict]) -> List[Dict]:
-    from collections import defaultdict
-    totals = defaultdict(float)
-    for r in rows:
-        des = r.get("designation") or "General Fund"
-        amt = float(r.get("amount") or 0)
-        totals[des] += amt
-    return [{"designation": k, "amount": v} for k,v in sorted(totals.items())]
+def _prepare_logo(logo_bytes: Optional[bytes]) -> Optional[ImageReader]:
+    """Decodes the logo once, downsamples it to the printed box and flattens alpha onto the header band."""
+    if not logo_bytes: return None
+    try:
+        from PIL import Image
+        im = Image.open(io.BytesIO(logo_bytes)).convert("RGBA")
+        px = int(LOGO_BOX / 72 * LOGO_DPI)
+        im.thumbnail((px, px))
+        flat = Image.new("RGB", im.size, tuple(int(round(v*255)) for v in HEADER_RGB))
+        flat.paste(im, mask=im.split()[3])
+        img = ImageReader(flat); img.getRGBData()  # ImageReader keeps the raw pixels from here on
+        return img
+    except Exception:
+        return None
+
+STATIC_FORM = "SparkStatic"
+
+class ReceiptTemplate:
+    """Static receipt furniture: header band, logo, org name/EIN lines and legal footer.
+
+    The logo is decoded and the text laid out once per process. reportlab forms belong to a
+    document, so the furniture is drawn into a Form XObject the first time a document needs
+    it and every page after that references the same form instead of redrawing it.
+    """
+    def __init__(self, logo_bytes: Optional[bytes]):
+        self.logo = _prepare_logo(logo_bytes)
+        self.org_line = ORG_NAME[:64]
+        self.ein_line = f"EIN: {ORG_EIN} • {ORG_ADDR}"
+
+    def draw(self, c, W, H):
+        """Stamps the header, org block and footer on the current page; leaves the caller's graphics state alone."""
+        if not c.hasForm(STATIC_FORM):
+            c.beginForm(STATIC_FORM)
+            self.draw_header(c, W, H); self.draw_footer(c, W)
+            c.endForm()
+        c.doForm(STATIC_FORM)
+
+    def draw_header(self, c, W, H):
+        c.setFillColorRGB(*HEADER_RGB)
+        c.rect(0, H-1.0*inch, W, 1.0*inch, fill=1, stroke=0)
+        if self.logo is not None:
+            try: c.drawImage(self.logo, 0.75*inch, H-0.9*inch, width=LOGO_BOX, height=LOGO_BOX, preserveAspectRatio=True)
+            except Exception: pass
+        c.setFillColor(colors.white)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(1.8*inch, H-0.55*inch, self.org_line)
+        c.setFont("Helvetica", 9.5)
+        c.drawString(1.8*inch, H-0.8*inch, self.ein_line)
+
+    def draw_footer(self, c, W):
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Oblique", 9.5)
+        c.drawString(0.75*inch, 0.95*inch, "No goods or services were provided in exchange for this contribution.")
+        c.setFont("Helvetica", 8.5)
+        c.drawString(0.75*inch, 0.75*inch, "Thank you for fueling creativity and shipping boxes of hope.")
+
+@lru_cache(maxsize=1)
+def receipt_template() -> ReceiptTemplate:
+    return ReceiptTemplate(_load_logo_bytes())
 
 def generate_receipt_pdf(receipt_id: str, donor_name: str, donation_amount: float, donation_date: str,
                          designation: str, restricted: bool, payment_method: str,
                          soft_credit_to: Optional[str]=None, line_items: Optional[List[Dict]]=None) -> bytes:
-    buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=LETTER); W,H = LETTER
-    _draw_header(c, W, H, _load_logo_bytes())
+    # invariant=1 pins reportlab's creation date and document ID so identical inputs give identical bytes
+    buf = io.BytesIO(); c = canvas.Canvas(buf, pagesize=LETTER, invariant=1); W,H = LETTER
+    receipt_template().draw(c, W, H)
 
     y = H - 1.25*inch
     c.setFillColor(colors.black)
@@ -88,46 +154,48 @@ def generate_receipt_pdf(receipt_id: str, donor_name: str, donation_amount: floa
 
     verify_url = f"{BASE_VERIFY_URL}?rid={receipt_id}"
     try:
-        qr_png = _qr_bytes(verify_url)
-        c.drawImage(ImageReader(io.BytesIO(qr_png)), W-1.9*inch, 0.9*inch, width=1.1*inch, height=1.1*inch, mask='auto')
+        _draw_qr(c, verify_url, W-1.9*inch, 0.9*inch, 1.1*inch)
         c.setFont("Helvetica", 8.5); c.drawRightString(W-0.75*inch, 0.85*inch, "Verify receipt")
     except Exception:
         pass
 
-    c.setFont("Helvetica-Oblique", 9.5)
-    c.drawString(0.75*inch, 0.95*inch, "No goods or services were provided in exchange for this contribution.")
-    c.setFont("Helvetica", 8.5)
-    c.drawString(0.75*inch, 0.75*inch, "Thank you for fueling creativity and shipping boxes of hope.")
-    c.drawRightString(W-0.75*inch, 0.75*inch, datetime.utcnow().strftime("Generated %Y-%m-%d %H:%M UTC"))
+    c.setFillColor(colors.black); c.setFont("Helvetica", 8.5)
+    c.drawRightString(W-0.75*inch, 0.75*inch, f"Issued {donation_date}")
     c.showPage(); c.save()
     return buf.getvalue()
 
-def _load_csv(name: str):
-    data_dir = os.getenv("DATA_DIR", "/app/data")
-    path = os.path.join(data_dir, name)
-    with open(path, newline="", encoding="utf-8") as f:
-        import csv; return list(csv.DictReader(f))
-
 def find_donation(donation_id: str) -> Optional[dict]:
-    for r in _load_csv("donations.csv"):
-        if r.get("donation_id")==donation_id:
-            return r
-    return None
+    return get_store().donation(donation_id)
 
 def find_donor(donor_id: str) -> Optional[dict]:
-    for r in _load_csv("donors.csv"):
-        if r.get("donor_id")==donor_id:
-            return r
-    return None
+    return get_store().donor(donor_id)
+
+def receipt_id_for(row: dict) -> str:
+    return row.get("receipt_id") or f"RCPT-{row.get('donation_id', '')}"
+
+def receipt_args(row: dict, donor: Optional[dict] = None) -> dict:
+    """generate_receipt_pdf keyword arguments for a donation row and its donor."""
+    donor = donor or {"primary_contact_name": "Donor", "email": ""}
+    return dict(
+        receipt_id=receipt_id_for(row), 
+        donor_name=donor["primary_contact_name"],
+        donation_amount=float(row.get("amount", "0") or 0), 
+        donation_date=(row.get("received_at") or "")[:10],
+        designation=row.get("designation", "General Fund"), 
+        restricted=(row.get("restricted", "no").lower() == "yes"),
+        payment_method=(row.get("method", "square")).title(), 
+        soft_credit_to=row.get("soft_credit_to") or None,
+        line_items=line_items_from_row(row)
+    )
+
+def statement_args(donor: dict, year: int, cents: int, breakdown: Optional[list]) -> dict:
+    """generate_receipt_pdf keyword arguments for a donor's annual statement."""
+    return dict(
+        receipt_id=f"YEAR-{year}-{donor.get('donor_id', '')}", donor_name=donor.get("primary_contact_name", "Donor"),
+        donation_amount=cents / 100, donation_date=f"{year}-12-31", designation=f"Annual Statement {year}",
+        restricted=False, payment_method="Multiple", soft_credit_to=None, line_items=breakdown
+    )
 
 def line_items_from_row(row: dict) -> Optional[list]:
-    br = (row.get("designation_breakdown") or "").strip()
-    if not br: return None
-    out = []
-    for part in br.split(";"):
-        if ":" in part:
-            d,a = part.split(":",1)
-            try:
-                out.append({"designation":d.strip(), "amount":float(a)})
-            except: pass
-    return out or None
+    if isinstance(row, DonationRow): return row.line_items
+    return parse_breakdown(row.get("designation_breakdown"))
@@ -1,10 +1,8 @@
 import os, csv, json
-from collections import defaultdict
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 from typing import Dict, List
-
-def dec(v: str) -> Decimal:
-    return Decimal(v or "0").quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+from services.datastore import get_store
+from services.columnar import DonationTable, cents_str
 
 def _load_csv(path: str) -> List[Dict]:
     with open(path, newline="", encoding="utf-8") as f:
@@ -13,15 +11,12 @@ def _load_csv(path: str) -> List[Dict]:
 def run_reconciliation(data_dir: str) -> Dict:
     sq_path = os.path.join(data_dir, "donations.csv")
     internal_path = os.path.join(data_dir, "internal_donations.csv")
-    sq = _load_csv(sq_path) if os.path.exists(sq_path) else []
-    internal = _load_csv(internal_path) if os.path.exists(internal_path) else []
-    def rollup(rows: List[Dict]):
-        by_des, total = defaultdict(Decimal), Decimal("0.00")
-        for r in rows:
-            des = r.get("designation") or "General Fund"
-            amt = dec(r.get("amount"))
-            by_des[des] += amt; total += amt
-        return {"total": f"{total:.2f}", "by_designation": {k: f"{v:.2f}" for k,v in sorted(by_des.items())}}
+    sq = get_store(data_dir).table() if os.path.exists(sq_path) else DonationTable([])
+    internal = DonationTable(_load_csv(internal_path) if os.path.exists(internal_path) else [])
+    def rollup(table: DonationTable):
+        by_des = table.group_by("designation")
+        return {"total": cents_str(table.total()[0]),
+                "by_designation": {k[0]: cents_str(v[0]) for k,v in sorted(by_des.items())}}
     res = {"square": rollup(sq), "internal": rollup(internal)}
     try:
         res["variance_total"] = f'{Decimal(res["square"]["total"]) - Decimal(res["internal"]["total"]):.2f}'
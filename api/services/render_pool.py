@@ -0,0 +1,175 @@
+import os, time, signal, logging, itertools, threading, multiprocessing
+from concurrent.futures import Future, CancelledError, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty
+from typing import Optional, List, Dict
+
+from services.receipts import generate_receipt_pdf
+
+logger = logging.getLogger(__name__)
+
+RENDER_POOL_SIZE = int(os.getenv("RENDER_POOL_SIZE", str(os.cpu_count() or 1)))  # 0 renders inline
+RENDER_TIMEOUT_SEC = float(os.getenv("RENDER_TIMEOUT_SEC", "30"))             # per render, counted from when it starts
+RENDER_QUEUE_TIMEOUT_SEC = float(os.getenv("RENDER_QUEUE_TIMEOUT_SEC", "30"))  # a render still queued after this is dropped
+RENDER_KILL_GRACE_SEC = float(os.getenv("RENDER_KILL_GRACE_SEC", "5"))        # worker ignoring its alarm this long is killed
+RENDER_MAX_TASKS_PER_CHILD = int(os.getenv("RENDER_MAX_TASKS_PER_CHILD", "500"))
+
+class RenderError(Exception):
+    """Base for render failures that mean "try again later" (503), not a bad request or a bug."""
+
+class RenderTimeout(RenderError):
+    pass
+
+class RenderUnavailable(RenderError):
+    pass
+
+# --- worker side -----------------------------------------------------------------------------
+_started = None
+
+def _on_alarm(signum, frame):
+    raise RenderTimeout(f"PDF render exceeded {RENDER_TIMEOUT_SEC}s")
+
+def _init_worker(started):
+    global _started
+    _started = started
+    signal.signal(signal.SIGALRM, _on_alarm)
+
+def _run_task(task_id: int, queued_until: float, timeout: float, fn, args, kwargs):
+    if time.time() > queued_until: raise RenderUnavailable("Render queue is backed up")
+    _started.put((task_id, os.getpid(), time.monotonic()))
+    # the deadline covers this render only; time spent queued behind other work doesn't count
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try: return fn(*args, **kwargs)
+    finally: signal.setitimer(signal.ITIMER_REAL, 0)
+
+# --- parent side -----------------------------------------------------------------------------
+_pool = None
+_started_q = None
+_pool_lock = threading.Lock()
+_tasks: Dict[int, list] = {}          # task id -> [future, worker pid, started (monotonic)]
+_tasks_lock = threading.Lock()
+_ids = itertools.count()
+stats = {"timeouts": 0, "killed": 0, "dropped": 0}
+
+def _finish(task_id: int, result=None, error: Optional[BaseException] = None):
+    with _tasks_lock: entry = _tasks.pop(task_id, None)
+    if entry is None or entry[0].done(): return
+    if error is None: entry[0].set_result(result)
+    else:
+        if isinstance(error, RenderTimeout): stats["timeouts"] += 1
+        elif isinstance(error, RenderUnavailable): stats["dropped"] += 1
+        entry[0].set_exception(error)
+
+def _watchdog(pool, started):
+    """Records which worker picked up each task and kills only a worker wedged past its deadline.
+
+    A render normally ends itself through the worker's alarm; this catches one stuck in C code.
+    multiprocessing.Pool replaces the killed worker, so other renders keep running.
+    """
+    while _pool is pool:
+        try:
+            task_id, pid, t0 = started.get(timeout=0.25)
+            with _tasks_lock:
+                if task_id in _tasks: _tasks[task_id][1:] = [pid, t0]
+            continue
+        except Empty: pass
+        except Exception: return
+        now = time.monotonic()
+        with _tasks_lock:
+            stuck = [(tid, e[1]) for tid, e in _tasks.items() if e[2] is not None and now - e[2] > RENDER_TIMEOUT_SEC + RENDER_KILL_GRACE_SEC]
+        for tid, pid in stuck:
+            logger.error(f"Render worker {pid} stuck past {RENDER_TIMEOUT_SEC}s - killing it")
+            try: os.kill(pid, signal.SIGKILL); stats["killed"] += 1
+            except OSError: pass
+            _finish(tid, error=RenderTimeout("PDF render timed out"))
+
+def _executor():
+    global _pool, _started_q
+    if RENDER_POOL_SIZE <= 0: return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn keeps reportlab/redis state out of the children; maxtasksperchild recycles them
+                ctx = multiprocessing.get_context("spawn")
+                _started_q = ctx.Queue()
+                _pool = ctx.Pool(RENDER_POOL_SIZE, initializer=_init_worker, initargs=(_started_q,),
+                                 maxtasksperchild=RENDER_MAX_TASKS_PER_CHILD or None)
+                threading.Thread(target=_watchdog, args=(_pool, _started_q), name="render-watchdog", daemon=True).start()
+    return _pool
+
+def _fail_all(error: BaseException):
+    with _tasks_lock: ids = list(_tasks)
+    for tid in ids: _finish(tid, error=error)
+
+def _recycle(pool):
+    """Replaces a pool that stopped accepting work."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool: _pool = None
+    try: pool.terminate()
+    except Exception: pass
+    _fail_all(RenderUnavailable("Render pool restarted"))
+
+def submit_task(fn, *args, **kwargs) -> Future:
+    """Queues a module-level render function on the pool (or runs it inline when the pool is disabled)."""
+    fut: Future = Future()
+    for attempt in range(2):
+        pool = _executor()
+        if pool is None: break
+        task_id = next(_ids)
+        with _tasks_lock: _tasks[task_id] = [fut, None, None]
+        try:
+            pool.apply_async(_run_task, (task_id, time.time() + RENDER_QUEUE_TIMEOUT_SEC, RENDER_TIMEOUT_SEC, fn, args, kwargs),
+                             callback=lambda res, t=task_id: _finish(t, res),
+                             error_callback=lambda e, t=task_id: _finish(t, error=e))
+            fut.set_running_or_notify_cancel()
+            return fut
+        except ValueError:   # pool closed underneath us
+            with _tasks_lock: _tasks.pop(task_id, None)
+            _recycle(pool)
+    try: fut.set_result(fn(*args, **kwargs))
+    except Exception as e: fut.set_exception(e)
+    return fut
+
+def submit_receipt_pdf(**kwargs) -> Future:
+    return submit_task(generate_receipt_pdf, **kwargs)
+
+def wait_pdf(fut: Future, timeout: Optional[float] = None) -> bytes:
+    """Result of a submitted render; pool-side failures surface as RenderError subclasses."""
+    # the pool resolves every future itself; this is only a backstop against a lost result
+    limit = RENDER_QUEUE_TIMEOUT_SEC + RENDER_TIMEOUT_SEC + RENDER_KILL_GRACE_SEC + 1 if timeout is None else timeout
+    try:
+        return fut.result(timeout=limit)
+    except FutureTimeout:
+        raise RenderTimeout("PDF render timed out")
+    except (BrokenProcessPool, CancelledError) as e:
+        raise RenderUnavailable(f"Render pool unavailable: {e.__class__.__name__}")
+
+def render_receipt_pdf(**kwargs) -> bytes:
+    """generate_receipt_pdf off the request thread, in a separate process, bounded by RENDER_TIMEOUT_SEC."""
+    return wait_pdf(submit_receipt_pdf(**kwargs))
+
+def render_many(jobs: List[dict]) -> List[Optional[bytes]]:
+    """Renders a batch across the pool; a failed or timed-out render yields None for that job."""
+    futs = [submit_receipt_pdf(**kw) for kw in jobs]
+    out: List[Optional[bytes]] = []
+    for f in futs:
+        try: out.append(wait_pdf(f))
+        except Exception as e:
+            logger.warning(f"Batch render failed: {str(e)}"); out.append(None)
+    return out
+
+def pool_status() -> dict:
+    with _tasks_lock:
+        running = sum(1 for e in _tasks.values() if e[2] is not None); queued = len(_tasks) - running
+    return {"size": RENDER_POOL_SIZE, "started": _pool is not None, "timeout_sec": RENDER_TIMEOUT_SEC,
+            "queue_timeout_sec": RENDER_QUEUE_TIMEOUT_SEC, "max_tasks_per_child": RENDER_MAX_TASKS_PER_CHILD,
+            "running": running, "queued": queued, **stats}
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close(); pool.terminate()
+        _fail_all(RenderUnavailable("Render pool shut down"))
@@ -0,0 +1,322 @@
+import os, csv, json, mmap, fcntl, zlib, threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple, Callable
+import numpy as np
+
+from services.datastore import DonationRow, to_cents, diff_rows, notify_changed, DONATION_COLUMNS, DONOR_COLUMNS
+from services.aggregates import net_summary, get_refund_ledger
+
+MAGIC = b"SPKSNAP1"
+EMPTY = np.uint32(0xFFFFFFFF)
+DONATION_DTYPE = np.dtype([("cents", "<i8"), ("year", "<u2")] + [(c, "<u4") for c in DONATION_COLUMNS])
+DONOR_DTYPE = np.dtype([(c, "<u4") for c in DONOR_COLUMNS])
+# the giving_summary aggregate: one record per (donor, year, designation), rebuilt with every snapshot
+GIVING_DTYPE = np.dtype([("cents", "<i8"), ("count", "<u4"), ("year", "<u2"), ("donor_id", "<u4"), ("designation", "<u4")])
+# name -> (record section, key column) for the group indexes stored in the file
+INDEXES = {"donation_id": ("donations", "donation_id"), "receipt_id": ("donations", "receipt_id"),
+           "square_payment_id": ("donations", "square_payment_id"), "donor": ("donations", "donor_id"),
+           "org": ("donations", "org_id"), "donor_id": ("donors", "donor_id"), "giving": ("giving", "donor_id")}
+
+def _key_hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+def _csv_sig(directory: str) -> str:
+    sigs = []
+    for name in ("donations.csv", "donors.csv"):
+        try: st = os.stat(os.path.join(directory, name)); sigs.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except OSError: sigs.append("")
+    return "|".join(sigs)
+
+def _read_csv(path: str) -> List[Dict]:
+    if not os.path.exists(path): return []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+class _StringTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[bytes] = []
+
+    def add(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings); self.strings.append(s.encode("utf-8"))
+        return i
+
+def _group_index(keys: np.ndarray, strings: List[bytes], rank: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """Open-addressing hash table from key string -> [start, len) run in an order array of record indexes."""
+    groups: Dict[int, List[int]] = {}
+    order_by = np.argsort(rank, kind="stable") if rank is not None else range(len(keys))
+    for i in order_by:
+        k = int(keys[i])
+        if strings[k]: groups.setdefault(k, []).append(int(i))
+    cap = 8
+    while cap < 2 * len(groups): cap *= 2
+    slots = np.full(cap, EMPTY, dtype="<u4")
+    gkey, gstart, glen, order = [], [], [], []
+    for g, (k, idxs) in enumerate(groups.items()):
+        gkey.append(k); gstart.append(len(order)); glen.append(len(idxs)); order.extend(idxs)
+        h = _key_hash(strings[k]) & (cap - 1)
+        while slots[h] != EMPTY: h = (h + 1) & (cap - 1)
+        slots[h] = g
+    return {"slots": slots, "key": np.array(gkey, dtype="<u4"), "start": np.array(gstart, dtype="<u4"),
+            "len": np.array(glen, dtype="<u4"), "order": np.array(order, dtype="<u4")}
+
+def build_snapshot(directory: str, path: str) -> Dict:
+    """Writes DATA_DIR's CSVs as fixed-width records plus a deduplicated string table, atomically replacing path."""
+    sig = _csv_sig(directory)
+    donations = _read_csv(os.path.join(directory, "donations.csv"))
+    donors = _read_csv(os.path.join(directory, "donors.csv"))
+    st = _StringTable(); st.add("")
+    don = np.zeros(len(donations), dtype=DONATION_DTYPE)
+    for i, r in enumerate(donations):
+        year = (r.get("received_at") or "")[:4]
+        don[i]["cents"] = to_cents(r.get("amount")); don[i]["year"] = int(year) if year.isdigit() else 0
+        for c in DONATION_COLUMNS: don[i][c] = st.add(r.get(c) or "")
+    dnr = np.zeros(len(donors), dtype=DONOR_DTYPE)
+    for i, r in enumerate(donors):
+        for c in DONOR_COLUMNS: dnr[i][c] = st.add(r.get(c) or "")
+    agg: Dict[Tuple[int, int, int], list] = {}
+    for rec in don:
+        e = agg.setdefault((int(rec["donor_id"]), int(rec["year"]), int(rec["designation"]) or st.add("General Fund")), [0, 0])
+        e[0] += int(rec["cents"]); e[1] += 1
+    giving = np.zeros(len(agg), dtype=GIVING_DTYPE)
+    for i, ((donor, year, des), (cents, count)) in enumerate(agg.items()):
+        giving[i] = (cents, count, year, donor, des)
+    sections: Dict[str, np.ndarray] = {"donations": don, "donors": dnr, "giving": giving}
+    for name, (table, col) in INDEXES.items():
+        recs = sections[table]
+        rank = recs["received_at"] if name == "donor" else None
+        if rank is not None: rank = np.array([st.strings[int(x)] for x in rank], dtype=object)
+        for part, arr in _group_index(recs[col], st.strings, rank).items(): sections[f"ix.{name}.{part}"] = arr
+    offsets = np.zeros(len(st.strings) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(s) for s in st.strings])
+    sections["str.offsets"] = offsets
+    sections["str.blob"] = np.frombuffer(b"".join(st.strings), dtype="u1")
+
+    layout, pos = {}, 0
+    for name, arr in sections.items():
+        layout[name] = {"offset": pos, "count": int(arr.shape[0]), "dtype": arr.dtype.descr if arr.dtype.names else arr.dtype.str}
+        pos += arr.nbytes; pos += -pos % 8
+    header = json.dumps({"csv_sig": sig, "sections": layout}).encode("utf-8")
+    base = len(MAGIC) + 4 + len(header); base += -base % 8
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+        for name, arr in sections.items():
+            f.seek(base + layout[name]["offset"]); f.write(arr.tobytes())
+        f.truncate(base + pos)
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"donations": len(donations), "donors": len(donors), "strings": len(st.strings), "bytes": base + pos}
+
+class SnapshotFile:
+    """Read-only mmap view of a snapshot; record arrays are zero-copy numpy views over the page cache."""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.ino = os.fstat(f.fileno()).st_ino
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC: raise ValueError(f"{path} is not a donation snapshot")
+        hlen = int.from_bytes(self.mm[len(MAGIC):len(MAGIC) + 4], "little")
+        meta = json.loads(self.mm[len(MAGIC) + 4:len(MAGIC) + 4 + hlen])
+        base = len(MAGIC) + 4 + hlen; base += -base % 8
+        self.csv_sig = meta["csv_sig"]
+        self.s: Dict[str, np.ndarray] = {}
+        for name, sec in meta["sections"].items():
+            dt = np.dtype([tuple(x) for x in sec["dtype"]]) if isinstance(sec["dtype"], list) else np.dtype(sec["dtype"])
+            self.s[name] = np.frombuffer(self.mm, dtype=dt, count=sec["count"], offset=base + sec["offset"])
+        self.donations, self.donors = self.s["donations"], self.s["donors"]
+        self.readers = 0; self.retired = False   # guarded by the owning SnapshotStore's lock
+        self._rows: Dict[str, List[Dict]] = {}
+
+    def raw(self, i: int) -> bytes:
+        o = self.s["str.offsets"]
+        return self.s["str.blob"][int(o[i]):int(o[i + 1])].tobytes()
+
+    def string(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def lookup(self, index: str, key: str) -> np.ndarray:
+        """Record indexes whose key column equals key (donor runs are ordered by received_at)."""
+        slots = self.s[f"ix.{index}.slots"]; cap = slots.shape[0]
+        kb = key.encode("utf-8"); h = _key_hash(kb) & (cap - 1)
+        while slots[h] != EMPTY:
+            g = int(slots[h])
+            if self.raw(int(self.s[f"ix.{index}.key"][g])) == kb:
+                start = int(self.s[f"ix.{index}.start"][g])
+                return self.s[f"ix.{index}.order"][start:start + int(self.s[f"ix.{index}.len"][g])]
+            h = (h + 1) & (cap - 1)
+        return self.s[f"ix.{index}.order"][:0]
+
+    def donation(self, i: int) -> DonationRow:
+        rec = self.donations[int(i)]
+        return DonationRow({c: self.string(int(rec[c])) for c in DONATION_COLUMNS})
+
+    def donor(self, i: int) -> Dict:
+        rec = self.donors[int(i)]
+        return {c: self.string(int(rec[c])) for c in DONOR_COLUMNS}
+
+    def rows(self, kind: str) -> List[Dict]:
+        """Every "donation" or "donor" record, decoded once per file and shared by later calls."""
+        rows = self._rows.get(kind)
+        if rows is None:
+            n = (self.donations if kind == "donation" else self.donors).shape[0]
+            rows = self._rows.setdefault(kind, [getattr(self, kind)(i) for i in range(n)])
+        return rows
+
+    def close(self):
+        """Unmaps the file. Decoded rows stay usable; the record arrays do not."""
+        self.s = {}; self.donations = self.donors = None
+        try: self.mm.close()
+        except BufferError: pass   # a view escaped (e.g. an old table); the mapping is freed with it
+
+class SnapshotStore:
+    """DataStore-compatible backend over a shared mmap snapshot (DATA_BACKEND=snapshot).
+
+    The snapshot is rebuilt under an flock when the CSVs change; every worker maps the same
+    file, so startup costs one mmap and the record pages are shared through the page cache.
+    """
+    def __init__(self, directory: str, path: Optional[str] = None):
+        self.dir = directory
+        self.path = path or os.getenv("SNAPSHOT_PATH") or os.path.join(directory, "spark.snap")
+        self._lock = threading.Lock()
+        self._file: Optional[SnapshotFile] = None
+        self._sig: Optional[str] = None
+        self._table = None
+
+    @contextmanager
+    def _reading(self):
+        """Leases the current snapshot; a file replaced by a rebuild is unmapped once its last lease ends."""
+        sig = _csv_sig(self.dir); changed = None
+        with self._lock:
+            if self._file is None or sig != self._sig:
+                old = self._file
+                self._file, changed = self._fresh(sig); self._sig = sig; self._table = None
+                if old is not None and old is not self._file: old.retired = True; self._maybe_close(old)
+            f = self._file; f.readers += 1
+        if changed: notify_changed(*changed)
+        try: yield f
+        finally:
+            with self._lock: f.readers -= 1; self._maybe_close(f)
+
+    @staticmethod
+    def _maybe_close(f: SnapshotFile):
+        if f.retired and f.readers == 0: f.close()
+
+    def _fresh(self, sig: str) -> Tuple[SnapshotFile, Optional[Tuple[set, set]]]:
+        """The snapshot for sig, plus the changed ids when this worker rebuilt it over an older one.
+
+        Only the rebuilding worker diffs and announces a change; the rest just map its output,
+        so caches are bumped once per CSV edit rather than once per worker.
+        """
+        def usable(snap: Optional[SnapshotFile]) -> bool:
+            # a file written before the giving section existed is rebuilt like a stale one
+            return snap is not None and "giving" in snap.s and (snap.csv_sig == sig or sig == "|")
+        def discard(snap: Optional[SnapshotFile]):
+            if snap is not None and snap is not self._file: snap.close()   # mapped here, never handed out
+        snap = self._try_open()
+        if usable(snap): return snap, None
+        with open(f"{self.path}.lock", "w") as lk:
+            fcntl.flock(lk, fcntl.LOCK_EX)  # one worker rebuilds; the rest wait and map its output
+            discard(snap); snap = self._try_open()
+            if usable(snap): return snap, None
+            build_snapshot(self.dir, self.path); new = SnapshotFile(self.path)
+            changed = None if snap is None else diff_rows(snap.rows("donation"), snap.rows("donor"),
+                                                           new.rows("donation"), new.rows("donor"))
+            discard(snap)
+        return new, changed
+
+    def _try_open(self) -> Optional[SnapshotFile]:
+        if self._file is not None:
+            try:
+                if os.stat(self.path).st_ino == self._file.ino: return self._file
+            except OSError: return None
+        try: return SnapshotFile(self.path)
+        except (OSError, ValueError): return None
+
+    def reload(self):
+        with self._lock: self._sig = None
+        with self._reading() as f: return f
+
+    def _first(self, index: str, key: str) -> Optional[DonationRow]:
+        with self._reading() as f:
+            hits = f.lookup(index, key)
+            return f.donation(hits[0]) if hits.size else None
+
+    def donation(self, donation_id: str) -> Optional[DonationRow]:
+        return self._first("donation_id", donation_id)
+
+    def donation_by_receipt(self, receipt_id: str) -> Optional[DonationRow]:
+        return self._first("receipt_id", receipt_id)
+
+    def donation_by_payment(self, square_payment_id: str) -> Optional[DonationRow]:
+        return self._first("square_payment_id", square_payment_id)
+
+    def donor(self, donor_id: str) -> Optional[Dict]:
+        with self._reading() as f:
+            hits = f.lookup("donor_id", donor_id)
+            return f.donor(hits[0]) if hits.size else None
+
+    def donations(self) -> List[DonationRow]:
+        with self._reading() as f: return f.rows("donation")
+
+    def donors(self) -> List[Dict]:
+        with self._reading() as f: return f.rows("donor")
+
+    def donations_for_org(self, org_id: str) -> List[DonationRow]:
+        with self._reading() as f: return [f.donation(i) for i in np.sort(f.lookup("org", org_id))]
+
+    def _donor_hits(self, f: SnapshotFile, donor_id: str, year: Optional[int]) -> np.ndarray:
+        hits = f.lookup("donor", donor_id)
+        return hits if year is None else hits[f.donations["year"][hits] == int(year)]
+
+    def donations_for_donor(self, donor_id: str, year: Optional[int] = None) -> List[DonationRow]:
+        with self._reading() as f: return [f.donation(i) for i in self._donor_hits(f, donor_id, year)]
+
+    def giving_summary(self, donor_id: str, year: int) -> Tuple[int, int, List[Dict]]:
+        """(total_cents, count, designation breakdown) for one donor-year from the giving section, net of refunds."""
+        with self._reading() as f:
+            recs = f.s["giving"][f.lookup("giving", donor_id)]
+            recs = recs[recs["year"] == int(year)]
+            totals = {f.string(des): cents for des, cents in zip(recs["designation"].tolist(), recs["cents"].tolist())}
+            count = int(recs["count"].sum())
+        return net_summary(totals, count, get_refund_ledger(self.dir), donor_id, year)
+
+    def giving_summaries(self, year: int) -> Dict[str, Tuple[int, int, List[Dict]]]:
+        """giving_summary for every donor with gifts in year, from the giving section's records for that year."""
+        grouped: Dict[str, list] = {}
+        with self._reading() as f:
+            recs = f.s["giving"]; recs = recs[recs["year"] == int(year)]
+            for donor, des, cents, count in zip(recs["donor_id"].tolist(), recs["designation"].tolist(),
+                                                recs["cents"].tolist(), recs["count"].tolist()):
+                donor = f.string(donor)
+                if not donor: continue
+                e = grouped.setdefault(donor, [{}, 0]); e[0][f.string(des)] = cents; e[1] += count
+        refunds = get_refund_ledger(self.dir)
+        return {d: net_summary(totals, count, refunds, d, year) for d, (totals, count) in grouped.items()}
+
+    def donations_between(self, start: str, end: str, donor_id: Optional[str] = None,
+                          org_id: Optional[str] = None) -> List[DonationRow]:
+        rows = self.donations_for_donor(donor_id) if donor_id is not None else \
+            self.donations_for_org(org_id) if org_id is not None else self.donations()
+        return [r for r in rows if start <= (r.get("received_at") or "") < end
+                and (org_id is None or r.get("org_id") == org_id)]
+
+    def table(self):
+        with self._reading() as f:
+            t = self._table
+            if t is None:
+                from services.columnar import DonationTable
+                recs = f.donations; label: Callable[[int], str] = f.string
+                # labels are resolved while building and cents is copied, so the table outlives the mapping
+                t = self._table = DonationTable.from_codes(recs["cents"].copy(), {
+                    "donor": (recs["donor_id"], label),
+                    "year": (recs["year"], lambda y: str(y) if y else ""),
+                    "designation": (recs["designation"], lambda i: label(i) or "General Fund"),
+                    "org": (recs["org_id"], label)})
+        return t
+
+if __name__ == "__main__":
+    from services.datastore import data_dir
+    store = SnapshotStore(data_dir())
+    print(build_snapshot(store.dir, store.path))
@@ -0,0 +1,200 @@
+import os, csv, sqlite3, threading
+from typing import Optional, List, Dict, Tuple, Iterable
+from services.datastore import DonationRow, to_cents, diff_rows, notify_changed, DONATION_COLUMNS, DONOR_COLUMNS
+from services.aggregates import net_summary, get_refund_ledger
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS donations (rowid INTEGER PRIMARY KEY, {", ".join(f"{c} TEXT" for c in DONATION_COLUMNS)},
+                                      amount_cents INTEGER NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS ix_donations_id ON donations(donation_id);
+CREATE INDEX IF NOT EXISTS ix_donations_receipt ON donations(receipt_id);
+CREATE INDEX IF NOT EXISTS ix_donations_payment ON donations(square_payment_id);
+CREATE INDEX IF NOT EXISTS ix_donations_org ON donations(org_id, received_at);
+CREATE INDEX IF NOT EXISTS ix_donations_donor ON donations(donor_id, received_at);
+CREATE INDEX IF NOT EXISTS ix_donations_received ON donations(received_at);
+CREATE TABLE IF NOT EXISTS donors (rowid INTEGER PRIMARY KEY, {", ".join(f"{c} TEXT" for c in DONOR_COLUMNS)});
+CREATE INDEX IF NOT EXISTS ix_donors_id ON donors(donor_id);
+CREATE TABLE IF NOT EXISTS giving (donor_id TEXT NOT NULL, year TEXT NOT NULL, designation TEXT NOT NULL,
+                                   cents INTEGER NOT NULL, count INTEGER NOT NULL,
+                                   PRIMARY KEY (donor_id, year, designation)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_giving_year ON giving(year);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def _csv_sig(path: str) -> str:
+    try: st = os.stat(path); return f"{st.st_mtime_ns}:{st.st_size}"
+    except OSError: return ""
+
+def _fill_giving(c: sqlite3.Connection):
+    """Rebuilds the giving_summary aggregate from the donations table; runs inside the caller's transaction."""
+    c.execute("DELETE FROM giving")
+    c.execute("INSERT INTO giving SELECT donor_id, substr(received_at, 1, 4), COALESCE(NULLIF(designation, ''), 'General Fund'), "
+              "SUM(amount_cents), COUNT(*) FROM donations GROUP BY 1, 2, 3")
+    c.execute("INSERT OR REPLACE INTO meta VALUES ('giving', '1')")
+
+def _read_csv(path: str) -> Iterable[Dict]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+class SqliteStore:
+    """DataStore-compatible backend over an embedded SQLite file in WAL mode.
+
+    donations.csv/donors.csv are bulk-imported whenever their mtime/size differs from
+    the last import recorded in the meta table; the import runs under BEGIN IMMEDIATE
+    so only one gunicorn worker does it while the others keep reading the old snapshot.
+    """
+    def __init__(self, directory: str, db_path: Optional[str] = None):
+        self.dir = directory
+        self.db_path = db_path or os.getenv("SQLITE_PATH") or os.path.join(directory, "spark.db")
+        self.donations_path = os.path.join(directory, "donations.csv")
+        self.donors_path = os.path.join(directory, "donors.csv")
+        self._local = threading.local()
+        self._sig: Optional[str] = None
+        self._table: Tuple[Optional[str], object] = (None, None)
+        with self._conn() as c: c.executescript(SCHEMA)
+        if self._meta("csv_sig") is not None and self._meta("giving") is None: self._materialize()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _csv_sig(self) -> str:
+        return f"{_csv_sig(self.donations_path)}|{_csv_sig(self.donors_path)}"
+
+    def _sync(self):
+        sig = self._csv_sig()
+        if sig == self._sig: return
+        if sig != "|" and self._meta("csv_sig") != sig: self.import_csv()
+        self._sig = sig
+
+    def import_csv(self) -> Dict[str, int]:
+        """Bulk-loads both CSVs into fresh tables in a single write transaction."""
+        c = self._conn(); sig = self._csv_sig()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if self._meta("csv_sig") == sig:
+                c.execute("COMMIT"); return {"donations": self.count("donations"), "donors": self.count("donors")}
+            # only a re-import has anything to invalidate; the first import just fills the tables
+            old = None if self._meta("csv_sig") is None else (
+                [dict(r) for r in c.execute(f"SELECT {', '.join(DONATION_COLUMNS)} FROM donations ORDER BY rowid")],
+                [dict(r) for r in c.execute(f"SELECT {', '.join(DONOR_COLUMNS)} FROM donors ORDER BY rowid")])
+            donations = list(_read_csv(self.donations_path)) if os.path.exists(self.donations_path) else []
+            donors = list(_read_csv(self.donors_path)) if os.path.exists(self.donors_path) else []
+            c.execute("DELETE FROM donations"); c.execute("DELETE FROM donors")
+            c.executemany(f"INSERT INTO donations ({', '.join(DONATION_COLUMNS)}, amount_cents) "
+                          f"VALUES ({', '.join('?' * (len(DONATION_COLUMNS) + 1))})",
+                          (tuple(r.get(k) or "" for k in DONATION_COLUMNS) + (to_cents(r.get("amount")),) for r in donations))
+            c.executemany(f"INSERT INTO donors ({', '.join(DONOR_COLUMNS)}) VALUES ({', '.join('?' * len(DONOR_COLUMNS))})",
+                          (tuple(r.get(k) or "" for k in DONOR_COLUMNS) for r in donors))
+            _fill_giving(c)
+            c.execute("INSERT OR REPLACE INTO meta VALUES ('csv_sig', ?)", (sig,))
+            c.execute("INSERT OR REPLACE INTO meta VALUES ('generation', COALESCE((SELECT value FROM meta WHERE key='generation'), 0) + 1)")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK"); raise
+        if old is not None: notify_changed(*diff_rows(old[0], old[1], donations, donors))
+        return {"donations": self.count("donations"), "donors": self.count("donors")}
+
+    def _materialize(self):
+        """Fills the giving table for a database imported before it existed."""
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if self._meta("giving") is None: _fill_giving(c)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK"); raise
+
+    def count(self, table: str) -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _donations(self, where: str = "", args: tuple = (), limit: str = "") -> List[DonationRow]:
+        self._sync()
+        cur = self._conn().execute(f"SELECT {', '.join(DONATION_COLUMNS)} FROM donations {where} ORDER BY rowid {limit}", args)
+        return [DonationRow(dict(r)) for r in cur]
+
+    def _first(self, column: str, value: str) -> Optional[DonationRow]:
+        rows = self._donations(f"WHERE {column}=?", (value,), "LIMIT 1")
+        return rows[0] if rows else None
+
+    def reload(self):
+        self._sig = None; self._sync()
+        return self
+
+    def donation(self, donation_id: str) -> Optional[DonationRow]:
+        return self._first("donation_id", donation_id)
+
+    def donation_by_receipt(self, receipt_id: str) -> Optional[DonationRow]:
+        return self._first("receipt_id", receipt_id)
+
+    def donation_by_payment(self, square_payment_id: str) -> Optional[DonationRow]:
+        return self._first("square_payment_id", square_payment_id)
+
+    def donor(self, donor_id: str) -> Optional[Dict]:
+        self._sync()
+        row = self._conn().execute(f"SELECT {', '.join(DONOR_COLUMNS)} FROM donors WHERE donor_id=? ORDER BY rowid LIMIT 1",
+                                   (donor_id,)).fetchone()
+        return dict(row) if row else None
+
+    def donations(self) -> List[DonationRow]:
+        return self._donations()
+
+    def donors(self) -> List[Dict]:
+        self._sync()
+        return [dict(r) for r in self._conn().execute(f"SELECT {', '.join(DONOR_COLUMNS)} FROM donors ORDER BY rowid")]
+
+    def donations_for_org(self, org_id: str) -> List[DonationRow]:
+        return self._donations("WHERE org_id=?", (org_id,))
+
+    def donations_for_donor(self, donor_id: str, year: Optional[int] = None) -> List[DonationRow]:
+        if year is None: return self._donations("WHERE donor_id=?", (donor_id,))
+        return self._donations("WHERE donor_id=? AND received_at >= ? AND received_at < ?", (donor_id, str(year), str(int(year) + 1)))
+
+    def donations_between(self, start: str, end: str, donor_id: Optional[str] = None,
+                          org_id: Optional[str] = None) -> List[DonationRow]:
+        """Donations with start <= received_at < end (ISO strings), optionally narrowed to a donor or org."""
+        where, args = "WHERE received_at >= ? AND received_at < ?", [start, end]
+        if donor_id is not None: where += " AND donor_id=?"; args.append(donor_id)
+        if org_id is not None: where += " AND org_id=?"; args.append(org_id)
+        return self._donations(where, tuple(args))
+
+    def giving_summary(self, donor_id: str, year: int) -> Tuple[int, int, List[Dict]]:
+        """(total_cents, count, designation breakdown) for one donor-year from the giving table, net of refunds."""
+        self._sync()
+        rows = self._conn().execute("SELECT designation, cents, count FROM giving WHERE donor_id=? AND year=?",
+                                    (donor_id, str(year))).fetchall()
+        return net_summary({r[0]: r[1] for r in rows}, sum(r[2] for r in rows), get_refund_ledger(self.dir), donor_id, year)
+
+    def giving_summaries(self, year: int) -> Dict[str, Tuple[int, int, List[Dict]]]:
+        """giving_summary for every donor with gifts in year, from one read of the giving table."""
+        self._sync()
+        cur = self._conn().execute("SELECT donor_id, designation, cents, count FROM giving WHERE year=? AND donor_id != ''", (str(year),))
+        grouped: Dict[str, list] = {}
+        for donor, des, cents, count in cur:
+            e = grouped.setdefault(donor, [{}, 0]); e[0][des] = cents; e[1] += count
+        refunds = get_refund_ledger(self.dir)
+        return {d: net_summary(totals, count, refunds, d, year) for d, (totals, count) in grouped.items()}
+
+    def table(self):
+        self._sync()
+        gen = self._meta("generation")
+        if self._table[0] != gen or self._table[1] is None:
+            from services.columnar import DonationTable
+            self._table = (gen, DonationTable(self._donations()))
+        return self._table[1]
+
+if __name__ == "__main__":
+    from services.datastore import data_dir
+    print(SqliteStore(data_dir()).import_csv())
@@ -0,0 +1,212 @@
+import os, json, time, uuid, hashlib, logging
+from datetime import datetime
+from typing import Optional, List, Dict, Tuple
+
+from services.datastore import get_store
+from services.receipts import statement_args
+from services.render_pool import render_many, RENDER_POOL_SIZE
+from services.emailer import send_bulk, EMAIL_BULK_FLUSH
+from services.task_queue import enqueue_task, register_task, TASKS_DISPATCH_DEADLINE_SEC
+from cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+BATCH_TIME_BUDGET_SEC = float(os.getenv("BATCH_TIME_BUDGET_SEC", "3000"))   # pause before Cloud Run's request timeout
+BATCH_LOCK_SEC = int(os.getenv("BATCH_LOCK_SEC", "600"))                    # refreshed at every checkpoint
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "5"))   # per donor; a statement still failing after this waits for a restart
+BATCH_STATUS_TTL = 30*24*3600
+STATEMENT_SHARDS = int(os.getenv("STATEMENT_SHARDS", "0"))     # default fan-out for /tasks/year-end-statements; 0 runs inline
+SHARD_TASK_PATH = "/tasks/year-end-statements/shard"
+_RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+Shard = Optional[Tuple[int, int]]   # (index, count)
+
+def _suffix(shard: Shard) -> str: return f":{shard[0]}of{shard[1]}" if shard else ""
+def _status_key(year: int, shard: Shard = None) -> bytes: return f"spark:batch:statements:{year}{_suffix(shard)}".encode()
+def _lock_key(year: int, shard: Shard = None) -> bytes: return f"spark:lock:batch:statements:{year}{_suffix(shard)}".encode()
+def _fanout_key(year: int) -> bytes: return f"spark:batch:statements:{year}:fanout".encode()
+
+def shard_of(donor_id: str, shards: int) -> int:
+    """Hash-range shard: the 32-bit hash space split into `shards` equal ranges."""
+    return int.from_bytes(hashlib.blake2b(donor_id.encode(), digest_size=4).digest(), "big") * shards >> 32
+
+def group_statements(year: int, shard: Shard = None) -> Tuple[List[dict], Dict[str, int], Dict[str, list]]:
+    """The year's materialized aggregates: (donors with gifts sorted by id, net cents per donor, designation breakdown per donor)."""
+    store = get_store(); summaries = store.giving_summaries(year)
+    totals = {d: cents for d, (cents, _, _) in summaries.items()}
+    breakdowns = {d: breakdown for d, (_, _, breakdown) in summaries.items()}
+    donors = sorted((d for d in store.donors() if d.get("donor_id") in summaries
+                     and (shard is None or shard_of(d["donor_id"], shard[1]) == shard[0])), key=lambda d: d["donor_id"])
+    return donors, totals, breakdowns
+
+def batch_status(year: int, shard: Shard = None) -> dict:
+    try: status = json.loads(redis_cache.r.get(_status_key(year, shard)) or "{}")
+    except Exception as e: return {"state": "unknown", "year": year, "error": str(e)}
+    return status or {"state": "idle", "year": year}
+
+def _save(status: dict):
+    status["updated_at"] = datetime.utcnow().isoformat()
+    try: redis_cache.r.setex(_status_key(status["year"], status.get("shard") and tuple(status["shard"])), BATCH_STATUS_TTL, json.dumps(status))
+    except Exception as e: logger.warning(f"Statement batch checkpoint not saved: {str(e)}")
+
+def _release(year: int, shard: Shard, token: str, status: dict) -> dict:
+    try: redis_cache.r.eval(_RELEASE, 1, _lock_key(year, shard), token)
+    except Exception: pass
+    return status
+
+def retryable(status: dict) -> bool:
+    """Whether any failed statement in status still has attempts left."""
+    return any(f["attempts"] < BATCH_MAX_ATTEMPTS for f in (status.get("failed") or {}).values())
+
+def run_statement_batch(year: int, restart: bool = False, shard: Shard = None, budget: Optional[float] = None) -> dict:
+    """Renders and emails every donor's statement for year, checkpointing a donor-id cursor in Redis.
+
+    Work stops at BATCH_TIME_BUDGET_SEC with state "paused"; calling again continues after the
+    last checkpoint, so a run cut short by a request timeout or a failure never starts over or
+    re-sends a flushed batch. Donors whose render or email failed are kept in the checkpoint
+    and retried first on the next call (up to BATCH_MAX_ATTEMPTS each); a pass that ends with
+    any of them outstanding is "incomplete", not "done". A finished year is not re-sent unless
+    restart=True, which discards the checkpoint. One run per year (or per year and shard) at a
+    time across workers.
+    """
+    token = uuid.uuid4().hex; started = time.monotonic()
+    budget = BATCH_TIME_BUDGET_SEC if budget is None else budget
+    try:
+        if not redis_cache.r.set(_lock_key(year, shard), token, nx=True, ex=BATCH_LOCK_SEC): return {**batch_status(year, shard), "busy": True}
+        locked = True
+    except Exception as e:
+        logger.warning(f"Statement batch running without a checkpoint, Redis unavailable: {str(e)}"); locked = False
+    prev = {} if restart or not locked else batch_status(year, shard)
+    if restart and locked and shard is None:
+        try: redis_cache.r.delete(_fanout_key(year))
+        except Exception: pass
+    if prev.get("state") == "done": return _release(year, shard, token, prev)
+    if prev.get("state") not in ("running", "paused", "failed", "incomplete"): prev = {}
+    # donor_id -> {"stage": "render" | "email", "attempts": n} for statements not yet delivered
+    failed: Dict[str, dict] = prev.get("failed") or {}
+    status = {"state": "running", "year": year, "shard": shard, "started_at": prev.get("started_at", datetime.utcnow().isoformat()), "error": None,
+              "total": 0, "processed": prev.get("processed", 0), "generated": prev.get("generated", 0),
+              "emailed": prev.get("emailed", 0), "email_failed": prev.get("email_failed", 0), "render_failed": prev.get("render_failed", 0),
+              "cursor": prev.get("cursor"), "failed": failed, "resumes": prev.get("resumes", -1) + 1}
+    outbox: List[dict] = []; mailed: List[str] = []
+    outcomes: Dict[str, Optional[str]] = {}   # donor_id -> None once delivered, else the stage that failed
+    pending = {"processed": 0, "generated": 0, "render_failed": 0}
+    def checkpoint(cursor: Optional[str]):
+        # the cursor only moves past donors whose emails have gone out or who are recorded as failed
+        for donor_id, res in zip(mailed, send_bulk(outbox)):
+            status["emailed" if res["sent"] else "email_failed"] += 1
+            outcomes[donor_id] = None if res["sent"] else "email"
+        outbox.clear(); mailed.clear()
+        for donor_id, stage in outcomes.items():
+            if stage is None: failed.pop(donor_id, None)
+            else: failed[donor_id] = {"stage": stage, "attempts": failed.get(donor_id, {}).get("attempts", 0) + 1}
+        outcomes.clear()
+        for k in pending: status[k] += pending[k]; pending[k] = 0
+        # retried donors sit behind the cursor, so it never moves backwards
+        status["cursor"] = max(filter(None, (status["cursor"], cursor)), default=None); _save(status)
+        if locked:
+            try: redis_cache.r.expire(_lock_key(year, shard), BATCH_LOCK_SEC)
+            except Exception: pass
+    try:
+        donors, totals, breakdowns = group_statements(year, shard)
+        status["total"] = len(donors)
+        # earlier failures first, then the donors after the cursor; a donor no longer in the year is dropped
+        by_id = {d["donor_id"]: d for d in donors}
+        for donor_id in [i for i in failed if i not in by_id]: failed.pop(donor_id)
+        retry = [by_id[i] for i in sorted(failed) if failed[i]["attempts"] < BATCH_MAX_ATTEMPTS]
+        jobs = retry + [d for d in donors if status["cursor"] is None or d["donor_id"] > status["cursor"]]
+        _save(status)
+        # render a pool's worth of statements at a time so memory stays bounded by the chunk, not the run
+        chunk = max(1, RENDER_POOL_SIZE) * 4
+        for i in range(0, len(jobs), chunk):
+            if i and time.monotonic() - started > budget:
+                # send what is buffered and stop; every call gets through at least one chunk
+                checkpoint(jobs[i-1]["donor_id"]); status["state"] = "paused"; break
+            part = jobs[i:i+chunk]
+            # one round trip for the chunk's cached statements, render only the rest, and write those back together
+            pdfs = redis_cache.get_cached_statements((d["donor_id"] for d in part), year)
+            missing = [d for d in part if d["donor_id"] not in pdfs]
+            fresh = {d["donor_id"]: pdf for d, pdf in zip(missing, render_many(
+                [statement_args(d, year, totals[d["donor_id"]], breakdowns[d["donor_id"]]) for d in missing])) if pdf is not None}
+            # emailed statements get opened, so they skip the admission bar
+            if fresh: redis_cache.cache_statements(year, fresh, force=True)
+            pdfs.update(fresh)
+            for d in part:
+                donor_id, pdf = d["donor_id"], pdfs.get(d["donor_id"])
+                retried = failed.get(donor_id)
+                if not retried: pending["processed"] += 1
+                if pdf is None: outcomes[donor_id] = "render"; pending["render_failed"] += 1; continue
+                # a statement that failed only at the email stage was already counted as generated
+                if not retried or retried["stage"] == "render": pending["generated"] += 1
+                if d.get("email"):
+                    outbox.append({"to": d["email"], "subject": f"Your {year} annual giving statement",
+                                   "html": "<p>Attached is your annual statement.</p>", "attachment": pdf,
+                                   "filename": f"YEAR-{year}-{donor_id}.pdf"})
+                    mailed.append(donor_id)
+                else: outcomes[donor_id] = None
+            if len(outbox) >= EMAIL_BULK_FLUSH or not outbox: checkpoint(part[-1]["donor_id"])
+        else:
+            if jobs: checkpoint(jobs[-1]["donor_id"])
+            status["state"] = "incomplete" if failed else "done"
+    except Exception as e:
+        logger.error(f"Statement batch for {year} failed: {str(e)}"); status.update(state="failed", error=str(e))
+    finally:
+        if status["state"] == "done": status["finished_at"] = datetime.utcnow().isoformat()
+        _save(status)
+        if locked: _release(year, shard, token, status)
+    logger.info(f"Statement batch {year}{_suffix(shard)} {status['state']}: {status['generated']} generated, "
+                f"{status['emailed']} emailed, {len(failed)} outstanding")
+    return status
+
+def fan_out(year: int, shards: int, restart: bool = False) -> dict:
+    """Splits the year into hash-range shards and queues one task per unfinished shard.
+
+    Calling again with the same year re-queues only shards that are not done, so it doubles as
+    a kick for a stalled run; restart=True clears every shard's checkpoint first.
+    """
+    try: plan = json.loads(redis_cache.r.get(_fanout_key(year)) or "{}")
+    except Exception as e: raise RuntimeError(f"Fan-out needs Redis for shard checkpoints: {str(e)}")
+    if restart or not plan:
+        old = plan.get("shards", 0)
+        plan = {"year": year, "shards": shards, "run_id": uuid.uuid4().hex[:12], "started_at": datetime.utcnow().isoformat()}
+        redis_cache.r.delete(_fanout_key(year), *[_status_key(year, (i, n)) for n in {old, shards} if n for i in range(n)])
+        redis_cache.r.setex(_fanout_key(year), BATCH_STATUS_TTL, json.dumps(plan))
+    n = plan["shards"]; queued = 0
+    for i in range(n):
+        if batch_status(year, (i, n)).get("state") == "done": continue
+        # each queueing starts a new continuation chain; the shard lock keeps a second chain from running alongside
+        payload = {"year": year, "shard": i, "shards": n, "run_id": plan["run_id"], "chain": uuid.uuid4().hex[:8], "part": 0}
+        queued += enqueue_task(SHARD_TASK_PATH, payload, name=f"statements-{year}-{plan['run_id']}-{i}-{payload['chain']}-p0")
+    logger.info(f"Statement fan-out {year}: {queued} of {n} shards queued")
+    return {**fanout_status(year), "queued": queued}
+
+def run_shard(payload: dict) -> dict:
+    """Task handler for one shard: runs until its time budget, then queues its own continuation."""
+    year, shard, part = payload["year"], (payload["shard"], payload["shards"]), payload.get("part", 0)
+    # finish inside the task's dispatch deadline so Cloud Tasks doesn't retry a run that is still going
+    status = run_statement_batch(year, shard=shard, budget=min(BATCH_TIME_BUDGET_SEC, TASKS_DISPATCH_DEADLINE_SEC * 0.8))
+    if status["state"] == "paused":
+        enqueue_task(SHARD_TASK_PATH, {**payload, "part": part + 1},
+                     name=f"statements-{year}-{payload['run_id']}-{shard[0]}-{payload['chain']}-p{part + 1}")
+    elif status["state"] == "failed" or (status["state"] == "incomplete" and retryable(status)):
+        # surfacing the failure lets Cloud Tasks retry with backoff; the retry resumes from the shard's checkpoint
+        reason = status.get("error") or f"{len(status['failed'])} statements outstanding"
+        raise RuntimeError(f"Statement shard {shard[0]}/{shard[1]} for {year} {status['state']}: {reason}")
+    return status
+
+register_task(SHARD_TASK_PATH, run_shard)
+
+def fanout_status(year: int) -> dict:
+    """Aggregate progress across a fanned-out year's shards, or the single-run status if it wasn't fanned out."""
+    try: plan = json.loads(redis_cache.r.get(_fanout_key(year)) or "{}")
+    except Exception as e: return {"state": "unknown", "year": year, "error": str(e)}
+    if not plan: return batch_status(year)
+    n = plan["shards"]; shards = [batch_status(year, (i, n)) for i in range(n)]
+    states = [s.get("state", "idle") for s in shards]
+    agg = {k: sum(s.get(k, 0) for s in shards) for k in ("total", "processed", "generated", "emailed", "email_failed", "render_failed")}
+    agg["outstanding"] = sum(len(s.get("failed") or {}) for s in shards)
+    state = ("done" if all(st == "done" for st in states) else "failed" if "failed" in states
+             else "incomplete" if all(st in ("done", "incomplete") for st in states)
+             else "queued" if all(st == "idle" for st in states) else "running")
+    return {"state": state, **plan, **agg, "shards_done": states.count("done"),
+            "shard_states": {st: states.count(st) for st in set(states)}}
@@ -0,0 +1,150 @@
+import os, csv
+from typing import Optional, List, Dict, Iterable, Iterator, BinaryIO, Union
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import LETTER
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+
+from services.receipts import receipt_template
+from services.datastore import DonationRow
+
+ROW_H = 0.18*inch
+TOP = 1.25*inch      # below the header band
+BOTTOM = 1.25*inch   # above the legal footer
+COLUMNS = ((0.75*inch, "Date"), (1.75*inch, "Donation ID"), (3.1*inch, "Designation"), (5.3*inch, "Method"))
+
+class StatementWriter:
+    """Itemized multi-page giving statement written row by row.
+
+    Each page stamps the shared org header/footer form and a column header row; rows are
+    drawn as they arrive and pages are flushed with showPage(), so only the compressed
+    page streams stay in memory until save() writes them to the target file or stream.
+    """
+    def __init__(self, out: Union[str, BinaryIO], donor_name: str, donor_id: str, year: int):
+        self.c = canvas.Canvas(out, pagesize=LETTER, pageCompression=1, invariant=1)
+        self.W, self.H = LETTER
+        self.tpl = receipt_template()
+        self.donor_name, self.donor_id, self.year = donor_name, donor_id, year
+        self.page = 0; self.rows = 0; self.y = 0.0
+        self._new_page()
+
+    def _new_page(self):
+        if self.page: self._finish_page()
+        self.page += 1
+        c, W, H = self.c, self.W, self.H
+        self.tpl.draw(c, W, H)
+        y = H - TOP
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(0.75*inch, y, f"Annual Giving Statement {self.year}" + (" (continued)" if self.page > 1 else ""))
+        c.setFont("Helvetica", 10)
+        c.drawRightString(W-0.75*inch, y, f"Statement ID: YEAR-{self.year}-{self.donor_id}")
+        y -= 0.25*inch
+        c.drawString(0.75*inch, y, f"Donor: {self.donor_name}")
+        y -= 0.35*inch
+        c.setFont("Helvetica-Bold", 9.5)
+        for x, label in COLUMNS: c.drawString(x, y, label)
+        c.drawRightString(W-0.75*inch, y, "Amount")
+        c.setStrokeColor(colors.grey); c.line(0.75*inch, y-0.06*inch, W-0.75*inch, y-0.06*inch)
+        c.setFont("Helvetica", 9.5)
+        self.y = y - ROW_H - 0.04*inch
+
+    def _finish_page(self):
+        self.c.setFillColor(colors.black); self.c.setFont("Helvetica", 8.5)
+        self.c.drawRightString(self.W-0.75*inch, 0.55*inch, f"Page {self.page}")
+        self.c.showPage()
+
+    def _room(self, lines: int = 1):
+        if self.y - (lines-1)*ROW_H < BOTTOM: self._new_page()
+
+    def add_row(self, row: Dict):
+        self._room()
+        c, y = self.c, self.y
+        cents = getattr(row, "cents", None)
+        amount = cents / 100 if cents is not None else float(row.get("amount") or 0)
+        c.drawString(COLUMNS[0][0], y, (row.get("received_at") or "")[:10])
+        c.drawString(COLUMNS[1][0], y, (row.get("donation_id") or "")[:22])
+        c.drawString(COLUMNS[2][0], y, (row.get("designation") or "General Fund")[:36])
+        c.drawString(COLUMNS[3][0], y, (row.get("method") or "").title()[:14])
+        c.drawRightString(self.W-0.75*inch, y, f"${amount:,.2f}")
+        self.y -= ROW_H; self.rows += 1
+
+    def finish(self, total_cents: int, breakdown: Optional[List[Dict]] = None, gross_cents: Optional[int] = None) -> int:
+        """Writes the totals block, closes the document and returns the page count.
+
+        When gross_cents (the sum of the listed gifts) is above the net total_cents, the gap is
+        printed as a refunds line so the listed gifts, refunds and total add up.
+        """
+        c, W = self.c, self.W
+        refunded = (gross_cents or 0) - total_cents
+        self._room(5 if refunded > 0 else 3)
+        self.y -= 0.1*inch
+        if refunded > 0:
+            c.setFont("Helvetica", 9.5)
+            c.drawString(0.75*inch, self.y, "Gifts listed"); c.drawRightString(W-0.75*inch, self.y, f"${gross_cents / 100:,.2f}")
+            self.y -= ROW_H
+            c.drawString(0.75*inch, self.y, "Less refunds"); c.drawRightString(W-0.75*inch, self.y, f"-${refunded / 100:,.2f}")
+            self.y -= ROW_H
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(0.75*inch, self.y, f"Total giving {self.year} ({self.rows} gifts)")
+        c.drawRightString(W-0.75*inch, self.y, f"${total_cents / 100:,.2f}")
+        self.y -= ROW_H + 0.1*inch
+        if breakdown:
+            self._room(2)
+            c.drawString(0.75*inch, self.y, "Designation Breakdown"); self.y -= ROW_H
+            c.setFont("Helvetica", 9.5)
+            for li in breakdown:
+                if self.y < BOTTOM: self._new_page()
+                c.drawString(0.95*inch, self.y, f"- {li.get('designation','')}")
+                c.drawRightString(W-0.75*inch, self.y, f"${float(li.get('amount',0)):,.2f}")
+                self.y -= ROW_H
+        self._finish_page()
+        c.save()
+        return self.page
+
+def write_itemized_statement(out: Union[str, BinaryIO], donor_name: str, donor_id: str, year: int,
+                             rows: Iterable[Dict], breakdown: Optional[List[Dict]] = None,
+                             total_cents: Optional[int] = None) -> int:
+    """Writes the statement; total_cents is the donor-year's net total (giving_summary), defaulting to the rows' sum."""
+    w = StatementWriter(out, donor_name, donor_id, year); gross = 0
+    for r in rows:
+        w.add_row(r)
+        cents = getattr(r, "cents", None)
+        gross += cents if cents is not None else int(round(float(r.get("amount") or 0) * 100))
+    return w.finish(gross if total_cents is None else total_cents, breakdown, gross)
+
+ITEMIZED_COLUMNS = ("received_at", "donation_id", "designation", "method", "amount")
+
+def write_itemized_rows(path: str, rows: Iterable[Dict]) -> int:
+    """Writes the printed columns of rows, date-ordered, to a CSV file the render worker streams back in.
+
+    Only the file path crosses into the pool, so a donor with thousands of gifts is never pickled as one list.
+    """
+    ordered = sorted(rows, key=lambda r: r.get("received_at") or "")
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f); w.writerow(ITEMIZED_COLUMNS)
+        w.writerows((r.get("received_at") or "", r.get("donation_id") or "", r.get("designation") or "", r.get("method") or "",
+                     f"{r.cents / 100:.2f}" if isinstance(r, DonationRow) else r.get("amount") or "0") for r in ordered)
+    return len(ordered)
+
+def read_itemized_rows(path: str) -> Iterator[Dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+def render_itemized_statement_file(path: str, donor_id: str, year: int, donor_name: str, rows_path: str,
+                                   breakdown: Optional[List[Dict]] = None, total_cents: Optional[int] = None) -> int:
+    """Render-pool entry point: streams the rows the caller wrote to rows_path, so pool processes never load the store."""
+    return write_itemized_statement(path, donor_name, donor_id, year, read_itemized_rows(rows_path), breakdown, total_cents)
+
+def iter_file(path: str, chunk_size: int = 64*1024, remove: bool = True):
+    """Yields a file in chunks for StreamingResponse, deleting it once fully sent (or abandoned)."""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk: break
+                yield chunk
+    finally:
+        if remove:
+            try: os.unlink(path)
+            except OSError: pass
@@ -0,0 +1,92 @@
+import os, hmac, json, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE = os.getenv("TASK_QUEUE", "local")                  # local | cloudtasks
+TASKS_LOCAL_WORKERS = int(os.getenv("TASKS_LOCAL_WORKERS", "2"))
+CLOUD_TASKS_PROJECT = os.getenv("CLOUD_TASKS_PROJECT", os.getenv("GOOGLE_CLOUD_PROJECT", ""))
+CLOUD_TASKS_LOCATION = os.getenv("CLOUD_TASKS_LOCATION", "us-central1")
+CLOUD_TASKS_QUEUE = os.getenv("CLOUD_TASKS_QUEUE", "spark-tasks")
+TASKS_TARGET_URL = os.getenv("TASKS_TARGET_URL", "").rstrip("/")          # this service's public base URL
+TASKS_SERVICE_ACCOUNT = os.getenv("TASKS_SERVICE_ACCOUNT", "")             # OIDC identity Cloud Tasks calls us as
+TASKS_OIDC_AUDIENCE = os.getenv("TASKS_OIDC_AUDIENCE", TASKS_TARGET_URL)     # audience minted into (and required of) task tokens
+TASKS_SHARED_SECRET = os.getenv("TASKS_SHARED_SECRET", "")                 # alternative to OIDC, sent as X-Tasks-Secret
+TASKS_DISPATCH_DEADLINE_SEC = int(os.getenv("TASKS_DISPATCH_DEADLINE_SEC", "1800"))  # Cloud Tasks caps HTTP tasks at 30 min
+
+# path -> handler; the local queue calls these directly, Cloud Tasks reaches them through the routes at the same path
+_handlers: Dict[str, Callable[[dict], object]] = {}
+
+def register_task(path: str, handler: Callable[[dict], object]):
+    _handlers[path] = handler
+
+class LocalQueue:
+    """In-process stand-in for Cloud Tasks: runs handlers on a small thread pool, deduping task names."""
+    def __init__(self, workers: int = TASKS_LOCAL_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="local-task")
+        self._names: set = set(); self._lock = threading.Lock()
+
+    def enqueue(self, path: str, payload: dict, name: Optional[str] = None) -> bool:
+        with self._lock:
+            if name in self._names: return False
+            if name: self._names.add(name)
+        def run():
+            try: _handlers[path](payload)
+            except Exception as e: logger.error(f"Local task {name or path} failed: {str(e)}")
+        self._pool.submit(run)
+        return True
+
+class CloudTasksQueue:
+    """HTTP tasks POSTed back to this service; task names make re-enqueues idempotent."""
+    def __init__(self):
+        from google.cloud import tasks_v2
+        self._tasks_v2 = tasks_v2
+        self._client = tasks_v2.CloudTasksClient()
+        self._parent = self._client.queue_path(CLOUD_TASKS_PROJECT, CLOUD_TASKS_LOCATION, CLOUD_TASKS_QUEUE)
+
+    def enqueue(self, path: str, payload: dict, name: Optional[str] = None) -> bool:
+        from google.api_core.exceptions import AlreadyExists
+        request = {"http_method": self._tasks_v2.HttpMethod.POST, "url": f"{TASKS_TARGET_URL}/api/v1{path}",
+                   "headers": {"Content-Type": "application/json"}, "body": json.dumps(payload).encode()}
+        if TASKS_SERVICE_ACCOUNT: request["oidc_token"] = {"service_account_email": TASKS_SERVICE_ACCOUNT, "audience": TASKS_OIDC_AUDIENCE}
+        if TASKS_SHARED_SECRET: request["headers"]["X-Tasks-Secret"] = TASKS_SHARED_SECRET
+        task = {"http_request": request, "dispatch_deadline": {"seconds": TASKS_DISPATCH_DEADLINE_SEC}}
+        if name: task["name"] = f"{self._parent}/tasks/{name}"
+        try: self._client.create_task(request={"parent": self._parent, "task": task})
+        except AlreadyExists: return False
+        return True
+
+_google_request = None
+
+def verify_task_caller(authorization: Optional[str], secret: Optional[str]) -> bool:
+    """Whether an HTTP task callback really came from our queue.
+
+    Accepts the Cloud Tasks OIDC token (signed by Google for TASKS_SERVICE_ACCOUNT with
+    audience TASKS_OIDC_AUDIENCE) or the TASKS_SHARED_SECRET header. With neither configured
+    every HTTP call is refused; the local queue calls its handlers directly.
+    """
+    global _google_request
+    if TASKS_SHARED_SECRET and secret and hmac.compare_digest(secret.encode(), TASKS_SHARED_SECRET.encode()): return True
+    if not (TASKS_SERVICE_ACCOUNT and TASKS_OIDC_AUDIENCE and authorization and authorization.startswith("Bearer ")): return False
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as google_requests
+    if _google_request is None: _google_request = google_requests.Request()
+    try: claims = id_token.verify_oauth2_token(authorization[len("Bearer "):], _google_request, audience=TASKS_OIDC_AUDIENCE)
+    except Exception as e:
+        logger.warning(f"Rejected task token: {str(e)}"); return False
+    return claims.get("email") == TASKS_SERVICE_ACCOUNT and bool(claims.get("email_verified"))
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None: _queue = CloudTasksQueue() if TASK_QUEUE == "cloudtasks" else LocalQueue()
+    return _queue
+
+def enqueue_task(path: str, payload: dict, name: Optional[str] = None) -> bool:
+    """Queues payload for the handler registered at path; False if a task with this name was already queued."""
+    return get_queue().enqueue(path, payload, name)
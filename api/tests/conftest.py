@@ -0,0 +1,6 @@
+import os, sys
+
+# the app imports from the api/ directory root (services.*, cache.*), as it does under gunicorn
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+os.environ.setdefault("RENDER_POOL_SIZE", "0")
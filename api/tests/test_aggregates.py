@@ -0,0 +1,53 @@
+import os
+import pytest
+from services.aggregates import RefundLedger, GivingAggregates, get_refund_ledger
+from services.datastore import DataStore, DonationRow
+from services.snapshot import SnapshotStore
+from services.sqlite_store import SqliteStore
+
+ROWS = ("donation_id,donor_id,amount,received_at,designation,square_payment_id\n"
+        "g1,d1,50.00,2025-02-01T10:00:00,Music,sq1\n"
+        "g2,d1,16.00,2025-03-01T10:00:00,,sq2\n"
+        "g3,d1,9.00,2024-03-01T10:00:00,Music,sq3\n"
+        "g4,d2,5.00,2025-04-01T10:00:00,Music,sq4\n")
+
+@pytest.fixture
+def data(tmp_path):
+    with open(tmp_path / "donations.csv", "w", newline="") as f: f.write(ROWS)
+    with open(tmp_path / "donors.csv", "w", newline="") as f: f.write("donor_id,primary_contact_name,email\nd1,Ada,a@x.org\n")
+    return tmp_path
+
+def _gift(donation_id="g1", donor_id="d1", amount="50.00", designation="Music"):
+    return DonationRow({"donation_id": donation_id, "donor_id": donor_id, "amount": amount,
+                        "received_at": "2025-02-01T10:00:00", "designation": designation, "square_payment_id": "sq1"})
+
+def test_ledger_dedupes_and_is_shared_through_the_file(tmp_path):
+    a, b = RefundLedger(str(tmp_path)), RefundLedger(str(tmp_path))
+    assert a.record("rf1", _gift(), 1000) and not a.record("rf1", _gift(), 1000)
+    assert a.record("rf2", _gift(), 250)
+    assert b.adjustments("d1", 2025) == {"Music": 1250} and not b.record("rf2", _gift(), 250)
+    assert b.adjustments("d1", 2024) == {} and b.adjustments("d9", 2025) == {}
+
+def test_aggregates_fold_appended_gifts_and_net_refunds(tmp_path):
+    ledger = RefundLedger(str(tmp_path)); agg = GivingAggregates(ledger)
+    agg.add([_gift(), _gift("g2", designation="")])
+    assert agg.summary("d1", 2025) == (10000, 2, [{"designation": "General Fund", "amount": 50.0}, {"designation": "Music", "amount": 50.0}])
+    ledger.record("rf1", _gift(), 2000); agg.add([_gift("g3", "d2", "1.00")])
+    assert agg.summary("d1", 2025)[:2] == (8000, 2) and agg.summary("d1", 2025)[2][1] == {"designation": "Music", "amount": 30.0}
+    assert set(agg.year(2025)) == {"d1", "d2"} and agg.summary("nobody", 2025) == (0, 0, [])
+
+@pytest.mark.parametrize("backend", [DataStore, SqliteStore, SnapshotStore])
+def test_every_backend_nets_refunds_the_same_way(data, backend):
+    store = backend(str(data))
+    get_refund_ledger(str(data)).record("rf1", store.donation("g1"), 500)
+    assert store.giving_summary("d1", 2025) == (6100, 2, [{"designation": "General Fund", "amount": 16.0},
+                                                          {"designation": "Music", "amount": 45.0}])
+    summaries = store.giving_summaries(2025)
+    assert set(summaries) == {"d1", "d2"} and summaries["d1"] == store.giving_summary("d1", 2025)
+    assert summaries["d2"] == (500, 1, [{"designation": "Music", "amount": 5.0}])
+    assert store.giving_summary("d1", 2024)[:2] == (900, 1)
+
+def test_sqlite_fills_the_giving_table_for_an_older_database(data):
+    store = SqliteStore(str(data)); expected = store.giving_summaries(2025)
+    store._conn().execute("DELETE FROM giving"); store._conn().execute("DELETE FROM meta WHERE key='giving'")
+    assert SqliteStore(str(data)).giving_summaries(2025) == expected
@@ -0,0 +1,45 @@
+import time
+import fakeredis
+import pytest
+import redis
+from cache.breaker import CircuitBreaker, BreakerRedis, RedisUnavailable
+
+def _closed_port_client(breaker):
+    return BreakerRedis(connection_pool=redis.ConnectionPool(host="127.0.0.1", port=1, socket_connect_timeout=0.2),
+                        breaker=breaker)
+
+def _down():
+    raise ConnectionError("down")
+
+def test_opens_after_threshold_and_fails_fast():
+    b = CircuitBreaker("test", probe=_down, threshold=2, probe_sec=60)
+    client = _closed_port_client(b)
+    for _ in range(2):
+        with pytest.raises(redis.ConnectionError): client.get("k")
+    assert b.state == "open" and b.trips == 1 and b.status()["opened_at"]
+    with pytest.raises(RedisUnavailable): client.get("k")
+    with pytest.raises(RedisUnavailable): client.pipeline().get("k").execute()
+    assert b.failures == 2   # fast failures don't touch the network or the count
+
+def test_success_resets_the_consecutive_count():
+    b = CircuitBreaker("test", probe=lambda: None, threshold=3)
+    b.failure(ConnectionError("x")); b.failure(ConnectionError("x")); b.success(); b.failure(ConnectionError("x"))
+    assert b.state == "closed" and b.failures == 1
+
+def test_probe_closes_the_breaker():
+    attempts = []
+    def probe():
+        attempts.append(1)
+        if len(attempts) < 2: raise ConnectionError("still down")
+    b = CircuitBreaker("test", probe=probe, threshold=1, probe_sec=0.01)
+    b.failure(ConnectionError("down"))
+    deadline = time.monotonic() + 2
+    while b.state == "open" and time.monotonic() < deadline: time.sleep(0.01)
+    assert b.state == "closed" and b.failures == 0 and len(attempts) == 2
+
+def test_commands_pass_through_while_closed():
+    b = CircuitBreaker("test", probe=lambda: None)
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=fakeredis.FakeServer())
+    client = BreakerRedis(connection_pool=pool, breaker=b)
+    client.set("k", "v")
+    assert client.get("k") == b"v" and client.pipeline().get("k").execute() == [b"v"] and b.state == "closed"
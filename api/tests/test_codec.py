@@ -0,0 +1,25 @@
+import os, zlib
+from cache import codec
+
+PDF = b"%PDF-1.4\n" + b"0 0 m 10 10 l S\n" * 200
+
+def test_off_by_default_passes_bytes_through(monkeypatch):
+    monkeypatch.setattr(codec, "CACHE_COMPRESSION", "none")
+    assert codec.encode(PDF) is PDF and codec.decode(PDF) is PDF
+
+def test_zlib_round_trip(monkeypatch):
+    monkeypatch.setattr(codec, "CACHE_COMPRESSION", "zlib")
+    packed = codec.encode(PDF)
+    assert packed.startswith(codec.MAGIC) and len(packed) < len(PDF) and codec.decode(packed) == PDF
+
+def test_small_or_incompressible_values_stay_raw(monkeypatch):
+    monkeypatch.setattr(codec, "CACHE_COMPRESSION", "zlib")
+    assert codec.encode(b"%PDF-tiny") == b"%PDF-tiny"
+    noise = os.urandom(2048)
+    assert codec.encode(noise) == noise
+
+def test_unknown_header_or_corrupt_body_reads_as_miss():
+    assert codec.decode(codec.MAGIC + bytes((9, 1)) + zlib.compress(PDF)) is None
+    assert codec.decode(codec.MAGIC + bytes((codec.VERSION, 7)) + zlib.compress(PDF)) is None
+    assert codec.decode(codec.MAGIC + bytes((codec.VERSION, 1)) + b"not zlib") is None
+    assert codec.decode(None) is None and codec.decode(b"") == b""
@@ -0,0 +1,36 @@
+import numpy as np
+from services.columnar import DonationTable, cents_str
+from services.datastore import DonationRow
+
+def _rows(*specs):
+    return [DonationRow({"donor_id": d, "amount": a, "received_at": f"{y}-06-01", "designation": des, "org_id": "spark"})
+            for d, a, y, des in specs]
+
+ROWS = _rows(("d1", "10.00", 2025, "Music"), ("d1", "0.10", 2025, ""), ("d2", "5.55", 2025, "Music"),
+             ("d1", "7.00", 2024, "Music"))
+
+def test_group_by_sums_integer_cents():
+    t = DonationTable(ROWS)
+    assert t.group_by("donor", "year") == {("d1", "2025"): (1010, 2), ("d2", "2025"): (555, 1), ("d1", "2024"): (700, 1)}
+    assert t.group_by("designation", mask=t.mask(year=2025)) == {("Music",): (1555, 2), ("General Fund",): (10, 1)}
+    assert t.group_by(mask=t.mask(donor="d1")) == {(): (1710, 3)}
+
+def test_mask_and_total():
+    t = DonationTable(ROWS)
+    assert t.total(t.mask(donor="d1", year="2025")) == (1010, 2)
+    assert not t.mask(donor="nobody").any() and t.group_by("donor", mask=t.mask(donor="nobody")) == {}
+
+def test_extended_reuses_codes_and_leaves_base_untouched():
+    t = DonationTable(ROWS)
+    t2 = t.extended(_rows(("d3", "1.00", 2025, "Music"), ("d1", "1.00", 2025, "Music")))
+    assert t.size == 4 and t2.size == 6
+    assert t2.total(t2.mask(donor="d1", year="2025")) == (1110, 3) and t2.total(t2.mask(donor="d3")) == (100, 1)
+    assert t.extended([]) is t
+
+def test_from_codes_merges_equal_labels():
+    labels = {0: "d1", 1: "d2", 2: "d1"}
+    t = DonationTable.from_codes(np.array([100, 200, 300], dtype=np.int64), {"donor": (np.array([0, 1, 2]), labels.get)})
+    assert t.group_by("donor") == {("d1",): (400, 2), ("d2",): (200, 1)}
+
+def test_cents_str():
+    assert cents_str(123456) == "1234.56" and cents_str(5) == "0.05"
@@ -0,0 +1,70 @@
+import os
+import pytest
+from services import datastore
+from services.datastore import DataStore
+
+DONATIONS = "donation_id,donor_id,amount,date\ng1,d1,10.00,2025-01-05\ng2,d2,20.00,2025-02-05\n"
+DONORS = "donor_id,primary_contact_name,email\nd2,Bea,bea@x.org\n"
+
+def _write(path, text, mode="w"):
+    with open(path, mode, newline="") as f: f.write(text)
+
+def _bump(path):
+    st = os.stat(path); os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+@pytest.fixture
+def changes(monkeypatch):
+    seen = []
+    monkeypatch.setattr(datastore, "claim_change", lambda change: True)
+    monkeypatch.setattr(datastore, "_change_listeners", [lambda d, n: seen.append((set(d), set(n)))])
+    return seen
+
+def test_appended_donor_row_invalidates_that_donors_receipts(tmp_path, changes):
+    _write(tmp_path / "donations.csv", DONATIONS); _write(tmp_path / "donors.csv", DONORS)
+    store = DataStore(str(tmp_path))
+    assert [r["donation_id"] for r in store.donations_for_donor("d1")] == ["g1"]
+    _write(tmp_path / "donors.csv", "d1,Ada,ada@x.org\n", "a"); _bump(tmp_path / "donors.csv")
+    assert [r["donation_id"] for r in store.donations_for_donor("d1")] == ["g1"]
+    assert changes == [({"g1"}, {"d1"})]
+
+def test_appended_donation_marks_only_that_gift(tmp_path, changes):
+    _write(tmp_path / "donations.csv", DONATIONS); _write(tmp_path / "donors.csv", DONORS)
+    store = DataStore(str(tmp_path)); store.donations_for_donor("d2")
+    _write(tmp_path / "donations.csv", "g3,d2,5.00,2025-03-05\n", "a"); _bump(tmp_path / "donations.csv")
+    assert [r["donation_id"] for r in store.donations_for_donor("d2")] == ["g2", "g3"]
+    assert changes == [({"g3"}, {"d2"})]
+
+ROWS = ("donation_id,org_id,donor_id,amount,received_at,receipt_id,square_payment_id\n"
+        "g1,spark,d1,10.00,2024-12-31T10:00:00,r1,sq1\n"
+        "g2,spark,d1,20.50,2025-01-02T10:00:00,r2,sq2\n"
+        "g3,other,d2,5.00,2025-03-01T10:00:00,r3,sq3\n"
+        "g1,spark,d9,99.00,2025-04-01T10:00:00,r9,sq9\n")
+
+@pytest.fixture
+def store(tmp_path):
+    _write(tmp_path / "donations.csv", ROWS)
+    _write(tmp_path / "donors.csv", "donor_id,primary_contact_name,email\nd1,Ada,ada@x.org\nd1,Dup,dup@x.org\n")
+    return DataStore(str(tmp_path))
+
+def test_lookups_by_every_index(store):
+    assert store.donation("g2")["donor_id"] == "d1" and store.donation("g2").cents == 2050
+    assert store.donation_by_receipt("r3")["donation_id"] == "g3"
+    assert store.donation_by_payment("sq2")["donation_id"] == "g2"
+    assert store.donation("nope") is None and store.donor("nope") is None
+    assert [r["donation_id"] for r in store.donations_for_org("other")] == ["g3"]
+
+def test_first_occurrence_wins(store):
+    assert store.donation("g1")["donor_id"] == "d1"
+    assert store.donor("d1")["primary_contact_name"] == "Ada"
+
+def test_donor_year_and_date_range(store):
+    assert [r["donation_id"] for r in store.donations_for_donor("d1")] == ["g1", "g2"]
+    assert [r["donation_id"] for r in store.donations_for_donor("d1", 2025)] == ["g2"]
+    assert [r["donation_id"] for r in store.donations_between("2025-01-01", "2026-01-01", org_id="spark")] == ["g2", "g1"]
+    assert [r["donation_id"] for r in store.donations_between("2025-01-01", "2026-01-01", donor_id="d1")] == ["g2"]
+
+def test_rewritten_file_is_reindexed(tmp_path, store):
+    store.donation("g1")
+    _write(tmp_path / "donations.csv", ROWS.replace("g3,other,d2,5.00", "g3,other,d2,7.00"))
+    _bump(tmp_path / "donations.csv")
+    assert store.donation("g3").cents == 700 and len(store.donations()) == 4
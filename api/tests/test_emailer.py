@@ -0,0 +1,83 @@
+import json, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from services import emailer
+
+class FakeProvider(ThreadingHTTPServer):
+    """Records every POST; respond(path, body) decides the status and JSON reply."""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.requests, self.lock = [], threading.Lock()
+        self.respond = lambda path, body: (202, None)
+
+    @property
+    def url(self): return f"http://127.0.0.1:{self.server_address[1]}"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock: self.server.requests.append((self.path, dict(self.headers), body))
+        status, reply = self.server.respond(self.path, body)
+        data = json.dumps(reply).encode() if reply is not None else b""
+        self.send_response(status); self.send_header("Content-Length", str(len(data))); self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args): pass
+
+@pytest.fixture
+def provider(monkeypatch):
+    server = FakeProvider()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(emailer, "SENDGRID_API_URL", server.url)
+    monkeypatch.setattr(emailer, "POSTMARK_API_URL", server.url)
+    monkeypatch.setenv("SENDGRID_API_KEY", "sg-test"); monkeypatch.setenv("POSTMARK_TOKEN", "pm-test")
+    yield server
+    server.shutdown(); server.server_close()
+
+def _msg(to, subject="Receipt", attachment=b"%PDF-1"):
+    return {"to": to, "subject": subject, "html": "<p>hi</p>", "attachment": attachment, "filename": "r.pdf"}
+
+def test_sendgrid_groups_identical_messages(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "sendgrid")
+    msgs = [_msg("a@x.org"), _msg("b@x.org"), _msg("c@x.org", subject="Statement")]
+    res = emailer.send_bulk(msgs)
+    assert [r["to"] for r in res] == ["a@x.org", "b@x.org", "c@x.org"] and all(r["sent"] for r in res)
+    assert len(provider.requests) == 2
+    by_subject = {body["subject"]: body for _, _, body in provider.requests}
+    assert [p["to"][0]["email"] for p in by_subject["Receipt"]["personalizations"]] == ["a@x.org", "b@x.org"]
+    path, headers, _ = provider.requests[0]
+    assert path == "/v3/mail/send" and headers["Authorization"] == "Bearer sg-test"
+
+def test_sendgrid_batches_at_provider_limit(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "sendgrid"); monkeypatch.setattr(emailer, "SENDGRID_BATCH", 2)
+    res = emailer.send_bulk([_msg(f"{i}@x.org") for i in range(5)])
+    assert all(r["sent"] for r in res)
+    assert sorted(len(b["personalizations"]) for _, _, b in provider.requests) == [1, 2, 2]
+
+def test_sendgrid_error_marks_the_whole_request(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "sendgrid")
+    provider.respond = lambda path, body: (400, {"errors": [{"message": "bad"}]}) if body["subject"] == "Bad" else (202, None)
+    res = emailer.send_bulk([_msg("a@x.org", "Bad"), _msg("b@x.org"), _msg("c@x.org", "Bad")])
+    assert [(r["sent"], r["error"]) for r in res] == [(False, "HTTP 400"), (True, None), (False, "HTTP 400")]
+
+def test_postmark_reports_each_message(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "postmark")
+    provider.respond = lambda path, body: (200, [{"ErrorCode": 0 if m["To"] != "bad@x.org" else 300, "Message": "Invalid email"} for m in body])
+    res = emailer.send_bulk([_msg("a@x.org"), _msg("bad@x.org"), _msg("c@x.org")])
+    assert [(r["sent"], r["error"]) for r in res] == [(True, None), (False, "Invalid email"), (True, None)]
+    (path, headers, body), = provider.requests
+    assert path == "/email/batch" and headers["X-Postmark-Server-Token"] == "pm-test" and len(body) == 3
+
+def test_postmark_splits_batches(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "postmark"); monkeypatch.setattr(emailer, "POSTMARK_BATCH", 2)
+    provider.respond = lambda path, body: (200, [{"ErrorCode": 0} for _ in body])
+    assert all(r["sent"] for r in emailer.send_bulk([_msg(f"{i}@x.org") for i in range(5)]))
+    assert sorted(len(b) for _, _, b in provider.requests) == [1, 2, 2]
+
+def test_unconfigured_provider_sends_nothing(provider, monkeypatch):
+    monkeypatch.setattr(emailer, "PROVIDER", "sendgrid"); monkeypatch.delenv("SENDGRID_API_KEY")
+    res = emailer.send_bulk([_msg("a@x.org")])
+    assert res == [{"to": "a@x.org", "sent": False, "error": "not configured"}] and not provider.requests
+
+def test_empty_batch(provider):
+    assert emailer.send_bulk([]) == [] and not provider.requests
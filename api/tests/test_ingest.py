@@ -0,0 +1,58 @@
+import os
+from services.ingest import CsvTail
+
+HEADER = "donation_id,donor_id,amount\n"
+
+def _write(path, text, mode="w"):
+    with open(path, mode, newline="") as f: f.write(text)
+
+def test_first_poll_reads_everything(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\ng2,d2,20.00\n")
+    rebuilt, rows = CsvTail(str(p)).poll()
+    assert rebuilt and [r["donation_id"] for r in rows] == ["g1", "g2"]
+
+def test_append_returns_only_new_rows(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    _write(p, "g2,d2,20.00\ng3,d3,30.00\n", "a")
+    rebuilt, rows = tail.poll()
+    assert not rebuilt and [r["donation_id"] for r in rows] == ["g2", "g3"]
+    assert rows[0]["amount"] == "20.00" and tail.rows == 3
+    assert tail.poll() == (False, [])
+
+def test_partial_line_waits_for_newline(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    _write(p, "g2,d2,2", "a")
+    assert tail.poll() == (False, [])
+    _write(p, "0.00\n", "a")
+    assert [r["amount"] for r in tail.poll()[1]] == ["20.00"]
+
+def test_in_place_edit_of_consumed_bytes_rebuilds(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\ng2,d2,20.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    with open(p, "r+b") as f: f.seek(len(HEADER) + 6); f.write(b"9")   # same size, same inode
+    rebuilt, rows = tail.poll()
+    assert rebuilt and [r["amount"] for r in rows] == ["90.00", "20.00"]
+
+def test_truncate_rebuilds(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\ng2,d2,20.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    _write(p, HEADER + "g3,d3,5.00\n")
+    rebuilt, rows = tail.poll()
+    assert rebuilt and [r["donation_id"] for r in rows] == ["g3"] and tail.rows == 1
+
+def test_replaced_file_rebuilds(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    tmp = tmp_path / "donations.csv.new"; _write(tmp, HEADER + "g1,d1,10.00\ng2,d2,20.00\n")
+    os.replace(tmp, p)
+    rebuilt, rows = tail.poll()
+    assert rebuilt and [r["donation_id"] for r in rows] == ["g1", "g2"]
+
+def test_missing_file_reports_rebuild_once(tmp_path):
+    p = tmp_path / "donations.csv"; _write(p, HEADER + "g1,d1,10.00\n")
+    tail = CsvTail(str(p)); tail.poll()
+    os.remove(p)
+    assert tail.poll() == (True, [])
+    assert tail.poll() == (False, [])
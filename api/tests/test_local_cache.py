@@ -0,0 +1,40 @@
+import time
+from cache import redis_cache
+from cache.local_cache import LocalLRU
+
+def test_evicts_least_recently_used_by_bytes():
+    lru = LocalLRU(max_bytes=10, max_item_bytes=10)
+    lru.set("a", b"aaaa", "ea", 60); lru.set("b", b"bbbb", "eb", 60)
+    assert lru.get("a") == (b"aaaa", "ea")   # a is now the most recent
+    lru.set("c", b"cccc", None, 60)
+    assert lru.get("b") is None and lru.get("a") and lru.get("c")
+    assert lru.stats()["bytes"] == 8 and lru.stats()["evictions"] == 1
+
+def test_oversized_and_expired_entries():
+    lru = LocalLRU(max_bytes=100)   # items over a quarter of the tier are never admitted
+    lru.set("big", b"x" * 26, None, 60); lru.set("small", b"x" * 25, None, 0.01)
+    assert lru.get("big") is None
+    time.sleep(0.02)
+    assert lru.get("small") is None and lru.stats()["bytes"] == 0
+
+def test_replacing_a_key_keeps_the_byte_count():
+    lru = LocalLRU(max_bytes=100)
+    lru.set("k", b"12345", None, 60); lru.set("k", b"12", None, 60)
+    assert lru.get("k") == (b"12", None) and lru.stats()["bytes"] == 2
+
+def test_invalidation_messages_drop_a_key_or_a_prefix(monkeypatch):
+    lru = LocalLRU(max_bytes=1000); monkeypatch.setattr(redis_cache, "_local", lru)
+    for k in ("g1", "g2"): lru.set(("receipt", k), b"pdf", None, 60)
+    for k in ("d1:2024", "d1:2025", "d2:2025"): lru.set(("statement", k), b"pdf", None, 60)
+    redis_cache._drop_local({"kind": "receipt", "key": "g1"})
+    redis_cache._drop_local({"kind": "statement", "prefix": "d1:"})
+    assert [k for k in (("receipt", "g1"), ("receipt", "g2"), ("statement", "d1:2024"), ("statement", "d2:2025"))
+            if lru.get(k)] == [("receipt", "g2"), ("statement", "d2:2025")]
+
+def test_local_tier_is_bypassed_until_subscribed(monkeypatch):
+    lru = LocalLRU(max_bytes=1000); lru.set(("receipt", "g1"), b"pdf", "e", 60)
+    monkeypatch.setattr(redis_cache, "_local", lru); monkeypatch.setattr(redis_cache, "_ensure_listener", lambda: None)
+    monkeypatch.setattr(redis_cache, "_subscribed", type(redis_cache._subscribed)())
+    assert redis_cache._get_local("receipt", "g1") is None
+    redis_cache._subscribed.set()
+    assert redis_cache._get_local("receipt", "g1") == (b"pdf", "e")
@@ -0,0 +1,59 @@
+import time
+import pytest
+from services import outbox as ob
+
+@pytest.fixture
+def box(tmp_path, monkeypatch):
+    """An Outbox with no sender threads, drained by hand through a recording send_bulk."""
+    monkeypatch.setattr(ob, "OUTBOX_WORKERS", 0)
+    sent, fail = [], set()
+    def send_bulk(msgs):
+        sent.extend(msgs)
+        return [{"sent": m["to"] not in fail, "error": "bounced" if m["to"] in fail else None} for m in msgs]
+    monkeypatch.setattr(ob, "send_bulk", send_bulk)
+    box = ob.Outbox(str(tmp_path / "outbox.db"))
+    box.sent, box.fail = sent, fail
+    return box
+
+def _row(box, key):
+    return box._conn().execute("SELECT * FROM outbox WHERE key=?", (key,)).fetchone()
+
+def test_send_and_dedupe(box):
+    assert box.enqueue("receipt:g1", "a@x.org", "Receipt", "<p>hi</p>")[1:] == ("pending", True)
+    assert box.enqueue("receipt:g1", "a@x.org", "Receipt", "<p>hi</p>")[1:] == ("pending", False)
+    assert box.drain_once() == 1 and [m["to"] for m in box.sent] == ["a@x.org"]
+    assert box.enqueue("receipt:g1", "a@x.org", "Receipt", "<p>hi</p>")[1:] == ("sent", False)
+    assert box.drain_once() == 0 and box.stats["deduped"] == 2 and box.metrics()["depth"] == 0
+
+def test_key_is_sendable_again_after_the_dedupe_window(box, monkeypatch):
+    box.enqueue("k", "a@x.org", "s", "h"); box.drain_once()
+    monkeypatch.setattr(ob, "OUTBOX_DEDUPE_SEC", 0)
+    assert box.enqueue("k", "b@x.org", "s", "h")[1:] == ("pending", True)
+    box.drain_once()
+    assert [m["to"] for m in box.sent] == ["a@x.org", "b@x.org"]
+
+def test_failed_send_backs_off_then_goes_dead(box, monkeypatch):
+    monkeypatch.setattr(ob, "OUTBOX_MAX_ATTEMPTS", 2)
+    box.fail.add("a@x.org"); box.enqueue("k", "a@x.org", "s", "h")
+    box.drain_once()
+    row = _row(box, "k")
+    assert row["status"] == "pending" and row["attempts"] == 1 and row["next_at"] > time.time() + 20
+    assert box.drain_once() == 0   # not due yet
+    box._conn().execute("UPDATE outbox SET next_at=0")
+    box.drain_once()
+    assert _row(box, "k")["status"] == "dead" and _row(box, "k")["last_error"] == "bounced"
+    assert box.stats["retried"] == 1 and box.stats["dead"] == 1
+
+def test_expired_lease_is_reclaimed(box, monkeypatch):
+    box.enqueue("k", "a@x.org", "s", "h")
+    assert len(box._claim()) == 1 and box._claim() == []   # held by a worker that then died
+    box._conn().execute("UPDATE outbox SET lease_until=?", (time.time() - 1,))
+    assert box.drain_once() == 1 and _row(box, "k")["status"] == "sent"
+
+def test_attachment_is_resolved_at_send_time(box, monkeypatch):
+    monkeypatch.setattr(ob, "_resolvers", {"receipt": lambda ref: (b"%PDF-" + ref.encode(), f"{ref}.pdf")})
+    box.enqueue("k", "a@x.org", "s", "h", ref=("receipt", "g1"))
+    box.enqueue("k2", "b@x.org", "s", "h", ref=("statement", "d1:2025"))   # no resolver registered
+    box.drain_once()
+    assert [(m["to"], m["attachment"], m["filename"]) for m in box.sent] == [("a@x.org", b"%PDF-g1", "g1.pdf")]
+    assert _row(box, "k2")["status"] == "pending" and _row(box, "k2")["last_error"].startswith("attachment:")
@@ -0,0 +1,35 @@
+import io, re, zlib, base64
+from services import receipts
+from services.datastore import DonationRow
+from services.statement_writer import write_itemized_statement, write_itemized_rows, read_itemized_rows, render_itemized_statement_file
+
+def _text(pdf: bytes) -> bytes:
+    """Decoded page and form content streams (reportlab writes them ASCII85 over Flate)."""
+    out = []
+    for m in re.finditer(rb"/Filter \[ /ASCII85Decode /FlateDecode \].*?stream\r?\n(.*?)endstream", pdf, re.S):
+        out.append(zlib.decompress(base64.a85decode(m.group(1).strip(), adobe=True)))
+    return b"\n".join(out)
+
+def test_receipt_draws_header_and_footer_through_the_static_form():
+    pdf = receipts.generate_receipt_pdf(receipt_id="R1", donor_name="Ada", donation_amount=12.5, donation_date="2025-01-02",
+                                        designation="Music", restricted=False, payment_method="Card")
+    text = _text(pdf)
+    assert pdf.count(b"/Subtype /Form") == 1 and receipts.ORG_NAME.encode() in text
+    assert b"No goods or services" in text and b"Issued 2025-01-02" in text
+
+def test_statement_pages_share_one_static_form():
+    rows = [{"received_at": "2025-01-01", "donation_id": f"g{i}", "amount": "1.00"} for i in range(200)]
+    buf = io.BytesIO()
+    assert write_itemized_statement(buf, "Ada", "d1", 2025, rows) > 1
+    text = _text(buf.getvalue())
+    assert buf.getvalue().count(b"/Subtype /Form") == 1 and text.count(receipts.ORG_NAME.encode()) == 1
+
+def test_itemized_rows_round_trip_through_a_file_in_date_order(tmp_path):
+    rows = [DonationRow({"donation_id": "g2", "amount": "20", "received_at": "2025-03-01T09:00:00", "method": "card"}),
+            DonationRow({"donation_id": "g1", "amount": "10.5", "received_at": "2025-01-01T09:00:00", "designation": "Music"})]
+    assert write_itemized_rows(str(tmp_path / "rows.csv"), rows) == 2
+    assert [(r["donation_id"], r["amount"], r["designation"]) for r in read_itemized_rows(str(tmp_path / "rows.csv"))] == \
+        [("g1", "10.50", "Music"), ("g2", "20.00", "")]
+    assert render_itemized_statement_file(str(tmp_path / "s.pdf"), "d1", 2025, "Ada", str(tmp_path / "rows.csv"), None, 3050) == 1
+    text = _text((tmp_path / "s.pdf").read_bytes())
+    assert b"g1" in text and b"$30.50" in text and text.index(b"g1") < text.index(b"g2")
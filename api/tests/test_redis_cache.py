@@ -0,0 +1,36 @@
+import fakeredis
+import pytest
+from cache import redis_cache as rc
+from cache.admission import sketch_keys
+from cache.etag import pdf_etag
+from cache.local_cache import LocalLRU
+
+PDF = b"%PDF-1.4 receipt g1"
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = fakeredis.FakeRedis(); monkeypatch.setattr(rc, "r", fake)
+    monkeypatch.setattr(rc, "LOCAL_CACHE_MAX_BYTES", 0); monkeypatch.setattr(rc, "_local", LocalLRU(0))
+    return fake
+
+def _sketch(fake):
+    return [fake.get(k) for k in sketch_keys()]
+
+def test_unadmitted_receipt_still_revalidates(fake):
+    assert rc.get_cached_receipt_pdf("g1") is None   # first request: counted once, below the bar
+    rc.cache_receipt_pdf("g1", PDF)
+    assert fake.get(rc._at(rc._bkey("receipt", "g1"), b"0")) is None   # body not admitted
+    assert rc.get_receipt_etag("g1") == pdf_etag(PDF)
+
+def test_etag_reads_do_not_touch_the_sketch(fake):
+    rc.cache_receipt_pdf("g1", PDF); before = _sketch(fake)
+    for _ in range(5): rc.get_receipt_etag("g1")
+    assert _sketch(fake) == before
+    rc.get_cached_receipt_pdf("g1")
+    assert _sketch(fake) != before
+
+def test_etag_follows_the_record_version(fake):
+    rc.cache_receipt_pdf("g1", PDF)
+    rc.bump_versions(donation_ids=["g1"])
+    assert rc.get_receipt_etag("g1") is None
+    assert rc.get_statement_etag("d1", 2025) is None
@@ -0,0 +1,43 @@
+import signal, time
+import pytest
+from services import render_pool as rp
+
+def _wedged(sec):
+    # stands in for a render stuck in C code: the worker's alarm never gets through
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    time.sleep(sec)
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(rp, "RENDER_POOL_SIZE", 1)
+    monkeypatch.setattr(rp, "RENDER_TIMEOUT_SEC", 0.5)
+    monkeypatch.setattr(rp, "RENDER_KILL_GRACE_SEC", 0.5)
+    monkeypatch.setattr(rp, "stats", {"timeouts": 0, "killed": 0, "dropped": 0})
+    rp.wait_pdf(rp.submit_task(time.sleep, 0))   # pay the spawn start-up before timing anything
+    yield rp
+    rp.shutdown_pool()
+
+def test_inline_when_pool_disabled(monkeypatch):
+    monkeypatch.setattr(rp, "RENDER_POOL_SIZE", 0)
+    assert rp.wait_pdf(rp.submit_task(divmod, 7, 2)) == (3, 1) and rp.pool_status()["started"] is False
+
+def test_render_past_its_deadline_times_out(pool):
+    with pytest.raises(rp.RenderTimeout): rp.wait_pdf(rp.submit_task(time.sleep, 5))
+    assert rp.stats["timeouts"] == 1 and rp.stats["killed"] == 0
+
+def test_deadline_counts_from_start_not_from_submit(pool):
+    futs = [rp.submit_task(time.sleep, 0.3) for _ in range(3)]   # 0.9s of work on one worker, 0.5s deadline each
+    assert [rp.wait_pdf(f) for f in futs] == [None, None, None]
+
+def test_wedged_worker_is_killed_and_replaced(pool):
+    t0 = time.monotonic()
+    with pytest.raises(rp.RenderTimeout): rp.wait_pdf(rp.submit_task(_wedged, 30))
+    assert time.monotonic() - t0 < 5 and rp.stats["killed"] == 1
+    assert rp.wait_pdf(rp.submit_task(divmod, 7, 2)) == (3, 1)
+
+def test_render_queued_too_long_is_dropped(pool, monkeypatch):
+    monkeypatch.setattr(rp, "RENDER_QUEUE_TIMEOUT_SEC", 0.1)
+    first, second = rp.submit_task(time.sleep, 0.3), rp.submit_task(time.sleep, 0)
+    assert rp.wait_pdf(first) is None
+    with pytest.raises(rp.RenderUnavailable): rp.wait_pdf(second)
+    assert rp.stats["dropped"] == 1
@@ -0,0 +1,50 @@
+import threading, time
+import fakeredis
+import pytest
+from cache import redis_cache, single_flight as sf
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = fakeredis.FakeRedis(); monkeypatch.setattr(redis_cache, "r", fake)
+    monkeypatch.setattr(sf, "FLIGHT_POLL_SEC", 0.01)
+    return fake
+
+def test_hit_skips_build(redis):
+    assert sf.single_flight("k", lambda: b"cached", lambda: pytest.fail("built"), lambda pdf: None) == (b"cached", True)
+
+def test_concurrent_callers_share_one_build(redis):
+    cache, builds, gate = {}, [], threading.Event()
+    def build():
+        builds.append(1); gate.wait(2); return b"pdf"
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(sf.single_flight("k", lambda: cache.get("k"), build,
+                                                                           lambda pdf: cache.__setitem__("k", pdf))))
+               for _ in range(5)]
+    for t in threads: t.start()
+    time.sleep(0.1); gate.set()
+    for t in threads: t.join()
+    assert len(builds) == 1 and out == [(b"pdf", False)] * 5 and cache == {"k": b"pdf"}
+    assert not redis.exists(sf._lock_key("k")) and sf._flights == {}
+
+def test_waits_for_another_workers_render(redis):
+    redis.set(sf._lock_key("k"), "other-worker", px=5000)
+    cache = {}
+    threading.Timer(0.05, lambda: cache.__setitem__("k", b"theirs")).start()
+    assert sf.single_flight("k", lambda: cache.get("k"), lambda: pytest.fail("built"), lambda pdf: None) == (b"theirs", True)
+
+def test_renders_when_the_holder_gives_up(redis):
+    redis.set(sf._lock_key("k"), "other-worker", px=5000)
+    threading.Timer(0.05, lambda: redis.delete(sf._lock_key("k"))).start()
+    assert sf.single_flight("k", lambda: None, lambda: b"mine", lambda pdf: None) == (b"mine", False)
+
+def test_build_error_reaches_every_caller_and_clears_the_flight(redis):
+    def build(): raise RuntimeError("render failed")
+    with pytest.raises(RuntimeError): sf.single_flight("k", lambda: None, build, lambda pdf: None)
+    assert sf._flights == {} and not redis.exists(sf._lock_key("k"))
+
+def test_redis_down_still_renders(monkeypatch):
+    class Down:
+        def set(self, *a, **kw): raise ConnectionError("down")
+        def eval(self, *a, **kw): raise ConnectionError("down")
+    monkeypatch.setattr(redis_cache, "r", Down())
+    assert sf.single_flight("k", lambda: None, lambda: b"pdf", lambda pdf: None) == (b"pdf", False)
@@ -0,0 +1,66 @@
+import os
+import pytest
+from services import datastore
+from services.snapshot import SnapshotStore, SnapshotFile, build_snapshot
+
+ROWS = ("donation_id,org_id,donor_id,amount,received_at,receipt_id,square_payment_id,designation\n"
+        "g1,spark,d1,10.00,2025-06-01T10:00:00,r1,sq1,Music\n"
+        "g2,spark,d1,20.50,2025-01-02T10:00:00,r2,sq2,\n"
+        "g3,other,d2,5.00,2024-03-01T10:00:00,r3,sq3,Music\n")
+
+def _write(path, text):
+    with open(path, "w", newline="") as f: f.write(text)
+
+def _bump(path):
+    st = os.stat(path); os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    seen = []
+    monkeypatch.setattr(datastore, "_change_listeners", [lambda d, n: seen.append((set(d), set(n)))])
+    _write(tmp_path / "donations.csv", ROWS)
+    _write(tmp_path / "donors.csv", "donor_id,primary_contact_name,email\nd1,Ada,ada@x.org\nd2,Bea,bea@x.org\n")
+    return tmp_path, seen
+
+def test_build_and_read_back(data):
+    tmp_path, _ = data
+    stats = build_snapshot(str(tmp_path), str(tmp_path / "s.snap"))
+    f = SnapshotFile(str(tmp_path / "s.snap"))
+    assert stats["donations"] == 3 and stats["donors"] == 2
+    assert f.donation(f.lookup("donation_id", "g2")[0])["amount"] == "20.50"
+    assert f.lookup("donation_id", "missing").size == 0
+
+def test_lookups_and_donor_order(data):
+    tmp_path, seen = data
+    store = SnapshotStore(str(tmp_path))
+    assert store.donation("g1").cents == 1000 and store.donation_by_receipt("r3")["donation_id"] == "g3"
+    assert store.donation_by_payment("sq2")["donation_id"] == "g2" and store.donor("d2")["email"] == "bea@x.org"
+    assert [r["donation_id"] for r in store.donations_for_donor("d1")] == ["g2", "g1"]   # by received_at
+    assert [r["donation_id"] for r in store.donations_for_org("spark")] == ["g1", "g2"]
+    assert [r["donation_id"] for r in store.donations_for_donor("d2", 2025)] == []
+    assert store.giving_summary("d1", 2025)[:2] == (3050, 2) and seen == []
+
+def test_workers_share_one_build_and_rebuild_on_change(data):
+    tmp_path, seen = data
+    a, b = SnapshotStore(str(tmp_path)), SnapshotStore(str(tmp_path))
+    a.donations(); ino = os.stat(tmp_path / "spark.snap").st_ino
+    assert len(b.donations()) == 3 and os.stat(tmp_path / "spark.snap").st_ino == ino
+    _write(tmp_path / "donations.csv", ROWS.replace("g3,other,d2,5.00", "g3,other,d2,7.00")); _bump(tmp_path / "donations.csv")
+    assert a.donation("g3").cents == 700 and b.donation("g3").cents == 700
+    assert seen == [({"g3"}, {"d2"})]   # announced by the worker that rebuilt, not by both
+
+def test_decoded_rows_are_memoized_per_file(data):
+    tmp_path, _ = data
+    store = SnapshotStore(str(tmp_path))
+    assert store.donations() is store.donations() and store.donors() is store.donors()
+    _write(tmp_path / "donations.csv", ROWS + "g4,spark,d2,1.00,2025-05-01T10:00:00,r4,sq4,\n"); _bump(tmp_path / "donations.csv")
+    assert [r["donation_id"] for r in store.donations()] == ["g1", "g2", "g3", "g4"]
+
+def test_replaced_mapping_is_closed_once_its_last_reader_leaves(data):
+    tmp_path, _ = data
+    store = SnapshotStore(str(tmp_path))
+    with store._reading() as old:
+        _write(tmp_path / "donations.csv", ROWS.replace("20.50", "21.50")); _bump(tmp_path / "donations.csv")
+        assert store.donation("g2").cents == 2150
+        assert old.retired and not old.mm.closed and old.donation(0)["donation_id"] == "g1"
+    assert old.mm.closed and not store._file.mm.closed
@@ -0,0 +1,44 @@
+import os
+import pytest
+from services import datastore
+from services.sqlite_store import SqliteStore
+
+ROWS = ("donation_id,org_id,donor_id,amount,received_at,receipt_id,square_payment_id\n"
+        "g1,spark,d1,10.00,2024-12-31T10:00:00,r1,sq1\n"
+        "g2,spark,d1,20.50,2025-01-02T10:00:00,r2,sq2\n"
+        "g3,other,d2,5.00,2025-03-01T10:00:00,r3,sq3\n")
+
+def _write(path, text):
+    with open(path, "w", newline="") as f: f.write(text)
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    seen = []
+    monkeypatch.setattr(datastore, "_change_listeners", [lambda d, n: seen.append((set(d), set(n)))])
+    _write(tmp_path / "donations.csv", ROWS)
+    _write(tmp_path / "donors.csv", "donor_id,primary_contact_name,email\nd1,Ada,ada@x.org\nd2,Bea,bea@x.org\n")
+    return tmp_path, seen
+
+def test_import_and_lookups(data):
+    tmp_path, seen = data
+    store = SqliteStore(str(tmp_path))
+    assert store.donation("g2").cents == 2050 and store.donation_by_receipt("r3")["donation_id"] == "g3"
+    assert store.donation_by_payment("sq1")["donation_id"] == "g1" and store.donor("d2")["email"] == "bea@x.org"
+    assert [r["donation_id"] for r in store.donations_for_donor("d1", 2025)] == ["g2"]
+    assert [r["donation_id"] for r in store.donations_between("2025-01-01", "2026-01-01", org_id="spark")] == ["g2"]
+    assert store.count("donations") == 3 and store.count("donors") == 2
+    assert seen == []   # a first import has nothing cached to invalidate
+
+def test_second_store_reuses_the_import(data):
+    tmp_path, _ = data
+    SqliteStore(str(tmp_path)).donations()
+    other = SqliteStore(str(tmp_path))
+    assert other._meta("csv_sig") == other._csv_sig() and len(other.donations()) == 3
+
+def test_reimport_replaces_rows_and_reports_changes(data):
+    tmp_path, seen = data
+    store = SqliteStore(str(tmp_path)); store.donations()
+    _write(tmp_path / "donations.csv", ROWS.replace("g3,other,d2,5.00", "g3,other,d2,7.00") + "g4,spark,d2,1.00,2025-05-01,r4,sq4\n")
+    st = os.stat(tmp_path / "donations.csv"); os.utime(tmp_path / "donations.csv", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert store.donation("g3").cents == 700 and store.count("donations") == 4
+    assert seen == [({"g3", "g4"}, {"d2"})]
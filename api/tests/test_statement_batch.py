@@ -0,0 +1,126 @@
+import fakeredis
+import pytest
+from cache import redis_cache
+from services import statement_batch as sb
+
+YEAR = 2025
+
+@pytest.fixture
+def batch(monkeypatch):
+    """statement_batch over fakeredis with ten donors, a fake renderer and a recording mailer."""
+    monkeypatch.setattr(redis_cache, "r", fakeredis.FakeRedis())
+    donors = [{"donor_id": f"d{i:02d}", "primary_contact_name": f"Donor {i}", "email": f"d{i}@x.org"} for i in range(10)]
+    monkeypatch.setattr(sb, "group_statements", lambda year, shard=None: (
+        [d for d in donors if shard is None or sb.shard_of(d["donor_id"], shard[1]) == shard[0]],
+        {d["donor_id"]: 1000 for d in donors}, {d["donor_id"]: [] for d in donors}))
+    monkeypatch.setattr(sb, "statement_args", lambda donor, year, cents, breakdown: {"donor_id": donor["donor_id"]})
+    monkeypatch.setattr(sb, "render_many", lambda jobs: [f"%PDF-{kw['donor_id']}".encode() for kw in jobs])
+    monkeypatch.setattr(sb, "RENDER_POOL_SIZE", 1)   # four donors per chunk
+    sent = []
+    def send_bulk(msgs):
+        sent.extend(m["to"] for m in msgs)
+        return [{"to": m["to"], "sent": True, "error": None} for m in msgs]
+    monkeypatch.setattr(sb, "send_bulk", send_bulk)
+    return donors, sent
+
+def test_runs_to_done_in_one_call(batch):
+    donors, sent = batch
+    status = sb.run_statement_batch(YEAR)
+    assert status["state"] == "done" and status["generated"] == status["emailed"] == 10
+    assert sorted(sent) == sorted(d["email"] for d in donors)
+
+def test_paused_run_resumes_from_checkpoint(batch):
+    donors, sent = batch
+    first = sb.run_statement_batch(YEAR, budget=0)
+    assert first["state"] == "paused" and first["cursor"] == "d03" and first["processed"] == 4
+    assert sb.batch_status(YEAR)["cursor"] == "d03"
+    second = sb.run_statement_batch(YEAR, budget=0)
+    assert second["state"] == "paused" and second["cursor"] == "d07" and second["resumes"] == 1
+    third = sb.run_statement_batch(YEAR, budget=0)
+    assert third["state"] == "done" and third["processed"] == third["emailed"] == 10
+    # every donor mailed exactly once across the three calls
+    assert sorted(sent) == sorted(d["email"] for d in donors)
+
+def test_done_year_is_not_resent_without_restart(batch):
+    _, sent = batch
+    sb.run_statement_batch(YEAR)
+    again = sb.run_statement_batch(YEAR)
+    assert again["state"] == "done" and len(sent) == 10
+    restarted = sb.run_statement_batch(YEAR, restart=True)
+    assert restarted["state"] == "done" and restarted["resumes"] == 0 and len(sent) == 20
+
+def test_concurrent_run_is_refused(batch):
+    redis_cache.r.set(sb._lock_key(YEAR), "other-worker")
+    assert sb.run_statement_batch(YEAR)["busy"] is True
+
+def test_failed_run_resumes_after_last_checkpoint(batch, monkeypatch):
+    donors, sent = batch
+    render, calls = sb.render_many, []
+    def flaky(jobs):
+        calls.append(len(jobs))
+        if len(calls) == 2: raise RuntimeError("pool gone")
+        return render(jobs)
+    monkeypatch.setattr(sb, "render_many", flaky)
+    monkeypatch.setattr(sb, "EMAIL_BULK_FLUSH", 4)   # checkpoint after every chunk
+    failed = sb.run_statement_batch(YEAR)
+    assert failed["state"] == "failed" and failed["cursor"] == "d03" and failed["error"] == "pool gone"
+    done = sb.run_statement_batch(YEAR)
+    assert done["state"] == "done" and sorted(sent) == sorted(d["email"] for d in donors)
+
+def test_unflushed_emails_are_not_checkpointed(batch, monkeypatch):
+    donors, sent = batch
+    render = sb.render_many
+    monkeypatch.setattr(sb, "render_many", lambda jobs: render(jobs) if jobs[0]["donor_id"] == "d00" else 1 / 0)
+    failed = sb.run_statement_batch(YEAR)
+    # the first chunk's emails were still buffered, so the cursor must not have moved past them
+    assert failed["state"] == "failed" and failed["cursor"] is None and not sent
+    monkeypatch.setattr(sb, "render_many", render)
+    assert sb.run_statement_batch(YEAR)["state"] == "done" and sorted(sent) == sorted(d["email"] for d in donors)
+
+def test_shards_cover_every_donor_once(batch):
+    donors, sent = batch
+    for i in range(3): assert sb.run_statement_batch(YEAR, shard=(i, 3))["state"] == "done"
+    assert sorted(sent) == sorted(d["email"] for d in donors)
+
+def test_failed_render_is_retried_before_done(batch, monkeypatch):
+    donors, sent = batch
+    render = sb.render_many
+    monkeypatch.setattr(sb, "render_many", lambda jobs: [None if kw["donor_id"] == "d05" else pdf
+                                                         for kw, pdf in zip(jobs, render(jobs))])
+    first = sb.run_statement_batch(YEAR)
+    assert first["state"] == "incomplete" and first["failed"] == {"d05": {"stage": "render", "attempts": 1}}
+    assert first["generated"] == 9 and first["render_failed"] == 1 and "d5@x.org" not in sent
+    monkeypatch.setattr(sb, "render_many", render)
+    second = sb.run_statement_batch(YEAR)
+    assert second["state"] == "done" and second["failed"] == {}
+    assert second["processed"] == second["generated"] == second["emailed"] == 10 and sent.count("d5@x.org") == 1
+
+def test_failed_email_is_retried_without_resending_the_rest(batch, monkeypatch):
+    donors, sent = batch
+    send = sb.send_bulk
+    bounce = {"d2@x.org", "d7@x.org"}
+    monkeypatch.setattr(sb, "send_bulk", lambda msgs: [dict(r, sent=r["to"] not in bounce) for r in send(msgs)])
+    first = sb.run_statement_batch(YEAR)
+    assert first["state"] == "incomplete" and sorted(first["failed"]) == ["d02", "d07"]
+    assert first["emailed"] == 8 and first["email_failed"] == 2
+    bounce.discard("d2@x.org")
+    second = sb.run_statement_batch(YEAR)
+    assert second["state"] == "incomplete" and second["failed"] == {"d07": {"stage": "email", "attempts": 2}}
+    assert sent[10:] == ["d2@x.org", "d7@x.org"] and second["generated"] == 10 and second["emailed"] == 9
+    bounce.clear()
+    assert sb.run_statement_batch(YEAR)["state"] == "done" and len(sent) == 13
+
+def test_retries_stop_at_max_attempts(batch, monkeypatch):
+    _, sent = batch
+    monkeypatch.setattr(sb, "BATCH_MAX_ATTEMPTS", 2)
+    send = sb.send_bulk
+    monkeypatch.setattr(sb, "send_bulk", lambda msgs: [dict(r, sent=r["to"] != "d1@x.org") for r in send(msgs)])
+    for _ in range(4): status = sb.run_statement_batch(YEAR)
+    assert status["state"] == "incomplete" and status["failed"]["d01"]["attempts"] == 2
+    assert sent.count("d1@x.org") == 2 and not sb.retryable(status)
+
+def test_shard_task_raises_while_failures_are_retryable(batch, monkeypatch):
+    monkeypatch.setattr(sb, "render_many", lambda jobs: [None for _ in jobs])
+    with pytest.raises(RuntimeError, match="outstanding"):
+        sb.run_shard({"year": YEAR, "shard": 0, "shards": 1, "run_id": "r", "chain": "c", "part": 0})
+    assert sb.batch_status(YEAR, (0, 1))["state"] == "incomplete"
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routes import statements
+from services import task_queue
+
+SHARD = "/tasks/year-end-statements/shard"
+TASK = {"year": 2025, "shard": 1, "shards": 4, "run_id": "abc123", "chain": "c0ffee", "part": 2}
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+    monkeypatch.setattr(statements, "run_shard", lambda payload: calls.append(payload) or {"state": "done"})
+    app = FastAPI(); app.include_router(statements.router)
+    c = TestClient(app); c.calls = calls
+    return c
+
+def test_refused_when_no_task_auth_is_configured(client, monkeypatch):
+    monkeypatch.setattr(task_queue, "TASKS_SHARED_SECRET", ""); monkeypatch.setattr(task_queue, "TASKS_SERVICE_ACCOUNT", "")
+    assert client.post(SHARD, json=TASK).status_code == 401 and not client.calls
+
+def test_shared_secret(client, monkeypatch):
+    monkeypatch.setattr(task_queue, "TASKS_SHARED_SECRET", "s3cret")
+    assert client.post(SHARD, json=TASK, headers={"X-Tasks-Secret": "wrong"}).status_code == 401
+    r = client.post(SHARD, json=TASK, headers={"X-Tasks-Secret": "s3cret"})
+    assert r.status_code == 200 and client.calls == [TASK]
+
+@pytest.mark.parametrize("body", [{}, {**TASK, "shard": 4}, {**TASK, "shards": 0}, {**TASK, "year": "soon"},
+                                  {k: v for k, v in TASK.items() if k != "run_id"}, [TASK]])
+def test_malformed_payload_is_a_client_error(client, monkeypatch, body):
+    monkeypatch.setattr(task_queue, "TASKS_SHARED_SECRET", "s3cret")
+    assert client.post(SHARD, json=body, headers={"X-Tasks-Secret": "s3cret"}).status_code == 422
+    assert not client.calls
+
+def test_oidc_token_must_name_the_task_service_account(client, monkeypatch):
+    pytest.importorskip("google.oauth2.id_token")
+    from google.oauth2 import id_token
+    monkeypatch.setattr(task_queue, "TASKS_SHARED_SECRET", "")
+    monkeypatch.setattr(task_queue, "TASKS_SERVICE_ACCOUNT", "tasks@proj.iam.gserviceaccount.com")
+    monkeypatch.setattr(task_queue, "TASKS_OIDC_AUDIENCE", "https://api.example.org")
+    seen = []
+    def verify(token, request, audience):
+        seen.append(audience)
+        if token == "bad": raise ValueError("Token has wrong signature")
+        return {"email": "tasks@proj.iam.gserviceaccount.com" if token == "good" else "other@x.org", "email_verified": True}
+    monkeypatch.setattr(id_token, "verify_oauth2_token", verify)
+    for token, code in (("bad", 401), ("other", 401), ("good", 200)):
+        assert client.post(SHARD, json=TASK, headers={"Authorization": f"Bearer {token}"}).status_code == code
+    assert seen == ["https://api.example.org"] * 3 and client.calls == [TASK]
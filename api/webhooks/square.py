@@ -3,7 +3,11 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Optional
 from fastapi import APIRouter, Request, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from webhooks.security import verify_square_webhook, check_timestamp, rate_limit, idem_check, idem_store, process_lock
+from services.datastore import get_store, data_dir
+from services.aggregates import get_refund_ledger
+from cache.redis_cache import bump_versions
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -22,6 +26,8 @@ def process_square_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
             return process_payment_updated(event_data)
         elif event_type == "refund.created":
             return process_refund_created(event_data)
+        elif event_type == "refund.updated":
+            return process_refund_updated(event_data)
         elif event_type == "invoice.payment_made":
             return process_invoice_payment(event_data)
         else:
@@ -103,6 +109,19 @@ def process_payment_updated(event_data: Dict[str, Any]) -> Dict[str, Any]:
 
 def process_refund_created(event_data: Dict[str, Any]) -> Dict[str, Any]:
     """Process refund.created events from Square"""
+    return process_refund(event_data, "refund_created")
+
+def process_refund_updated(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Process refund.updated events from Square (a PENDING refund completing, or being rejected/failing)"""
+    return process_refund(event_data, "refund_updated")
+
+def process_refund(event_data: Dict[str, Any], action: str) -> Dict[str, Any]:
+    """Records a refund in the ledger once Square reports it COMPLETED.
+
+    refund.created usually arrives while the refund is still PENDING; the refund.updated that
+    follows carries the final status. COMPLETED is terminal, so nothing recorded is ever reversed,
+    and REJECTED or FAILED refunds never touch the totals.
+    """
     try:
         refund_data = event_data.get("data", {}).get("object", {}).get("refund", {})
         
@@ -115,20 +134,35 @@ def process_refund_created(event_data: Dict[str, Any]) -> Dict[str, Any]:
             "created_at": refund_data.get("created_at")
         }
         
-        logger.info(f"Square refund created: ${refund_info['amount']:.2f} for payment {refund_info['payment_id']}")
+        logger.info(f"Square refund {refund_info['refund_id']} {refund_info['status']}: ${refund_info['amount']:.2f} "
+                    f"for payment {refund_info['payment_id']}")
+        
+        donation = get_store().donation_by_payment(refund_info["payment_id"]) if refund_info["payment_id"] else None
+        recorded = False
+        if donation and refund_info["refund_id"] and refund_info["status"] == "COMPLETED":
+            # net the refund out of the donor's yearly giving aggregates
+            recorded = get_refund_ledger(data_dir()).record(refund_info["refund_id"], donation,
+                                                            int(refund_data.get("amount_money", {}).get("amount", 0)),
+                                                            refund_info["created_at"])
         
-        # Process refund - update donation records, send notifications
+        # Retire the refunded gift's cached receipt and its donor's statements once the totals change
+        if recorded:
+            bump_versions([donation["donation_id"]], [donation.get("donor_id", "")])
+            logger.info(f"Invalidated cached PDFs for donation {donation['donation_id']}")
         
         return {
             "status": "processed",
-            "action": "refund_created",
+            "action": action,
+            "refund_status": refund_info["status"],
             "refund_id": refund_info["refund_id"],
             "payment_id": refund_info["payment_id"],
-            "amount": refund_info["amount"]
+            "amount": refund_info["amount"],
+            "donation_id": donation["donation_id"] if donation else None,
+            "recorded": recorded
         }
         
     except Exception as e:
-        logger.error(f"Error processing refund.created event: {str(e)}")
+        logger.error(f"Error processing {action.replace('_', '.')} event: {str(e)}")
         raise
 
 def process_invoice_payment(event_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -204,8 +238,8 @@ async def square_webhook(request: Request,
         raise HTTPException(status_code=409, detail="Processing in progress")
     
     try:
-        # Process the event
-        result = process_square_event(data)
+        # Process the event off the event loop; refunds take a file lock and append to the ledger
+        result = await run_in_threadpool(process_square_event, data)
         result["event_id"] = event_id
         result["processed_at"] = datetime.utcnow().isoformat()
         
@@ -64,8 +64,11 @@ export interface ReceiptRequest {
   donation_id: string;
 }
 
+// The email is queued in the API's outbox and sent in the background; there is no synchronous "sent" flag.
 export interface EmailReceiptResponse {
-  sent: boolean;
+  queued: boolean;       // false when the same receipt email is already queued or was sent recently
+  message_id: number;
+  status: 'pending' | 'sending' | 'sent';
 }
 
 // Health check types